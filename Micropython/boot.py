@@ -1,3 +1,3 @@
 import libraries.vsys as vsys
 
-vsys.get_vsys()
+vsys.start()    # VSYS im Hintergrund überwachen (vsys.monitor), blockiert den Start nicht
@@ -0,0 +1,326 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# ACK im Servicemode: der Dekoder quittiert mit einem Stromimpuls von mind.
+# 60 mA für 6 ms +/- 1 ms (NMRA S-9.2.3)
+#
+# Wie SHORTDETECTOR bekommt ACKDETECTOR von SAMPLER jeden neuen Block von
+# Rohwerten (0..65535 wie read_u16()) und rechnet nur mit ganzen Zahlen:
+#
+#   learn()  Ruhestrom und Rauschen lernen (gleitende Mittel), z.B. während RESET;
+#            learn(True) lernt vom bisherigen Stand aus weiter (Drift verfolgen),
+#            valid() sagt, ob genug gelernt ist, forget() verwirft alles; mit dem
+#            Rauschen aus der Kalibrierung (preset()) reichen LEARN_FAST Werte
+#   arm()    Ruhestrom einfrieren, Schwelle = NOISE_FACTOR x Rauschen, begrenzt auf
+#            [min_delta, max_delta]; ab hier zählt 'n' die Werte (Zeitbasis für
+#            den Beginn des Impulses relativ zum ersten Paket)
+#   feed()   steigende Flanke = DEBOUNCE Werte in Folge über der Schwelle, fallende
+#            Flanke = DEBOUNCE Werte unter der halben Schwelle (Hysterese)
+#
+# Ein Impuls zählt als ACK, wenn er mind. min_us und höchstens max_us lang ist;
+# kürzere sind Störungen (die Erkennung läuft weiter), längere eine Laststufe
+# (kein ACK, fertig).
+#
+# ----------------------------------------------------------------------
+
+from micropython import const
+
+IDLE = const(0)
+LEARN = const(1)
+ARMED = const(2)
+HIGH = const(3)
+DONE = const(4)
+
+
+class ACKDETECTOR:
+
+    DEBOUNCE = const(3)         # Werte in Folge für eine Flanke (bei 5 kS/s 0,6 ms)
+    NOISE_FACTOR = const(4)     # Schwelle in Vielfachen des mittleren Rauschens
+    LEARN_SAMPLES = const(32)   # so viele Werte braucht ein gültiger Ruhestrom ...
+    LEARN_FAST = const(8)       # ... und mit bekanntem Rauschen
+
+    def __init__(self, rate, min_delta, max_delta, min_us=5000, max_us=12000):
+        self.us_per_sample = 1000000 // rate
+        self.limits(min_delta, max_delta)
+        self.min_samples = min_us // self.us_per_sample
+        self.max_samples = max_us // self.us_per_sample
+        self.threshold = max_delta
+        self.noise_floor = 0            # Rauschen lt. Kalibrierung, 0 = unbekannt
+        self.forget()
+        self.clear()
+
+    def limits(self, min_delta, max_delta):
+        self.min_delta = min_delta      # Schwelle (Rohwert über dem Ruhestrom) mindestens ...
+        self.max_delta = max_delta      # ... und höchstens
+
+    def clear(self):
+        self.n = 0
+        self.run = 0
+        self.start = 0
+        self.acked = False
+        self.width_us = 0
+        self.start_us = 0
+        self.rejected = 0       # verworfene Störimpulse
+
+    def learn(self, keep=False):
+        if not keep:
+            self.baseline = -1
+            self.learned = 0
+        self.state = LEARN
+
+    def valid(self):
+        return self.learned >= (self.LEARN_FAST if self.noise_floor else self.LEARN_SAMPLES)
+
+    # Rauschen (Rohwert) aus der Kalibrierung als Startwert
+    def preset(self, noise):
+        self.noise_floor = noise
+
+    def forget(self):
+        self.state = IDLE
+        self.baseline = -1
+        self.noise = self.noise_floor
+        self.learned = 0
+
+    def arm(self):
+        threshold = self.NOISE_FACTOR * self.noise
+        self.threshold = max(self.min_delta, min(self.max_delta, threshold))
+        self.clear()
+        self.state = ARMED
+
+    def stop(self):
+        self.state = IDLE
+
+    # Impuls läuft gerade
+    def busy(self):
+        return self.state == HIGH
+
+    # ACK erkannt oder Laststufe - weitere Pakete sind nicht nötig
+    def done(self):
+        return self.state == DONE
+
+    def feed(self, samples, shift=0, start=0, end=None):
+        state = self.state
+        if state == IDLE or state == DONE:
+            return
+        if end == None:
+            end = len(samples)
+        if state == LEARN:
+            baseline = self.baseline
+            noise = self.noise
+            for i in range(start, end):
+                s = samples[i] << shift
+                if baseline < 0:
+                    baseline = s
+                    noise = self.noise_floor
+                baseline += (s - baseline) >> 4
+                noise += (abs(s - baseline) - noise) >> 4
+            self.baseline = baseline
+            self.noise = noise
+            if self.learned < self.LEARN_SAMPLES:
+                self.learned += end - start
+            return
+        rise = self.baseline + self.threshold
+        fall = self.baseline + (self.threshold >> 1)
+        n = self.n
+        run = self.run
+        for i in range(start, end):
+            s = samples[i] << shift
+            n += 1
+            if state == ARMED:
+                if s >= rise:
+                    run += 1
+                    if run >= self.DEBOUNCE:
+                        self.start = n - run
+                        state = HIGH
+                        run = 0
+                else:
+                    run = 0
+            else:
+                if s < fall:
+                    run += 1
+                    if run >= self.DEBOUNCE:
+                        width = n - run - self.start
+                        run = 0
+                        if width < self.min_samples:
+                            self.rejected += 1
+                            state = ARMED
+                        else:
+                            state = self.finish(width)
+                            break
+                else:
+                    run = 0
+                    if n - self.start > self.max_samples:
+                        state = self.finish(n - self.start)
+                        break
+        self.n = n
+        self.run = run
+        self.state = state
+
+    def finish(self, width):
+        self.width_us = width * self.us_per_sample
+        self.start_us = self.start * self.us_per_sample
+        self.acked = width <= self.max_samples
+        return DONE
+
+
+if __name__ == "__main__":
+    # ms je geprüftem Bit, bisher (chk_ack: 200 x read_u16() mit Gleitkomma-Glättung
+    # nach Paket 4..6, dann warten bis der Strom wieder fällt) gegen ACKDETECTOR, an
+    # derselben nachgespielten Stromkurve: Ruhestrom mit Rauschen, ein Störimpuls
+    # (2 ms, 80 mA) und ggf. das ACK des Dekoders (6 ms, 70 bzw. 150 mA) 1 ms nach
+    # dem zweiten Prüfpaket. Die bisherige Glättung läuft gegen den halben
+    # Messwert, ein ACK mit 70 mA erscheint dort also nur mit ca. 35 mA.
+    #
+    # Die Zeit ist virtuell: put() blockiert wie die TX-FIFO (4 Worte) und das Gleis
+    # sendet mit den Bitlängen der Statemachine; ein Messwert kostet die CPU so
+    # viel, wie die Schleife hier auf diesem Rechner tatsächlich braucht, und zum
+    # Vergleich 20 bzw. 40 µs (angenommen, MicroPython auf dem RP2040).
+    import utime
+    import machine
+    from classes.sampler import SAMPLER
+    from classes.hbridge import DRV8871
+    from classes.encoder import DCCENCODER
+    from classes.recorder import RECORDER
+
+    FIFO = 4
+    driver = DRV8871(28, 29, 3)
+    rate = SAMPLER.RATE
+    us_per_sample = 1000000 // rate
+    RESET = [0xffffffff, 0xf0000001]
+    packet = list(DCCENCODER.encode([0b01111000, 28, 0b11101011], 24))   # Bit 3 von CV29 = 1?
+
+    class TRACK:
+        def __init__(self, ack, sample_us):      # ack = Höhe des ACK in mA, 0 = keins
+            self.ack = ack
+            self.sample_us = sample_us
+            self.clock = 0              # CPU
+            self.ends = []              # Sendeende je Wort
+            self.ack_start = None
+            self.verify_packets = 0
+
+        def put(self, words):
+            if type(words) == int:
+                words = (words,)
+            for word in words:
+                if len(self.ends) >= FIFO:
+                    self.clock = max(self.clock, self.ends[-FIFO])
+                start = max(self.clock, self.ends[-1] if self.ends else 0)
+                self.ends.append(start + RECORDER.airtime(word))
+            if list(words) == packet:
+                self.verify_packets += 1
+                if self.verify_packets == 2 and self.ack:
+                    self.ack_start = self.ends[-1] + 1000
+
+        def current(self, t):
+            mA = 40 + (t * 7919 // 1000) % 9 - 4                # Ruhestrom mit Rauschen
+            if 3000 <= t - (self.ends[9] if len(self.ends) > 9 else 10 ** 9) < 5000:
+                mA += 80                                         # Störimpuls nach den RESETs
+            if self.ack_start != None and self.ack_start <= t < self.ack_start + 6000:
+                mA += self.ack
+            return driver.mA2raw(mA)
+
+        # wie machine.ADC.read_u16(), kostet CPU-Zeit
+        def read_u16(self):
+            self.clock += self.sample_us
+            return self.current(self.clock)
+
+        def finish(self):
+            return max(self.clock, self.ends[-1])
+
+    # bisher: send2track() mit chk_ack()
+    def old_verify(track):
+        def get_current():
+            value = 0
+            peak = 0
+            for i in range(200):
+                value = (track.read_u16() - value) * 0.175 + value * (1 - 0.175)
+                peak = max(value, peak)
+            return driver.raw2mA(round(peak))
+
+        def chk_ack(quiescent_current):
+            return get_current() - quiescent_current >= 40
+
+        quiescent_current = get_current()
+        ack = False
+        for i in range(5):
+            track.put(RESET)
+        for i in range(6):
+            track.put(packet)
+            if i > 2:
+                ack |= chk_ack(quiescent_current)
+                if ack:
+                    while chk_ack(quiescent_current):
+                        pass
+                    break
+        for i in range(3):
+            track.put(RESET)
+        return ack, None
+
+    # neu: wie ELECTRICAL_SM.send2track(), SAMPLER liest die Werte per DMA (hier aus
+    # der Stromkurve bis zur aktuellen Zeit) und kostet nur die Auswertung
+    class REPLAY(SAMPLER):
+        def process(self):
+            track = self.track
+            samples = []
+            while self.t + us_per_sample <= track.clock:
+                self.t += us_per_sample
+                samples.append(track.current(self.t))
+            track.clock += len(samples) * self.cost_us
+            return self.feed(samples)
+
+    def new_verify(track, cost_us):
+        detector = ACKDETECTOR(rate, driver.mA2raw(15) - driver.mA2raw(0), driver.mA2raw(40) - driver.mA2raw(0))
+        sampler = REPLAY(26, machine.ADC(machine.Pin(26)), detector=detector)
+        sampler.track = track
+        sampler.t = 0
+        sampler.cost_us = cost_us
+        detector.learn()
+        for i in range(5):
+            track.put(RESET)
+            sampler.update()
+        detector.arm()
+        for i in range(6):
+            track.put(packet)
+            sampler.update()
+            if detector.busy() or detector.done():
+                break
+        while detector.busy():
+            track.put(RESET)
+            sampler.update()
+        for i in range(3):
+            track.put(RESET)
+        return detector.acked, detector
+
+    # CPU-Kosten je Messwert auf diesem Rechner
+    adc = machine.ADC(machine.Pin(26))
+    t = utime.ticks_us()
+    value = 0
+    peak = 0
+    for i in range(2000):
+        value = (adc.read_u16() - value) * 0.175 + value * (1 - 0.175)
+        peak = max(value, peak)
+    old_us = utime.ticks_diff(utime.ticks_us(), t) / 2000
+    detector = ACKDETECTOR(rate, 100, 1000)
+    detector.arm()
+    block = [1000] * 2000
+    t = utime.ticks_us()
+    detector.feed(block)
+    new_us = utime.ticks_diff(utime.ticks_us(), t) / 2000
+
+    print(f"je Messwert hier: bisher {old_us:.2f} µs, neu {new_us:.2f} µs")
+    for label, old_cost, new_cost in (("gemessen", old_us, new_us), ("20 µs", 20, new_us * 20 / old_us),
+                                      ("40 µs", 40, new_us * 40 / old_us)):
+        for ack in (70, 150, 0):
+            track = TRACK(ack, old_cost)
+            result, info = old_verify(track)
+            t_old = track.finish() / 1000
+            track = TRACK(ack, old_cost)
+            result_new, detector = new_verify(track, new_cost)
+            t_new = track.finish() / 1000
+            print(f"{label:<8} {f'ACK {ack:>3} mA' if ack else 'kein ACK  '}: bisher {t_old:6.1f} ms ({'ACK' if result else 'kein ACK':<8}), "
+                  f"neu {t_new:6.1f} ms ({'ACK' if result_new else 'kein ACK':<8}, Impuls {detector.width_us:>4} µs "
+                  f"ab {detector.start_us / 1000:4.1f} ms, Schwelle {driver.raw2mA(detector.threshold) + driver.offset} mA, "
+                  f"{detector.rejected} Störimpuls verworfen)")
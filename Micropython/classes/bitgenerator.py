@@ -1,5 +1,8 @@
 import rp2
 import machine
+import uctypes
+from array import array
+from micropython import const
 
 # Statemachine zum Erzeugen von NMRA-DCC-Pulsen
 #
@@ -25,14 +28,41 @@ import machine
 #  L  | PWM | Rückwärts
 #  L  |  L  | Stop
 #  H  |  H  | nicht definiert
+#
+# DMA-Betrieb (dma=True):
+# Ein Datenkanal schiebt den aktiven Puffer, getaktet vom TX-DREQ der Statemachine,
+# in die TX-FIFO. Ist er durch, startet er per chain_to einen Steuerkanal, der die
+# Adresse des aktiven Puffers aus 'dma_pointer' in READ_ADDR_TRIG des Datenkanals
+# schreibt - der Puffer läuft so endlos ohne CPU.
+# Zwei Puffer (vorn/hinten): neue Rahmen werden hinten aufgebaut (frame_begin(),
+# put(), frame_end()) und durch Tausch des Zeigers aktiviert. Der hintere Puffer
+# darf erst wieder beschrieben werden, wenn der Datenkanal den neuen vorderen
+# übernommen hat (ready()).
+# Die Puffer fassen anfangs DMA_WORDS Worte. Braucht ein Rahmen mehr, legt reserve()
+# den hinteren vor frame_begin() größer an (nie kleiner, er wird ja nicht gelesen);
+# fehlt dafür der Speicher, liefert es False und der Rahmen muss kürzer werden.
+#
+# Backend (backend=...): statt in die TX-FIFO gehen die Worte an backend.put(),
+# z.B. an einen RECORDER (classes/recorder.py), der sie mit Zeitstempel aufzeichnet.
+# Mit Backend gibt es keinen DMA-Betrieb, der Rahmen würde ja nie gesendet.
 
+PIO0_TXF0 = const(0x50200010)          # TX-FIFO von PIO0, SM0
+DMA_BASE = const(0x50000000)
+DMA_CH_SIZE = const(0x40)
+DMA_AL3_READ_ADDR_TRIG = const(0x3c)
+DREQ_PIO0_TX0 = const(0)
+TREQ_UNPACED = const(0x3f)
 
 
 class BITGENERATOR():
     # Ausgangszustand = nix!
     statemachine = None
+    DMA_WORDS = 2048                   # anfängliche Kapazität je Puffer im DMA-Betrieb (32-Bit-Worte)
+    
+    # IDLE: preamble 0 11111111 0 00000000 0 11111111 1
+    IDLE = (0b11111111111111111111111111111111, 0b11110111111110000000000111111111)
     
-    def __init__(cls, base_pin=None, model="LMD18200T"):
+    def __init__(cls, base_pin=None, model="LMD18200T", dma=False, backend=None):
         if base_pin == None:
             raise(ValueError("Kein Basis-Pin für die Ausgabe"))
         if model == "DRV8871":
@@ -42,19 +72,126 @@ class BITGENERATOR():
         else:
             raise(ValueError(f"{model} unbekannt"))
         cls.model = model
+        cls.backend = backend
+        if backend != None:
+            dma = False
+        cls.dma = dma
+        cls.data_channel = None
+        cls.control_channel = None
+        if dma:
+            cls.buffers = [array('I', bytes(4 * cls.DMA_WORDS)), array('I', bytes(4 * cls.DMA_WORDS))]
+            cls.addresses = [uctypes.addressof(cls.buffers[0]), uctypes.addressof(cls.buffers[1])]
+            cls.lengths = [0, 0]
+            cls.front = 0
+            cls.back_len = 0
+            cls.dma_pointer = array('I', [cls.addresses[0]])
         
     def begin(cls):
         cls.statemachine.active(1)
         if (cls.model == 'DRV8871'):
             cls.statemachine.exec('set(pins, 0b00)')
+        if cls.dma:
+            cls.dma_begin()
         
     def end(cls):
+        if cls.dma:
+            cls.dma_end()
         if cls.model == "DRV8871":
             cls.statemachine.exec('set(pins, 0b00)')
         cls.statemachine.active(0)
 
-    def put(cls, word):
-        cls.statemachine.put(word)
+    # Wort oder Puffer blockierend in die FIFO, im DMA-Betrieb an den hinteren Puffer anhängen
+    def put(cls, words):
+        if not cls.dma:
+            if cls.backend != None:
+                cls.backend.put(words)
+            else:
+                cls.statemachine.put(words)
+            return
+        if type(words) == int:
+            words = (words,)
+        n = len(words)
+        back = cls.buffers[1 - cls.front]
+        if cls.back_len + n > len(back):
+            raise(ValueError("DMA-Puffer zu klein"))     # sh. reserve()
+        for i in range(n):
+            back[cls.back_len + i] = words[i]
+        cls.back_len += n
+
+    # ---------------- DMA-Betrieb -----------------
+    def dma_begin(cls):
+        cls.front = 0
+        cls.buffers[0][0] = cls.IDLE[0]
+        cls.buffers[0][1] = cls.IDLE[1]
+        cls.lengths = [2, 0]
+        cls.dma_pointer[0] = cls.addresses[0]
+        cls.data_channel = rp2.DMA()
+        cls.control_channel = rp2.DMA()
+        trigger = DMA_BASE + cls.data_channel.channel * DMA_CH_SIZE + DMA_AL3_READ_ADDR_TRIG
+        ctrl = cls.control_channel.pack_ctrl(size=2, inc_read=False, inc_write=False, treq_sel=TREQ_UNPACED)
+        cls.control_channel.config(read=cls.dma_pointer, write=trigger, count=1, ctrl=ctrl)
+        ctrl = cls.data_channel.pack_ctrl(size=2, inc_read=True, inc_write=False, treq_sel=DREQ_PIO0_TX0,
+                                          chain_to=cls.control_channel.channel)
+        cls.data_channel.config(read=cls.buffers[0], write=PIO0_TXF0, count=2, ctrl=ctrl, trigger=True)
+
+    def dma_end(cls):
+        if cls.control_channel != None:
+            cls.control_channel.active(0)
+            cls.control_channel.close()
+            cls.control_channel = None
+        if cls.data_channel != None:
+            cls.data_channel.active(0)
+            cls.data_channel.close()
+            cls.data_channel = None
+
+    # hat der Datenkanal den vorderen Puffer übernommen? Dann ist der hintere frei.
+    def ready(cls):
+        if not cls.dma or cls.data_channel == None:
+            return True
+        start = cls.addresses[cls.front]
+        return start <= cls.data_channel.read <= start + 4 * cls.lengths[cls.front]
+
+    # hinteren Puffer für mindestens 'words' Worte auslegen, nur nach ready()
+    def reserve(cls, words):
+        if not cls.dma:
+            return True
+        back = 1 - cls.front
+        if len(cls.buffers[back]) >= words:
+            return True
+        try:
+            cls.buffers[back] = array('I', bytes(4 * words))
+        except MemoryError:
+            return False
+        cls.addresses[back] = uctypes.addressof(cls.buffers[back])
+        return True
+
+    def frame_begin(cls):
+        cls.back_len = 0
+
+    # hinteren Puffer aktivieren, er wird ab dem nächsten Durchlauf gesendet
+    def frame_end(cls):
+        if not cls.dma:
+            return
+        back = 1 - cls.front
+        if cls.back_len == 0:
+            cls.put(cls.IDLE)
+        n = cls.back_len
+        cls.lengths[back] = n
+        if cls.data_channel == None:
+            cls.front = back
+            cls.dma_pointer[0] = cls.addresses[back]
+            return
+        # Zähler und Zeiger so setzen, dass ein Wechsel genau dazwischen den Rahmen
+        # höchstens kürzt, aber nie über das Pufferende hinaus liest
+        state = machine.disable_irq()
+        if n <= cls.lengths[cls.front]:
+            cls.data_channel.count = n
+            cls.dma_pointer[0] = cls.addresses[back]
+        else:
+            cls.dma_pointer[0] = cls.addresses[back]
+            cls.data_channel.count = n
+        machine.enable_irq(state)
+        cls.front = back
 
 # 0 = 100µs = 50 Takte, 1 = 58µs = 29 Takte
 # für DDRV8871 H-Bridge-Modul
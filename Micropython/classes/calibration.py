@@ -0,0 +1,172 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Kalibrierung der Strommessung
+#
+# Mit eingeschaltetem, leerem Gleis misst CALIBRATOR den Ruhestrom (Mittelwert)
+# und das Rauschen (mittlere Abweichung davon), optional danach mit einer
+# bekannten Last (z.B. Widerstand am Gleis) die Steigung. CALIBRATOR hängt wie
+# SHORTDETECTOR am Datenstrom von SAMPLER (add_detector()) und rechnet im
+# Timer-Callback nur mit ganzen Zahlen:
+#
+#   Phase 1: 'count' Werte summieren -> Mittelwert
+#   Phase 2: 'count' Abweichungen vom Mittelwert summieren -> Rauschen
+#
+# CALIBRATION hält die Ergebnisse je H-Brücke in einer kleinen JSON-Datei im
+# Flash, ELECTRICAL und ELECTRICAL_SM lesen sie beim Start:
+#
+#   {"DRV8871": {"offset": 12, "noise": 3, "gain": 1.0}, ...}
+#
+#   offset  Ruhestrom in mA (ersetzt QUIESCENT_CURRENT der H-Brücke)
+#   noise   Rauschen in mA (Grundlage für ACK- und Lok-Erkennung)
+#   gain    Korrektur der Steigung (1.0 = lt. Datenblatt)
+#
+# ----------------------------------------------------------------------
+
+import json
+from micropython import const
+
+MEAN = const(1)
+NOISE = const(2)
+DONE = const(3)
+
+
+class CALIBRATOR:
+
+    def __init__(self, count=2048):
+        self.count = count      # Werte je Phase (bis 16384, Summe unter 2**30)
+        self.start()
+
+    def start(self):
+        self.state = MEAN
+        self.n = 0
+        self.total = 0
+        self.mean = 0           # Rohwert 16 Bit wie read_u16()
+        self.noise = 0
+
+    def done(self):
+        return self.state == DONE
+
+    def feed(self, samples, shift=0, start=0, end=None):
+        state = self.state
+        if state == DONE:
+            return
+        if end == None:
+            end = len(samples)
+        n = self.n
+        total = self.total
+        mean = self.mean
+        for i in range(start, end):
+            s = samples[i] << shift
+            if state == MEAN:
+                total += s
+            else:
+                total += abs(s - mean)
+            n += 1
+            if n >= self.count:
+                if state == MEAN:
+                    self.mean = mean = total // n
+                    state = NOISE
+                else:
+                    self.noise = total // n
+                    state = DONE
+                    break
+                n = 0
+                total = 0
+        self.n = n
+        self.total = total
+        self.state = state
+
+
+class CALIBRATION:
+
+    FILE = "calibration.json"
+
+    def __init__(self, path=FILE):
+        self.path = path
+        self.data = {}
+
+    # gespeicherte Werte lesen, ohne Datei bleibt alles leer
+    @classmethod
+    def load(cls, path=FILE):
+        calibration = cls(path)
+        try:
+            with open(path) as f:
+                calibration.data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        return calibration
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.data, f)
+
+    # {"offset", "noise", "gain"} der H-Brücke oder None
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, offset=None, noise=None, gain=None):
+        values = self.data.get(name, {"offset": None, "noise": None, "gain": 1.0})
+        if offset != None:
+            values["offset"] = offset
+        if noise != None:
+            values["noise"] = noise
+        if gain != None:
+            values["gain"] = gain
+        self.data[name] = values
+        return values
+
+    # gespeicherte Werte an die H-Brücke (HBRIDGE.calibrate()), Rauschen in mA oder None
+    def apply(self, driver):
+        values = self.get(driver.NAME)
+        if values == None or values["offset"] == None:
+            return None
+        driver.calibrate(values["offset"], values["gain"])
+        return values["noise"]
+
+    # Messung aus CALIBRATOR übernehmen: ohne 'load_mA' Ruhestrom und Rauschen am leeren
+    # Gleis, sonst die Steigung an einer Last mit 'load_mA' (über dem Ruhestrom)
+    def update(self, driver, calibrator, load_mA=None):
+        mA = driver.raw2mA(calibrator.mean) + driver.offset     # mit Ruhestrom
+        if load_mA == None:
+            noise = driver.raw2mA(calibrator.noise) - driver.raw2mA(0)
+            values = self.set(driver.NAME, offset=mA, noise=max(1, noise), gain=driver.gain)
+        else:
+            if mA - driver.offset <= 0:
+                raise(ValueError("Keine Last gemessen"))
+            ratio = load_mA / (mA - driver.offset)
+            values = self.set(driver.NAME, offset=round(driver.offset * ratio), gain=driver.gain * ratio)
+            if values["noise"] != None:
+                values["noise"] = max(1, round(values["noise"] * ratio))
+        driver.calibrate(values["offset"], values["gain"])
+        return values
+
+
+if __name__ == "__main__":
+    # Rauschen wie am leeren Gleis, einmal mit CALIBRATOR, einmal mit Gleitkomma nachgerechnet
+    import os
+    import utime
+
+    seed = 4711
+    samples = []
+    for n in range(4096):
+        seed = (seed * 1103515245 + 12345) & 0x7fffffff
+        samples.append((16000 + (seed >> 16) % 400 - 200) >> 4)      # 12 Bit wie im DMA-Ring
+    calibrator = CALIBRATOR(2048)
+    t = utime.ticks_us()
+    for k in range(0, len(samples), 50):
+        calibrator.feed(samples[k:k + 50], 4)
+    t = utime.ticks_diff(utime.ticks_us(), t)
+    values = [s << 4 for s in samples]
+    mean = sum(values[:2048]) / 2048
+    noise = sum(abs(v - int(mean)) for v in values[2048:]) / 2048
+    print(f"Mittel {calibrator.mean} ({mean:.1f}), Rauschen {calibrator.noise} ({noise:.1f}), "
+          f"{'fertig' if calibrator.done() else 'offen'}, {t / len(samples):.2f} µs je Wert")
+    calibration = CALIBRATION("calibration_test.json")
+    calibration.set("DRV8871", offset=12, noise=3)
+    calibration.save()
+    print(CALIBRATION.load("calibration_test.json").get("DRV8871"))
+    os.remove("calibration_test.json")
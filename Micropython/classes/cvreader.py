@@ -0,0 +1,160 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# CVs im Servicemode lesen (Direct Mode, NMRA S 9.2.3)
+#
+# CVREADER fasst die Lese-Varianten der Zentralen und des PC-Programms zusammen:
+#
+#   BITS    8 x verify_bit() und 1 x verify() zur Kontrolle,
+#           bei fehlender Bestätigung bis 'repetitions' Mal von vorn
+#   BYTES   verify() für 0..255 der Reihe nach, je Wert bis 'repetitions' Mal -
+#           für Dekoder, die Bit-Prüfungen nicht beantworten (bis 768 Pakete)
+#   AUTO    beim ersten read() mit test_directmode() entscheiden
+#
+# Jede Prüfung läuft über ask(): Paket senden, ACK abholen, Pakete zählen.
+# 'packets' und 'ms' summieren über alle Lesevorgänge, 'last' hält
+# (Pakete, ms) des letzten; stats() liefert die Werte je CV.
+#
+# Gelesene Werte merkt sich SERVICEMODE bis zum nächsten Schreiben der CV oder
+# Aus-/Einschalten (recall()/remember()); eine erneute Abfrage kommt dann ohne
+# Pakete aus ('hits'). read(cv, fresh=True) liest trotzdem vom Dekoder, z.B. zur
+# Kontrolle nach dem Schreiben.
+#
+#   reader = CVREADER(sm)
+#   cv29 = reader.read(29)      # None, wenn nicht lesbar
+#
+# ----------------------------------------------------------------------
+
+import utime
+from micropython import const
+
+AUTO = const(0)
+BITS = const(1)
+BYTES = const(2)
+
+
+class CVREADER:
+
+    REPETITIONS = 3
+
+    def __init__(self, sm, mode=AUTO, repetitions=REPETITIONS, progress=None):
+        self.sm = sm
+        self.mode = mode
+        self.repetitions = repetitions
+        self.progress = progress        # progress(cv, value) je Wert beim Durchsuchen
+        self.clear()
+
+    def clear(self):
+        self.cvs = 0
+        self.hits = 0
+        self.packets = 0
+        self.ms = 0
+        self.last = (0, 0)
+
+    # eine Prüfung (Byte oder mit 'bit' ein Bit) senden, True bei ACK
+    def ask(self, cv, value, bit=-1):
+        if bit < 0:
+            self.sm.verify(cv, value)
+        else:
+            self.sm.verify_bit(cv, bit, value)
+        self.packets += 1
+        return self.sm.ack()
+
+    # beantwortet der Dekoder Bit-Prüfungen? (CV 8 Bit 7 einmal als 1, einmal als 0)
+    def test_directmode(self):
+        return self.ask(8, 1, 7) ^ self.ask(8, 0, 7)
+
+    # Wert von 'cv' oder None
+    def read(self, cv, fresh=False):
+        if not fresh:
+            value = self.sm.recall(cv)
+            if value != None:
+                self.hits += 1
+                self.last = (0, 0)
+                return value
+        if self.mode == AUTO:
+            self.mode = BITS if self.test_directmode() else BYTES
+        packets = self.packets
+        t = utime.ticks_ms()
+        if self.mode == BITS:
+            value = self.read_bits(cv)
+        else:
+            value = self.scan(cv)
+        self.last = (self.packets - packets, utime.ticks_diff(utime.ticks_ms(), t))
+        self.cvs += 1
+        self.ms += self.last[1]
+        self.sm.remember(cv, value)
+        return value
+
+    # stimmen alle {CV: Wert}? je CV eine Byte-Prüfung, Abbruch beim ersten Fehlschlag
+    def confirm(self, values):
+        for cv in values:
+            if not self.ask(cv, values[cv]):
+                return False
+        for cv in values:
+            self.sm.remember(cv, values[cv])
+        return True
+
+    def read_bits(self, cv):
+        for repetition in range(self.repetitions):
+            value = 0
+            for bit in range(8):
+                if self.ask(cv, 1, bit):
+                    value |= 1 << bit
+            if self.ask(cv, value):
+                return value
+        return None
+
+    def scan(self, cv):
+        for value in range(256):
+            if self.progress != None:
+                self.progress(cv, value)
+            for repetition in range(self.repetitions):
+                if self.ask(cv, value):
+                    return value
+        return None
+
+    # {"cvs", "hits", "packets", "ms", "packets_per_cv", "ms_per_cv"}, Treffer aus
+    # dem Speicher zählen als CV ohne Pakete
+    def stats(self):
+        n = max(1, self.cvs + self.hits)
+        return {"cvs": self.cvs, "hits": self.hits, "packets": self.packets, "ms": self.ms,
+                "packets_per_cv": self.packets / n, "ms_per_cv": self.ms / n}
+
+
+if __name__ == "__main__":
+    # Gleiszeit je CV (RECORDER) für BITS und BYTES gegen einen nachgebildeten Dekoder,
+    # der die aufgezeichneten Prüf-Pakete auswertet und wie ein echter bestätigt
+    from classes.recorder import RECORDER, DECODER
+    from classes.servicemode import SERVICEMODE
+
+    SERVICEMODE.TRACK_BACKEND = RECORDER()
+    sm = SERVICEMODE("DRV8871", 27, 28, 29, 3, 26)
+    sm.begin()
+    sm.loop()   # Einschaltzyklus
+    cvs = {1: 3, 17: 0xc4, 18: 0xd2, 29: 0x26}
+    for label, bits, mode in (("BITS", True, AUTO), ("BYTES", False, AUTO)):
+        decoder = DECODER(sm, cvs, bits)
+        sm.cv_cache.clear()
+        SERVICEMODE.TRACK_BACKEND.clear()
+        reader = CVREADER(decoder, mode)
+        values = [reader.read(cv) for cv in cvs]
+        s = reader.stats()
+        print(f"{label:<6}: {values} {s['packets_per_cv']:.1f} Pakete, "
+              f"{decoder.time_us / 1000 / s['cvs']:.0f} ms je CV (Gleiszeit)")
+    # Sitzung wie im PC-Programm: CV 29 und 1 mehrfach, CV 29 schreiben und kontrollieren
+    session = (29, 1, 29, 17, 18, 1, 29)
+    for label, fresh in (("Sitzung ohne Speicher", True), ("Sitzung mit Speicher", False)):
+        decoder = DECODER(sm, dict(cvs), True)
+        sm.cv_cache.clear()
+        reader = CVREADER(decoder, BITS)
+        for cv in session:
+            reader.read(cv, fresh)
+        decoder.write(29, 0x06)
+        ok = reader.read(29, fresh) == 0x06
+        print(f"{label:<22}: {reader.packets} Pakete, {decoder.time_us / 1000:.0f} ms Gleiszeit, "
+              f"Kontrolle {'OK' if ok else 'FEHLER'}")
+    sm.end()
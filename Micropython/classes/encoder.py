@@ -0,0 +1,148 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# NMRA-DCC Paket-Encoder für Operations- und Servicemode
+#
+# {preamble} 0 [Byte 1] 0 [Byte 2] ... 0 [XOR] 1
+#
+# Der Bitstream wird links mit Einsen auf die Wortgrenze (32 Bit) aufgefüllt
+# und MSB zuerst an die Statemachine geschoben. Für jede Kombination aus
+# Paketlänge und Präambel ist das Bild des Pakets fest:
+#   - Präambel, Padding und Endbit stehen als konstante Worte in der Schablone,
+#   - jedes Byte landet an einer festen Position (Wort, Shift), die
+#     Startbits (0) ergeben sich aus den Lücken der Schablone.
+# Diese Tabellen werden einmal berechnet, kodiert wird nur noch mit ODER.
+#
+# ----------------------------------------------------------------------
+
+from micropython import const
+
+PREAMBLE = const(14)            # Standard Präambel für DCC-Instruktionen
+LONG_PREAMBLE = const(24)       # Präambel f. Servicemode
+MIN_BYTES = const(2)            # Anzahl Bytes ohne XOR
+MAX_BYTES = const(5)
+
+
+class DCCENCODER:
+
+    layouts = {}
+
+    # Schablone und Byte-Positionen für 'nbytes' Bytes (inkl. XOR)
+    @classmethod
+    def make_layout(cls, nbytes, preamble):
+        bits = preamble + nbytes * 9 + 1
+        padding = 32 - (bits % 32)     # links mit 1 erweitern bis Wortgrenze
+        count = (padding + bits) // 32
+        ones = padding + preamble
+        template = []
+        for w in range(count):
+            first = w * 32                 # Bitposition (von links) des Wortes
+            if first + 32 <= ones:
+                word = 0xffffffff
+            elif first < ones:
+                word = (0xffffffff << (32 - (ones - first))) & 0xffffffff
+            else:
+                word = 0
+            template.append(word)
+        template[count - 1] |= 1           # Endbit
+        placements = []
+        for k in range(nbytes):
+            pos = ones + k * 9 + 1         # erstes Datenbit hinter dem Startbit
+            w = pos // 32
+            o = pos % 32
+            if o + 8 <= 32:
+                placements.append((w, 24 - o, -1, 0))
+            else:
+                over = o + 8 - 32
+                placements.append((w, -over, w + 1, 32 - over))
+        return (count, tuple(template), tuple(placements))
+
+    @classmethod
+    def layout(cls, nbytes, preamble=PREAMBLE):
+        key = (nbytes, preamble)
+        l = cls.layouts.get(key)
+        if l == None:
+            l = cls.make_layout(nbytes, preamble)
+            cls.layouts[key] = l
+        return l
+
+    # Anzahl der Worte für ein Paket mit 'length' Bytes (ohne XOR)
+    @classmethod
+    def words(cls, length, preamble=PREAMBLE):
+        if MIN_BYTES <= length <= MAX_BYTES:
+            return cls.layout(length + 1, preamble)[0]
+        return 0
+
+    # kodiert 'packet' (ohne XOR) ab 'pos' in 'buffer', liefert die neue Position
+    @classmethod
+    def encode_into(cls, packet, buffer, pos=0, preamble=PREAMBLE):
+        n = len(packet)
+        if not MIN_BYTES <= n <= MAX_BYTES:
+            return pos
+        err = 0
+        for byte in packet:
+            err ^= byte
+        count, template, placements = cls.layout(n + 1, preamble)
+        for i in range(count):
+            buffer[pos + i] = template[i]
+        for k in range(n + 1):
+            byte = packet[k] if k < n else err
+            w, shift, w2, shift2 = placements[k]
+            if shift >= 0:
+                buffer[pos + w] |= byte << shift
+            else:
+                buffer[pos + w] |= byte >> -shift
+                buffer[pos + w2] |= (byte << shift2) & 0xffffffff
+        return pos + count
+
+    # Paket als Tupel von 32-Bit-Worten
+    @classmethod
+    def encode(cls, packet, preamble=PREAMBLE):
+        buffer = [0] * cls.words(len(packet), preamble)
+        cls.encode_into(packet, buffer, 0, preamble)
+        return tuple(buffer)
+
+
+# Standardfälle vorab berechnen
+for _n in range(MIN_BYTES + 1, MAX_BYTES + 2):
+    DCCENCODER.layout(_n, PREAMBLE)
+DCCENCODER.layout(4, LONG_PREAMBLE)
+
+
+if __name__ == "__main__":
+    import utime
+
+    # Referenz: Ausgabe von prepare()/to_bin() vor Einführung des Encoders
+    GOLDEN = [
+        ("kurze Adresse",   [0x03, 0b01110100],                   PREAMBLE,      (0xffffffff, 0xf019d0ef)),
+        ("Funktionen",      [0x03, 0b10010000],                   PREAMBLE,      (0xffffffff, 0xf01a4127)),
+        ("lange Adresse",   [0xc4, 0xd2, 0x3f, 0b10110100],       PREAMBLE,      (0xffffd88d, 0x21fad13b)),
+        ("AUX",             [0xc4, 0xd2, 0b11011110, 0x81],       PREAMBLE,      (0xffffd88d, 0x26f20493)),
+        ("Zubehör basic",   [0b10000001, 0b11111011],             PREAMBLE,      (0xffffffff, 0xf40becf5)),
+        ("Zubehör extend.", [0b10000001, 0b01110011, 0x05],       PREAMBLE,      (0xffffffe8, 0x139815ef)),
+        ("POM Lok",         [0x03, 0b11101100, 0x02, 0x07],       PREAMBLE,      (0xffffc06e, 0xc0101dd5)),
+        ("POM Zubehör",     [0x81, 0x73, 0xec, 0x02, 0x07],       PREAMBLE,      (0xffffffff, 0xffa04e6e, 0xc0101c37)),
+        ("SM verify",       [0b01110100, 0x1c, 0x06],             LONG_PREAMBLE, (0xffffffe7, 0x40e018dd)),
+        ("SM Bit verify",   [0b01111000, 0x07, 0b11101111],       LONG_PREAMBLE, (0xffffffe7, 0x803bbd21)),
+    ]
+    errors = 0
+    for name, packet, preamble, golden in GOLDEN:
+        words = DCCENCODER.encode(packet, preamble)
+        ok = words == golden
+        errors += 0 if ok else 1
+        print(f"{name:<16} {'OK' if ok else 'FEHLER'}  {[hex(w) for w in words]}")
+    print(f"{errors} Fehler")
+
+    buffer = [0] * 3
+    packets = [g[1] for g in GOLDEN if g[2] == PREAMBLE]
+    n = 0
+    t = utime.ticks_us()
+    for i in range(500):
+        for p in packets:
+            DCCENCODER.encode_into(p, buffer)
+            n += 1
+    t = utime.ticks_diff(utime.ticks_us(), t)
+    print(f"{n} Pakete in {t / 1000} ms = {round(n * 1000000 / t)} Pakete/s")
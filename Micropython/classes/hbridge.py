@@ -0,0 +1,159 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# H-Brücken: Pins zum Ein- und Ausschalten und Umrechnung der Strommessung
+#
+# Jede H-Brücke ist eine Klasse mit ihren Kalibrierwerten. Der Konstruktor
+# rechnet sie einmal in einen ganzzahligen Faktor um:
+#
+#     mA = (raw * scale + half) >> shift  -  offset        (raw = 0..65535 wie read_u16())
+#
+# shift ist so groß wie möglich, ohne dass raw * scale die Grenze der kleinen
+# Ganzzahlen in MicroPython (2**30) überschreitet - raw2mA() fordert also keinen
+# Speicher an und darf auch im Timer-Callback laufen.
+#
+# Eine weitere H-Brücke ist eine weitere Klasse in DRIVERS (und ggf. ein eigenes
+# PIO-Programm in BITGENERATOR, falls sie anders angesteuert wird).
+#
+# ----------------------------------------------------------------------
+
+import machine
+
+SMALL_INT = 1 << 30
+
+
+class HBRIDGE:
+
+    NAME = None
+    AREF_VOLT = 3300                           # mV !!
+    QUIESCENT_CURRENT = 0                      # Ruhestrom in mA (ohne Kalibrierung, sh. classes/calibration.py)
+    MV_PER_MA = 1.0                            # Spannung am ADC je mA Gleisstrom
+    SHORT_MA = 3000                            # harte Grenze der Kurzschluss-Abschaltung ...
+    SHORT_HOLD_US = 1000                       # ... und ihre Haltezeit
+    OVERLOAD_MA = 1000                         # Dauerstrom, darüber läuft das I²t-Konto ...
+    OVERLOAD_I2T = 0.5                         # ... mit so viel A²s (0 = aus), sh. classes/shortdetector.py
+
+    def __init__(self, BRAKE_PIN, PWM_PIN, POWER_PIN):
+        self.brake = machine.Pin(BRAKE_PIN, machine.Pin.OUT)
+        self.pwm = machine.Pin(PWM_PIN, machine.Pin.OUT)
+        self.power = machine.Pin(POWER_PIN, machine.Pin.OUT)
+        self.calibrate(self.QUIESCENT_CURRENT)
+
+    # Ruhestrom in mA und Korrektur der Steigung, z.B. aus CALIBRATION (classes/calibration.py)
+    def calibrate(self, offset, gain=1.0):
+        ma_per_count = self.AREF_VOLT / 65535 / self.MV_PER_MA * gain
+        shift = 0
+        while 65535 * round(ma_per_count * (1 << (shift + 1))) < SMALL_INT:
+            shift += 1
+        self.shift = shift
+        self.scale = round(ma_per_count * (1 << shift))
+        self.half = 1 << (shift - 1) if shift > 0 else 0
+        self.offset = round(offset)
+        self.gain = gain
+
+    # ADC-Rohwert in mA, nur ganze Zahlen
+    def raw2mA(self, raw):
+        return ((raw * self.scale + self.half) >> self.shift) - self.offset
+
+    # Umkehrung von raw2mA(): Strom in mA als ADC-Rohwert, höchstens der Endwert
+    def mA2raw(self, mA):
+        return max(0, min(65535, ((int(mA) + self.offset) << self.shift) // self.scale))
+
+    def on(self):
+        self.brake.value(0)
+        self.pwm.value(1)
+        self.power.value(1)
+
+    # auch aus dem Timer-Callback der Kurzschluss-Abschaltung
+    def off(self):
+        self.brake.value(1)
+        self.pwm.value(0)
+        self.power.value(0)
+
+
+# Logiktabelle:
+# PWM | Dir | Brake | Output
+# ----+-----+-------+-------
+#  H  |  H  |   L   | A1, B2 -> A = VCC, B = GND
+#  H  |  L  |   L   | A2, B1 -> A = GND, B = VCC
+#  L  |  X  |   L   | A1, B1 -> Brake (Motor kurzgeschlossen über VCC
+#  H  |  H  |   H   | A1, B1 -> Brake (Motor kurzgeschlossen über VCC
+#  H  |  L  |   H   | A2, B2 -> Brake (Motor kurzgeschlossen über GND
+#  L  |  X  |   H   | None   -> Power off
+#
+# Dir kommt von der Statemachine, on() = PWM H, Brake L; off() = PWM L, Brake H.
+# Mit dem Sense-Widerstand ist der ADC schon bei ca. 437 mA voll: die harte Grenze
+# liegt damit am Endwert, das I²t-Konto sieht höchstens 437 mA.
+#
+class LMD18200T(HBRIDGE):
+
+    NAME = "LMD18200T"
+    QUIESCENT_CURRENT = 17                     # mA
+    SENS_SHUNT = 20000                         # Ohm
+    SENS_AMPERE_PER_AMPERE = 0.000377          # Empfindlichkeit: 377µA / A lt. Datenblatt +/- 10 %
+    MV_PER_MA = SENS_SHUNT * SENS_AMPERE_PER_AMPERE
+    SHORT_HOLD_US = 2000                       # harte Grenze = Endwert des ADC
+    OVERLOAD_MA = 300
+    OVERLOAD_I2T = 0.05                        # bei vollem ADC (>= 437 mA) ca. 0,5 s
+
+
+# Logiktabelle:
+# IN1 | IN2 | Output
+# ----+-----+-------
+# PWM |  L  | Vorwärts
+#  L  | PWM | Rückwärts
+#  L  |  L  | Stop
+#  H  |  H  | nicht definiert
+#
+# IN1/IN2 kommen von der Statemachine (set(pins, 0b00) = Stop), Brake, PWM und
+# Power schalten die Versorgung der Brücke.
+#
+class DRV8871(HBRIDGE):
+
+    NAME = "DRV8871"
+    QUIESCENT_CURRENT = 13                     # mA
+    MV_PER_MA = 1.0
+    SHORT_HOLD_US = 300                        # Strombegrenzung im Baustein ab 3,6 A
+    OVERLOAD_MA = 1000
+    OVERLOAD_I2T = 0.5                         # 1,5 A ca. 0,4 s, 2 A ca. 0,17 s
+
+
+DRIVERS = {"DRV8871": DRV8871, "LMD18200T": LMD18200T}
+
+
+def hbridge(name, BRAKE_PIN, PWM_PIN, POWER_PIN):
+    if name not in DRIVERS:
+        raise(ValueError(f"H-Brücke {name} unbekannt"))
+    return DRIVERS[name](BRAKE_PIN, PWM_PIN, POWER_PIN)
+
+
+if __name__ == "__main__":
+    # ganzzahlige Umrechnung gegen die bisherige Rechnung mit Gleitkomma
+    import utime
+
+    def raw2mA_float(name, analog_value):
+        analog_value = analog_value * 3300 / 65535
+        if name == "DRV8871":
+            return analog_value - 13.0
+        analog_value /= 20000
+        return (analog_value / 0.000377) - 17.0
+
+    for name in DRIVERS:
+        driver = hbridge(name, 28, 29, 3)
+        error = 0
+        for raw in range(0, 65536, 7):
+            error = max(error, abs(driver.raw2mA(raw) - raw2mA_float(name, raw)))
+        t = utime.ticks_us()
+        for raw in range(1000):
+            driver.raw2mA(raw)
+        t_int = utime.ticks_diff(utime.ticks_us(), t) / 1000
+        t = utime.ticks_us()
+        for raw in range(1000):
+            raw2mA_float(name, raw)
+        t_float = utime.ticks_diff(utime.ticks_us(), t) / 1000
+        print(f"{name:<10} scale {driver.scale} >> {driver.shift}, offset {driver.offset} mA: "
+              f"max. Abweichung {error:.2f} mA, {t_int:.2f} µs statt {t_float:.2f} µs, "
+              f"1000 mA = Rohwert {driver.mA2raw(1000)}")
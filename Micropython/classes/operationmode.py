@@ -416,8 +416,24 @@ class LOCO:
 
 import machine
 from classes.bitgenerator import BITGENERATOR as bitgenerator
+from classes.packetcache import PACKETCACHE
+from classes.encoder import DCCENCODER
+from classes.sampler import SAMPLER, sampler
+from classes.shortdetector import OVERLOAD, overload
+from classes.telemetry import TELEMETRY
+from classes.calibration import CALIBRATION, CALIBRATOR
+from classes.hbridge import hbridge
 from micropython import const
+from array import array
 import utime
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+try:
+    import _thread
+except ImportError:
+    _thread = None
 
 
 DEBUG = False
@@ -426,132 +442,166 @@ DEBUG = False
 class ELECTRICAL:
     
 
-    LMD18200_QUIESCENT_CURRENT = 17.0
-    DRV8871_QUIESCENT_CURRENT = 13.0
-    LMD18200_SENS_SHUNT = 20000                # Ohm
-    AREF_VOLT = 3300                           # mV !!
-    DENOISE_SAMPLES = 200                      # Anzahl der Messzyklen, für Rauschunterdrückung
-    LMD18200_SENS_AMPERE_PER_AMPERE = 0.000377 # Empfindlichkeit: 377µA / A lt. Datenblatt
-    SHORT = 1000                               # erlaubter max. Strom in mA
     PREAMBLE = 14                              # Präambel f. Servicemode
     ACK_TRESHOLD = 40                          # Hub f. Ack
     CURRENT_SMOOTHING = 0.175                  # Glättung der Messergebnisse versuchen
+    PRESENCE_FACTOR = 4                        # Lok erkannt ab so viel x Rauschen über dem Ruhestrom
+    CALIBRATION_SAMPLES = 2048                 # Werte je Phase der Kalibrierung (bei 5 kS/s ca. 0,4 s)
+    PACKET_CACHE_SIZE = 128                    # max. Anzahl kodierter Pakete im Cache
+    USE_DMA = False                            # Gleissignal per DMA aus dem Refresh-Rahmen (opt-in)
+    USE_CORE1 = False                          # Core 1 besitzt Bitgenerator und Refresh-Puffer (opt-in)
+    TRACK_BACKEND = None                       # statt der Statemachine, z.B. RECORDER (classes/recorder.py)
+    
+    # Slots je Lok im Refresh-Puffer: Fahrstufe, 3 Funktionsgruppen F0-F12, 7 AUX-Gruppen F13-F68
+    SLOT_SPEED = const(0)
+    SLOT_FUNCTIONS = const(1)
+    SLOT_AUX = const(4)
+    SLOTS = const(11)
+    
+    # Refresh-Klassen: Fahrstufe in jedem Zyklus, F0-F12 jeden FUNCTION_INTERVAL-ten Zyklus,
+    # AUX-Gruppen nur nach einer Änderung (BURST Wiederholungen) und danach - sofern je
+    # benutzt - jeden AUX_INTERVAL-ten Zyklus. Die Loks sind über die Zyklen verteilt.
+    FUNCTION_INTERVAL = const(4)
+    AUX_INTERVAL = const(16)                   # Vielfaches von FUNCTION_INTERVAL
+    BURST = const(3)
+    
+    # Zeitbudget am Gleis: Bitlängen lt. PIO-Programm 'dccbit' (1 = 2 x 58 µs, 0 = 2 x 100 µs)
+    ONE_US = const(116)
+    ZERO_US = const(200)
+    REFRESH_LIMIT_MS = 1000                    # max. Abstand der Fahrstufen-Pakete an eine Lok
+                                               # (Dekoder mit Packet-Timeout, CV11, halten sonst an)
+    SLOT_WORDS = DCCENCODER.words(4)           # längstes Lok-Paket: lange Adresse + 2 Bytes
+    PACKET_WORDS = DCCENCODER.words(5)         # längstes Paket überhaupt (POM Zubehör)
     
     # IDLE: preamble 0 11111111 0 00000000 0 11111111 1
     IDLE =      [ const(0b11111111111111111111111111111111), const(0b11110111111110000000000111111111) ]
     # RESET: preamble 0 00000000 0 00000000 0 00000000 1
     RESET =     [ const(0b11111111111111111111111111111111), const(0b11110000000000000000000000000001) ]
     
+    # feste Wortpuffer für den Sendepfad
+    IDLE_WORDS = array('I', IDLE)
+    RESET_WORDS = array('I', RESET)
+    # The system has not saved the last state of the layout, therefor it must
+    # send 20 x RESET and 10 x IDLE immediately after power-on
+    STARTUP_WORDS = array('I', RESET * 20 + IDLE * 10)
+    accessory_buffer = array('I', bytes(4 * PACKET_WORDS))  # Accessory-Commands
+    pom_buffer = array('I', bytes(4 * PACKET_WORDS))        # POM-Commands
+    
     locos = []
     devices = []
+    cycle = 0
+    burst_pending = False
+    packet_cache = PACKETCACHE(PACKET_CACHE_SIZE)  # bleibt über power_on() hinweg erhalten
+    
+    # Briefkasten Core 0 -> Core 1: {Ziel: (Funktion, Argumente)}, geschützt durch mailbox_lock.
+    # Eine neue Änderung für dasselbe Ziel (Lok und Slot, Zubehör, POM) ersetzt die alte,
+    # es gilt die letzte - so bleibt er bei Loks x SLOTS + 2 Einträgen. Mehr als MAILBOX_MAX
+    # verschiedene Ziele lässt post() nicht zu, sondern wartet auf den nächsten Zyklus.
+    MAILBOX_MAX = 64
+    mailbox = {}
+    mailbox_lock = None
+    core1_running = False
     
     aux_instructions = [0b11011110, 0b11011111, 0b11011000, 0b11011001, 0b11010010, 0b11011011, 0b11011100]
     # DCC- und H-Bridge-LMD18200T-Modul elektrische Steuerung
     #
-#    @classmethod
+    @classmethod
     def __init__(cls, H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN):
         cls.motordriver = H_BRIDGE  
-        cls.brake = machine.Pin(BRAKE_PIN, machine.Pin.OUT)
-        cls.pwm = machine.Pin(PWM_PIN, machine.Pin.OUT)
-        cls.power = machine.Pin(POWER_PIN, machine.Pin.OUT)
+        cls.driver = hbridge(H_BRIDGE, BRAKE_PIN, PWM_PIN, POWER_PIN)   # Pins und Kalibrierung (classes/hbridge.py)
         cls.dir_pin = machine.Pin(DIR_PIN, machine.Pin.OUT)
         cls.ack = machine.ADC(machine.Pin(ACK_PIN))
-        cls.power_state = cls.power.value()
-        cls.buffer_dirty = False
+        cls.calibration = CALIBRATION.load()        # Ruhestrom, Rauschen, Steigung (classes/calibration.py)
+        cls.noise_mA = cls.calibration.apply(cls.driver)
+        cls.telemetry = TELEMETRY(cls.driver.raw2mA)   # Strom-Verlauf, bleibt über power_on() hinweg erhalten
+        cls.sampler = sampler(ACK_PIN, cls.ack, smoothing=cls.CURRENT_SMOOTHING)   # gemeinsamer Besitzer des ADC
+        cls.short_detector = None
+        cls.power_state = cls.driver.power.value()
+        cls.set_limits()
         cls.emergency = False
         cls.set_initial_state()
 
     @classmethod
     def set_initial_state(cls):
-        cls.ringbuffer = []
-        cls.accessory_buffer = [] # Accessory-Commands
-        cls.pom_buffer = [] # POM-Commands
+        cls.startup_pending = False
+        cls.accessory_len = 0
+        cls.accessory_view = memoryview(cls.accessory_buffer)[0:0]
+        cls.pom_len = 0
+        cls.pom_view = memoryview(cls.pom_buffer)[0:0]
+        cls.frame_dirty = True  # DMA: Refresh-Rahmen neu aufbauen
+        cls.cycle = 0           # Refresh-Zyklus für die Refresh-Klassen
+        cls.burst_pending = False
         cls.locos = [] # active Locos
         cls.accessories = [] # active Accessoires
         
-        cls.statemachine = bitgenerator(cls.dir_pin, model=cls.motordriver)
+        cls.statemachine = bitgenerator(cls.dir_pin, model=cls.motordriver, dma=cls.USE_DMA, backend=cls.TRACK_BACKEND)
 #        cls.statemachine.begin()
-
-        cls.messtimer = utime.ticks_ms()
         
          
-    # LMD18200T
-    # Logiktabelle:
-    # PWM | Dir | Brake | Output
-    # ----+-----+-------+-------
-    #  H  |  H  |   L   | A1, B2 -> A = VCC, B = GND
-    #  H  |  L  |   L   | A2, B1 -> A = GND, B = VCC
-    #  L  |  X  |   L   | A1, B1 -> Brake (Motor kurzgeschlossen über VCC
-    #  H  |  H  |   H   | A1, B1 -> Brake (Motor kurzgeschlossen über VCC
-    #  H  |  L  |   H   | A2, B2 -> Brake (Motor kurzgeschlossen über GND
-    #  L  |  X  |   H   | None   -> Power off
-    #
-    # DRV8871 Logiktabelle:
-    # IN1 | IN2 | Output
-    # ----+-----+-------
-    # PWM |  L  | Vorwärts
-    #  L  | PWM | Rückwärts
-    #  L  |  L  | Stop
-    #  H  |  H  | nicht definiert
+    # Schwellen als Rohwerte aus den (ggf. kalibrierten) Werten der H-Brücke
+    @classmethod
+    def set_limits(cls):
+        cls.connect(False)
+        cls.short_detector = overload(cls.driver, SAMPLER.RATE)   # Kurzschluss und I²t (Grenzen je H-Brücke)
+        cls.connect(cls.power_state == True)
+
+    # Verbraucher am gemeinsamen SAMPLER an- bzw. abmelden (nur solange eingeschaltet)
+    @classmethod
+    def connect(cls, on):
+        cls.sampler.remove_detector(cls.short_detector)
+        if on:
+            cls.sampler.add_detector(cls.short_detector)
+        cls.sampler.telemetry = cls.telemetry if on else None
+
+    # (Lok auf dem Gleis?, Strom in mA); ohne Kalibrierung gilt 'fallback' als Grenze
+    @classmethod
+    def loco_present(cls, fallback=-1):
+        I = cls.get_current()
+        if cls.noise_mA == None:
+            return (I >= fallback, I)
+        return (I >= cls.PRESENCE_FACTOR * cls.noise_mA, I)
 
+    # Logiktabellen der H-Brücken sh. classes/hbridge.py
     @classmethod
     def power_off(cls):
-        cls.brake.value(1)  
-        cls.pwm.value(0)
+        cls.driver.off()
         cls.statemachine.end()
-        cls.power.value(False)
         cls.power_state = False
         cls.emergency = False
+        cls.connect(False)
+        cls.sampler.end()
 
     #
     @classmethod
     def power_on(cls):
+        cooldown = cls.short_detector.cooldown_ms()
+        if cooldown > 0:
+            raise(RuntimeError(f"!!! ÜBERLAST - noch {cooldown} ms abkühlen !!!"))
         cls.set_initial_state()
-        # The system has not saved the last state of the layout, therefor it must
-        # send 20 x RESET and 10 x IDLE immediately after power-on
-        for i in range(20):
-            cls.ringbuffer.append(cls.RESET[0])
-            cls.ringbuffer.append(cls.RESET[1])
-        for i in range(10):
-            cls.ringbuffer.append(cls.IDLE[0])
-            cls.ringbuffer.append(cls.IDLE[1])
-        if DEBUG:
-            for p in cls.ringbuffer:
-                print(f"{cls.to_bin(p)} ", end="")
-            print()
-        cls.brake.value(0)  
-        cls.pwm.value(1)
+        cls.startup_pending = True   # 20 x RESET, 10 x IDLE
         cls.power_time = utime.ticks_ms()
-        cls.power.value(True)
+        cls.driver.on()
         cls.power_state = True
+        cls.short_detector.reset()
+        cls.connect(True)
+        cls.sampler.begin()
         cls.statemachine.begin()
         cls.chk_short()
         cls.send2track()
-        cls.ringbuffer = []
-
-    #
-    @classmethod
-    def raw2mA(cls, analog_value):
-        analog_value = analog_value * cls.AREF_VOLT / 65535  # ADC mappt auf 0..65535
-        if cls.motordriver == "DRV8871":
-            return analog_value - cls.DRV8871_QUIESCENT_CURRENT
-        analog_value /= cls.LMD18200_SENS_SHUNT  # Rsense
-        return (analog_value / cls.LMD18200_SENS_AMPERE_PER_AMPERE) - cls.LMD18200_QUIESCENT_CURRENT  # lt. Datenblatt 377 µA / A +/- 10 %
 
     #
     @classmethod
     def get_current(cls):
-        analog_value = 0
-        max_value = 0
-        for i in range(0, cls.DENOISE_SAMPLES):
-            analog_value = (cls.ack.read_u16() - analog_value) * cls.CURRENT_SMOOTHING + analog_value * (1 - cls.CURRENT_SMOOTHING)
-            max_value = max(analog_value, max_value)
-        return round(cls.raw2mA(max_value))
+        return cls.driver.raw2mA(cls.sampler.value())
     
-    #
+    # der SHORTDETECTOR hat die Pins schon abgeschaltet, hier wird nur noch aufgeräumt
     @classmethod
     def chk_short(cls):
-        if cls.get_current() > cls.SHORT: # Kurzschluss (ggf. im Servicemode
+        cls.sampler.poll()
+        if cls.short_detector.tripped:
+            cls.power_off()
+            if cls.short_detector.cause == OVERLOAD:
+                raise(RuntimeError("!!! ÜBERLAST !!!"))
             raise(RuntimeError("!!! KURZSCHLUSS !!!"))
 
     #
@@ -559,19 +609,18 @@ class ELECTRICAL:
     def emergency_stop(cls):
         for l in cls.locos:
             l.current_speed["FS"] = -1
-        cls.buffer_dirty = True
+            cls.update_speed_slot(l)
+        # DMA: der letzte Rahmen läuft weiter, auch wenn der Refresh angehalten ist (hold) -
+        # Nothalt-Fahrstufen sofort einbauen (ist der hintere Puffer noch belegt, folgt run())
+        if cls.power_state == True and cls.statemachine.dma and not cls.core1_running:
+            cls.transmit_frame()
         
     # sends "Reset all"
     @classmethod
     def reset(cls):
-        cls.__init__(cls.motordriver, cls.brake, cls.pwm, cls.power, cls.dir_pin, cls.ack)        
-        for i in range(20):
-            cls.ringbuffer.append(cls.RESET[0])
-            cls.ringbuffer.append(cls.RESET[1])
-        for i in range(10):
-            cls.ringbuffer.append(cls.IDLE[0])
-            cls.ringbuffer.append(cls.IDLE[1])
-        cls.send2track()
+        cls.startup_pending = True
+        if not cls.core1_running:
+            cls.send2track()
         
     # Geschwindigkeitscode 14 Fahrstufen
     #
@@ -617,52 +666,85 @@ class ELECTRICAL:
         return (0b01000000 | direction << 5 | cssss) & 0xff
         
    
+    # Paket als Tupel von 32-Bit-Worten, unveränderte Pakete kommen aus dem Cache
     #
     @classmethod
-    def to_bin(cls, num):
-        stream = 0
-        for j in range(0, 8):
-            if num & 1 << (7 - j):
-                stream |= 1
-            stream <<= 1
-        return stream >> 1 & 0xff
+    def encode(cls, packet):
+        key = bytes(packet)
+        words = cls.packet_cache.get(key)
+        if words == None:
+            words = DCCENCODER.encode(packet, cls.PREAMBLE)
+            cls.packet_cache.put(key, words)
+        return words
+
+    # Treffer, Fehlschläge, Einträge des Paket-Caches
+    #
+    @classmethod
+    def cache_stats(cls):
+        return cls.packet_cache.stats()
 
+    # einmalige Pakete für Zubehör und POM in die festen Puffer kodieren
+    #
+    # (mit Core 1 als fertige Worte über den Briefkasten)
+    #
+    @classmethod
+    def set_accessory_packet(cls, packet):
+        if cls.core1_running:
+            cls.post("accessory", cls.write_accessory, DCCENCODER.encode(packet, cls.PREAMBLE))
+            return
+        cls.accessory_len = DCCENCODER.encode_into(packet, cls.accessory_buffer, 0, cls.PREAMBLE)
+        cls.accessory_view = memoryview(cls.accessory_buffer)[0:cls.accessory_len]
 
     @classmethod
-    def prepare(cls, packet=[]):  # Daten in den Puffer stellen
-        stream = 0
-        bits = 0
-        padding = 0
-        """
-        is a packet length of 8, 11 or 14 bytes allowed according to NMRA RP 9.2.1 § 2.4.3.2?
-        Does not work with Arduino Library NmraDcc !!
-        """
-        if 2 <= len(packet) <= 5: #or len(packet) in [8, 11, 14]:  # Anzahl Bytes ohne XOR
-            # Streamlänge = jedem Byte ein 0 voran, das XOR-byte + 1 ans Ende + Preamble + Padding auf Wortgrenze (32 Bit)
-            err = 0;
-            for byte in packet:
-                err ^= byte
-            packet.append(err)
-            preamble = cls.PREAMBLE
-            bits = preamble + len(packet) * 9 + 1
-            padding = 32 - (bits % 32) # links mit 1 erweitern bis Wortgrenze
-            for i in range(0, padding + preamble):
-                stream <<= 1
-                stream |= 1
-            if DEBUG:
-                print(bin(stream), ": ", len(bin(stream))-2, " <") 
-            for i in packet:
-                stream <<= 9
-                stream |= cls.to_bin(i)
-            if DEBUG:
-                print(bin(stream), ": ", len(bin(stream))-2, " <") 
-            stream <<= 1
-            stream |= 1
-            if DEBUG:
-                print(bin(stream), ": ", len(bin(stream))-2, " <") 
-        return (padding + bits) // 32, stream  # Anzahl der Worte + Bitstream
-            
-    
+    def set_pom_packet(cls, packet):
+        if cls.core1_running:
+            cls.post("pom", cls.write_pom, DCCENCODER.encode(packet, cls.PREAMBLE))
+            return
+        cls.pom_len = DCCENCODER.encode_into(packet, cls.pom_buffer, 0, cls.PREAMBLE)
+        cls.pom_view = memoryview(cls.pom_buffer)[0:cls.pom_len]
+
+    @classmethod
+    def write_accessory(cls, words):
+        for i in range(len(words)):
+            cls.accessory_buffer[i] = words[i]
+        cls.accessory_len = len(words)
+        cls.accessory_view = memoryview(cls.accessory_buffer)[0:cls.accessory_len]
+
+    @classmethod
+    def write_pom(cls, words):
+        for i in range(len(words)):
+            cls.pom_buffer[i] = words[i]
+        cls.pom_len = len(words)
+        cls.pom_view = memoryview(cls.pom_buffer)[0:cls.pom_len]
+
+    # Änderung am Refresh-Puffer: läuft der Refresh auf Core 1, kommt sie unter 'key' in den
+    # Briefkasten und wird dort zwischen zwei Zyklen ausgeführt, sonst sofort
+    #
+    @classmethod
+    def post(cls, key, fn, *args):
+        if not cls.core1_running:
+            fn(*args)
+            return
+        while True:
+            cls.mailbox_lock.acquire()
+            if key in cls.mailbox or len(cls.mailbox) < cls.MAILBOX_MAX:
+                cls.mailbox[key] = (fn, args)
+                cls.mailbox_lock.release()
+                return
+            cls.mailbox_lock.release()
+            utime.sleep_ms(1)      # voll: Core 1 leert ihn vor dem nächsten Zyklus
+
+    @classmethod
+    def deliver(cls):
+        if len(cls.mailbox) == 0:
+            return
+        cls.mailbox_lock.acquire()
+        box = cls.mailbox
+        cls.mailbox = {}
+        cls.mailbox_lock.release()
+        for fn, args in box.values():
+            fn(*args)
+
     #
     @classmethod
     def generate_address(cls, loco):
@@ -676,161 +758,311 @@ class ELECTRICAL:
         
     #
     @classmethod
-    def generate_instructions(cls):
-        words  = []
-        lengths = []
-        for loco in cls.locos:
-            # lange oder kurze Adresse
-            instruction = cls.generate_address(loco)
-            # Richtung, Geschwindigkeit
-            richtung = loco.current_speed["Dir"]
-            fahrstufe = loco.current_speed["FS"]
-            if loco.speedsteps == 128:
-                speed = cls.speed_control_128steps(richtung, fahrstufe)
-                instruction.append(0b00111111)
-                instruction.append(speed)
-            elif loco.speedsteps == 28:
-                speed = cls.speed_control_28steps(richtung, fahrstufe)
-                instruction.append(speed)
-            elif loco.speedsteps == 14: # @TODO
-                speed = cls.speed_control_14steps(richtung, fahrstufe)
-                pass
-            else:
-                pass
+    def speed_instruction(cls, loco):
+        # lange oder kurze Adresse
+        instruction = cls.generate_address(loco)
+        # Richtung, Geschwindigkeit
+        richtung = loco.current_speed["Dir"]
+        fahrstufe = loco.current_speed["FS"]
+        if loco.speedsteps == 128:
+            speed = cls.speed_control_128steps(richtung, fahrstufe)
+            instruction.append(0b00111111)
+            instruction.append(speed)
+        elif loco.speedsteps == 28:
+            speed = cls.speed_control_28steps(richtung, fahrstufe)
+            instruction.append(speed)
+        elif loco.speedsteps == 14: # @TODO
+            speed = cls.speed_control_14steps(richtung, fahrstufe)
+            pass
+        else:
+            pass
+        return instruction
 
-            l, w = cls.prepare(instruction)
-            words.append(w)
-            lengths.append(l)
-        
-            # Funktionen
-            for f in loco.functions:
-                instruction = []
-                if loco.use_long_address:
-                    instruction.append(192 | (loco.address // 256))
-                    instruction.append(loco.address & 0xff)
-                else:
-                    instruction.append(loco.address)
-                    
-                instruction.append(f)
+    # Paket in den festen Wortpuffer der Lok schreiben, die Sicht (memoryview)
+    # auf den Slot wird nur neu angelegt, wenn sich die Paketlänge ändert
+    #
+    @classmethod
+    def set_slot(cls, loco, slot, instruction):
+        cls.post((loco, slot), cls.write_slot, loco, slot, cls.encode(instruction))
 
-                l, w = cls.prepare(instruction)
-                words.append(w)
-                lengths.append(l)
-                
-            for aux_nr in range(len(loco.aux)):
-                instruction = []
-                if loco.use_long_address:
-                    instruction.append(192 | (loco.address // 256))
-                    instruction.append(loco.address & 0xff)
-                else:
-                    instruction.append(loco.address)
-                    
-                instruction.append(cls.aux_instructions[aux_nr])
-                instruction.append(loco.aux[aux_nr])
-                
-                l, w = cls.prepare(instruction)
-                words.append(w)
-                lengths.append(l)
-                
-                    
-                
-        return lengths, words
-            
+    @classmethod
+    def write_slot(cls, loco, slot, words):
+        pos = slot * cls.SLOT_WORDS
+        for i in range(len(words)):
+            loco.words[pos + i] = words[i]
+        if len(loco.views[slot]) != len(words):
+            loco.views[slot] = memoryview(loco.words)[pos:pos + len(words)]
+        if slot != cls.SLOT_SPEED:
+            loco.burst[slot] = cls.BURST
+        cls.frame_dirty = True
+
+    # nur den Fahrstufen-Slot der Lok neu kodieren
     #
     @classmethod
-    def buffering(cls):
-        buffer = []
-        l, w = cls.generate_instructions()
-        buffer = cls.make_buffer(l, w)
-        if buffer == []:
-            buffer = cls.IDLE
+    def update_speed_slot(cls, loco):
+        cls.set_slot(loco, cls.SLOT_SPEED, cls.speed_instruction(loco))
 
-        return buffer
-    
+    # Funktionsgruppe 0..2 (F0-F4, F5-F8, F9-F12)
+    #
+    @classmethod
+    def update_function_slot(cls, loco, group):
+        instruction = cls.generate_address(loco)
+        instruction.append(loco.functions[group])
+        cls.set_slot(loco, cls.SLOT_FUNCTIONS + group, instruction)
 
+    # AUX-Gruppe 0..6 (F13-F20 ... F61-F68)
     #
     @classmethod
-    def make_buffer(cls, l, w):
-        buffer = []
-        for i in range(len(l)):
+    def update_aux_slot(cls, loco, group):
+        instruction = cls.generate_address(loco)
+        instruction.append(cls.aux_instructions[group])
+        instruction.append(loco.aux[group])
+        if loco.aux[group] != 0:
+            loco.aux_active |= 1 << group   # ab jetzt im Hintergrund auffrischen
+        cls.set_slot(loco, cls.SLOT_AUX + group, instruction)
+
+    # alle Slots der Lok neu kodieren (neue Lok, Adresse oder Fahrstufen geändert)
+    #
+    @classmethod
+    def update_slots(cls, loco):
+        if loco.words == None:
+            loco.words = array('I', bytes(4 * cls.SLOTS * cls.SLOT_WORDS))
+            loco.views = [memoryview(loco.words)[0:0]] * cls.SLOTS
+            loco.burst = bytearray(cls.SLOTS)
+        cls.update_speed_slot(loco)
+        for group in range(len(loco.functions)):
+            cls.update_function_slot(loco, group)
+        for group in range(len(loco.aux)):
+            cls.update_aux_slot(loco, group)
+
+    #
+    @classmethod
+    def debug_words(cls, label, words):
+        print(label, end=" ")
+        for word in words:
+            print("["+bin(word)+"]", end=" ")
+        print()
+
+    # ein Refresh-Zyklus über alle Loks nach Refresh-Klassen
+    #
+    @classmethod
+    def refresh_cycle(cls, sm, aux_interval, watch=None):
+        cycle = cls.cycle
+        pending = False
+        locos = cls.locos
+        for i in range(len(locos)):
+            loco = locos[i]
+            views = loco.views
+            burst = loco.burst
             if DEBUG:
-                print("Array#",i, end=": ")
-            while l[i] > 0:
-                l[i] -= 1
-                word = (w[i] >> l[i] * 32 & 0xffffffff)
+                cls.debug_words("Operation Mode Track signal:", views[cls.SLOT_SPEED])
+            sm.put(views[cls.SLOT_SPEED])
+            if watch != None and watch():
+                return
+            functions = (cycle + i) % cls.FUNCTION_INTERVAL == 0
+            aux = (cycle + i) % aux_interval == 0
+            for slot in range(cls.SLOT_FUNCTIONS, cls.SLOTS):
+                if burst[slot] > 0:
+                    burst[slot] -= 1
+                    if burst[slot] > 0:
+                        pending = True
+                elif slot < cls.SLOT_AUX:
+                    if not functions:
+                        continue
+                elif not (aux and loco.aux_active & (1 << (slot - cls.SLOT_AUX))):
+                    continue
                 if DEBUG:
-                    print("[" + bin(word) + "]", end=" ")
-                buffer.append(word)
+                    cls.debug_words("Operation Mode Track signal:", views[slot])
+                sm.put(views[slot])
+                if watch != None and watch():
+                    return
+        cls.cycle = (cycle + 1) % cls.AUX_INTERVAL
+        cls.burst_pending = pending
+
+    # Sendedauer der Worte in µs
+    #
+    @classmethod
+    def airtime(cls, words):
+        us = 0
+        for word in words:
+            ones = bin(word).count("1")
+            us += ones * cls.ONE_US + (32 - ones) * cls.ZERO_US
+        return us
+
+    # Zeitbudget des Refresh aus dem aktuellen Pufferinhalt (eingeschwungen, ohne Wiederholungen):
+    # Bits und µs über AUX_INTERVAL Zyklen, schlechtester Abstand der Fahrstufen-, Funktions- und
+    # AUX-Pakete je Lok in ms, Reserve bis REFRESH_LIMIT_MS und Anzahl Loks, die noch hineinpassen
+    #
+    @classmethod
+    def budget(cls):
+        cycles = cls.AUX_INTERVAL
+        locos = cls.locos
+        n = len(locos)
+        speed_us = [0] * n
+        function_us = [0] * n
+        aux_us = [0] * n
+        bits = 0
+        for i in range(n):
+            views = locos[i].views
+            speed_us[i] = cls.airtime(views[cls.SLOT_SPEED])
+            words = len(views[cls.SLOT_SPEED]) * cycles
+            for slot in range(cls.SLOT_FUNCTIONS, cls.SLOT_AUX):
+                function_us[i] += cls.airtime(views[slot])
+                words += len(views[slot]) * cycles // cls.FUNCTION_INTERVAL
+            for group in range(len(locos[i].aux)):
+                if locos[i].aux_active & (1 << group):
+                    aux_us[i] += cls.airtime(views[cls.SLOT_AUX + group])
+                    words += len(views[cls.SLOT_AUX + group])
+            bits += 32 * words
+        # Zeitachse über zwei Durchläufe, damit auch die Abstände über das Ende hinweg zählen
+        t = 0
+        total_us = 0
+        speed_max = 0
+        function_max = 0
+        last_speed = [None] * n
+        last_function = [None] * n
+        for k in range(2 * cycles):
+            c = k % cycles
+            for i in range(n):
+                if last_speed[i] != None:
+                    speed_max = max(speed_max, t - last_speed[i])
+                last_speed[i] = t
+                t += speed_us[i]
+                if (c + i) % cls.FUNCTION_INTERVAL == 0:
+                    if last_function[i] != None:
+                        function_max = max(function_max, t - last_function[i])
+                    last_function[i] = t
+                    t += function_us[i]
+                if (c + i) % cycles == 0:
+                    t += aux_us[i]
+            if k == cycles - 1:
+                total_us = t
+        if n == 0:
+            total_us = cls.airtime(cls.IDLE_WORDS) * cycles
+            bits = 32 * len(cls.IDLE_WORDS) * cycles
+        # ohne DMA rechnet transmit() die Strommessung nach jedem Paket nach: die längste
+        # Lücke ist die Sendedauer des längsten Pakets
+        longest = max(cls.airtime(cls.RESET_WORDS), cls.airtime(cls.IDLE_WORDS))
+        for loco in locos:
+            for view in loco.views:
+                longest = max(longest, cls.airtime(view))
+        speed_ms = speed_max / 1000
+        headroom_ms = cls.REFRESH_LIMIT_MS - speed_ms
+        free_locos = 0
+        if n > 0 and headroom_ms > 0:
+            free_locos = int(headroom_ms * 1000 * cycles * n / total_us)
+        return {
+            "locos": n,
+            "bits": bits,
+            "us": total_us,
+            "speed_ms": speed_ms,
+            "function_ms": function_max / 1000,
+            "aux_ms": total_us / 1000,
+            "headroom_ms": headroom_ms,
+            "free_locos": free_locos,
+            "watch_ms": longest / 1000,
+        }
+
+    # ohne DMA sendet transmit() bei gesperrten Interrupts, der Timer von SAMPLER kommt
+    # so lange nicht dran: nach jedem Paket selbst nachrechnen (die FIFO der Statemachine
+    # reicht dafür), True = abgeschaltet, nicht weiter senden
+    #
+    @classmethod
+    def watch(cls):
+        cls.sampler.update()
+        return cls.short_detector.tripped
+
+    # Sendepfad: arbeitet nur mit vorab angelegten Puffern und Sichten,
+    # im eingeschwungenen Zustand ohne Speicheranforderung (auch watch(), sh. SAMPLER.feed())
+    #
+    @classmethod
+    def transmit(cls, cycles=1, aux_interval=AUX_INTERVAL, watch=None):
+        sm = cls.statemachine
+        if cls.accessory_len > 0:
+            if DEBUG:
+                cls.debug_words("Accessory signal:", cls.accessory_view)
+            for i in range(5):
+                sm.put(cls.accessory_view)
+                if watch != None and watch():
+                    return
+            cls.accessory_len = 0
+
+        if cls.pom_len > 0:
+            if DEBUG:
+                cls.debug_words("POM signal:", cls.pom_view)
+            for i in range(8):
+                sm.put(cls.pom_view if i < 3 else cls.RESET_WORDS)   # 3 x POM, 5 x RESET
+                if watch != None and watch():
+                    return
+            cls.pom_len = 0
+
+        if cls.startup_pending:   # RESET / IDLE nach dem Einschalten
             if DEBUG:
-                print()
-        return buffer
+                cls.debug_words("Startup:", cls.STARTUP_WORDS)
+            for i in range(30):
+                sm.put(cls.RESET_WORDS if i < 20 else cls.IDLE_WORDS)   # 20 x RESET, 10 x IDLE
+                if watch != None and watch():
+                    return
+            cls.startup_pending = False
+        elif len(cls.locos) == 0:
+            sm.put(cls.IDLE_WORDS)
+            if watch != None:
+                watch()
+        else:
+            for i in range(cycles):
+                cls.refresh_cycle(sm, aux_interval, watch)
+
+    # obere Grenze der Worte eines DMA-Rahmens mit 'cycles' Zyklen: Zubehör und POM,
+    # dazu Einschaltfolge, IDLE oder je Lok und Zyklus alle Slots (mit offenen
+    # Wiederholungen kann jeder Slot in jedem Zyklus kommen)
+    #
+    @classmethod
+    def frame_words(cls, cycles):
+        oneshot = 5 * cls.PACKET_WORDS + 3 * cls.PACKET_WORDS + 5 * len(cls.RESET_WORDS)
+        startup = 20 * len(cls.RESET_WORDS) + 10 * len(cls.IDLE_WORDS)
+        refresh = cycles * len(cls.locos) * cls.SLOTS * cls.SLOT_WORDS
+        return oneshot + max(startup, len(cls.IDLE_WORDS), refresh)
+
+    # DMA-Betrieb: der Rahmen läuft ohne CPU, neu aufgebaut wird nur nach einer
+    # Änderung. Einmalige Pakete (Zubehör, POM, RESET) stehen genau in einem
+    # Rahmen, danach folgt wieder der normale Refresh-Rahmen.
+    # Ein Rahmen umfasst FUNCTION_INTERVAL Zyklen, benutzte AUX-Gruppen laufen mit
+    # den Funktionen; solange noch Wiederholungen (BURST) offen sind, wird er neu gebaut.
+    # Der Puffer wächst mit der Zahl der Loks (frame_words()); reicht der Speicher dafür
+    # nicht, wird der Rahmen kürzer und jedes Mal neu gebaut - sonst kämen die Funktionen
+    # der Loks, deren Zyklus nicht im Rahmen liegt, nie aufs Gleis.
+    #
+    @classmethod
+    def transmit_frame(cls):
+        sm = cls.statemachine
+        oneshot = cls.startup_pending or cls.accessory_len > 0 or cls.pom_len > 0
+        if (cls.frame_dirty or oneshot) and sm.ready():
+            cycles = cls.FUNCTION_INTERVAL
+            while not sm.reserve(cls.frame_words(cycles)) and cycles > 1:
+                cycles //= 2
+            sm.frame_begin()
+            cls.transmit(cycles, cls.FUNCTION_INTERVAL)
+            sm.frame_end()
+            cls.frame_dirty = oneshot or cls.burst_pending or cycles < cls.FUNCTION_INTERVAL
 
     #
     @classmethod
     def send2track(cls):
         try:
             if cls.power_state == True:
-                if (utime.ticks_ms() - cls.messtimer > 100):
-                    cls.chk_short()
-                    cls.messtimer = utime.ticks_ms()
-                     
-                if cls.buffer_dirty:
-                    buffer = cls.buffering()
-                    cls.ringbuffer = buffer
+                cls.chk_short()
+                if cls.statemachine.dma:
+                    cls.transmit_frame()
                 else:
-                    buffer = cls.ringbuffer
-                if buffer == []:
-                    buffer = cls.IDLE
-                
-                if not DEBUG:
-                    state = machine.disable_irq()
-
-                if cls.accessory_buffer != []:
-                    if DEBUG:
-                        print("Accessory signal: ", end="")
-                    for i in range(5):
-                        for word in cls.accessory_buffer:
-                            if DEBUG:
-                                print("["+bin(word)+"]", end=" ")
-                            cls.statemachine.put(word)
-                    cls.accessory_buffer = []
-                    if DEBUG:
-                        print()
- 
-                if cls.pom_buffer != []:
-                    if DEBUG:
-                        print("POM signal: ", end="")
-
-                    for n in range(2):
-                        for word in cls.pom_buffer:
-                            if DEBUG:
-                                print("["+bin(word)+"]", end=" ")
-                            cls.statemachine.put(word)
-                    
-                    for i in range(5):
-                        cls.pom_buffer.append(cls.RESET[0])
-                        cls.pom_buffer.append(cls.RESET[1])
-                        
-                    for word in cls.pom_buffer:
-                        if DEBUG:
-                            print("["+bin(word)+"]", end=" ")
-                        cls.statemachine.put(word)
-                    if DEBUG:
-                        print()
-                    
-                    cls.pom_buffer = []
-                    
-                if DEBUG:
-                    print("Operation Mode Track signal:", end=" ")
-                for word in buffer:
-                    if DEBUG:
-                        print("["+bin(word)+"]", end=" ")
-                    cls.statemachine.put(word)
-                if DEBUG:
-                    print()
-                if not DEBUG:
-                    machine.enable_irq(state)
-                cls.buffer_dirty = False
+                    # auf Core 1 läuft der Timer von SAMPLER auf Core 0 weiter
+                    watch = None if cls.core1_running else cls.watch
+                    if not DEBUG:
+                        state = machine.disable_irq()
+                    try:
+                        cls.transmit(watch=watch)
+                    finally:
+                        if not DEBUG:
+                            machine.enable_irq(state)
 
         except KeyboardInterrupt:
             raise(KeyboardInterrupt("SIGINT"))
@@ -847,6 +1079,9 @@ class OPERATIONS(ELECTRICAL):
     
     active_loco = None # Active Loco
     device = None # Active accessory
+    running = False    # Refresh läuft als asyncio-Task (run)
+    hold = False       # Refresh-Task sendet nicht (z.B. Nothalt per Taster), sh. refresh_step()
+    IDLE_MS = 5        # Wartezeit von run()/pause(), wenn kein Zyklus zu senden ist
     #
     @classmethod
     def __init__(cls, H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN):
@@ -856,9 +1091,11 @@ class OPERATIONS(ELECTRICAL):
     def ctrl_loco(cls, address=3, use_long_address=False, speedsteps=28, name=""):
         index = cls.search(address)
 
+        # die Liste wird ersetzt statt verändert, Core 1 liest sie ohne Sperre
         if index == None:
             cls.active_loco = LOCO(address, use_long_address, speedsteps)
-            cls.locos.append(cls.active_loco)
+            cls.update_slots(cls.active_loco)
+            cls.locos = cls.locos + [cls.active_loco]
         else:
             if (name != ""):
                 cls.locos[index].name = name
@@ -872,8 +1109,9 @@ class OPERATIONS(ELECTRICAL):
                 
                 cls.active_loco.current_speed = cls.locos[index].current_speed
                 cls.active_loco.functions = cls.locos[index].functions
-                cls.locos.remove(cls.locos[index])
-                cls.locos.append(cls.active_loco)
+                old = cls.locos[index]
+                cls.update_slots(cls.active_loco)
+                cls.locos = [l for l in cls.locos if l is not old] + [cls.active_loco]
             else:
                 cls.active_loco = cls.locos[index]
 
@@ -888,6 +1126,17 @@ class OPERATIONS(ELECTRICAL):
         index = cls.search(cls.active_loco.address)
         if index != None:
             cls.locos[index].speedsteps = speedsteps
+            cls.update_speed_slot(cls.locos[index])
+
+    # Lok aus dem Refresh nehmen
+    @classmethod
+    def remove_loco(cls, address):
+        index = cls.search(address)
+        if index != None:
+            old = cls.locos[index]
+            cls.locos = [l for l in cls.locos if l is not old]
+            cls.frame_dirty = True
+        return index != None
 
     @classmethod
     def search(cls, search_address):
@@ -900,8 +1149,10 @@ class OPERATIONS(ELECTRICAL):
     @classmethod
     def end(cls):
         cls.emergency_stop()
+        cls.core1_suspend()
         if cls.power_state == True:
             cls.power_off()
+        cls.core1_resume()
         utime.sleep_ms(100)
         cls.locos = []
         cls.device = None
@@ -911,7 +1162,9 @@ class OPERATIONS(ELECTRICAL):
     #
     @classmethod
     def begin(cls):
+        cls.core1_suspend()
         super().power_on()
+        cls.core1_resume()
         super().chk_short()
         utime.sleep_ms(100)
     
@@ -920,8 +1173,171 @@ class OPERATIONS(ELECTRICAL):
     def loop(cls):
         if cls.power_state == False:
             raise(RuntimeError("Power is off"))
+        if cls.running or cls.core1_running:
+            return          # die Refresh-Task bzw. Core 1 sendet
         cls.send2track()    # scheduler: Funktion liefert die DCC-Instruktionen an das Gleis
 
+    # asyncio-Betrieb: der Refresh läuft als eigene Task, nach jedem Zyklus (bzw. Rahmen im
+    # DMA-Betrieb) kommen die anderen Tasks dran. Operationen mit Wartezeit gibt es als
+    # Koroutinen, damit keine davon den Refresh anhält.
+    #
+    @classmethod
+    async def run(cls):
+        cls.running = True
+        try:
+            while cls.running:
+                await asyncio.sleep(cls.refresh_step() / 1000)
+        finally:
+            cls.running = False
+
+    # ein Schritt des Refresh, Ergebnis: Wartezeit in ms bis zum nächsten. Ohne DMA sendet
+    # send2track() einen ganzen Zyklus, danach nur kurz abgeben (0). Im DMA-Betrieb läuft der
+    # Rahmen ohne CPU, auch bei 'hold' - Änderungen (Nothalt) müssen trotzdem hinein, und die
+    # Kurzschlussprüfung läuft weiter. Ohne Strom, mit Core 1 oder 'hold' ohne DMA: warten.
+    #
+    @classmethod
+    def refresh_step(cls):
+        if cls.power_state != True or cls.core1_running:
+            return cls.IDLE_MS
+        if cls.statemachine.dma:
+            cls.send2track()
+            return cls.IDLE_MS
+        if cls.hold:
+            return cls.IDLE_MS
+        cls.send2track()
+        return 0
+
+    @classmethod
+    def stop(cls):
+        cls.running = False
+
+    # warten, ohne den Refresh anzuhalten
+    #
+    @classmethod
+    async def pause(cls, milliseconds):
+        if cls.running or cls.core1_running:
+            await asyncio.sleep(milliseconds / 1000)
+            return
+        stop = utime.ticks_add(utime.ticks_ms(), milliseconds)
+        while utime.ticks_diff(stop, utime.ticks_ms()) > 0:
+            await asyncio.sleep(cls.refresh_step() / 1000)
+
+    # Ruhestrom und Rauschen bei eingeschaltetem, leerem Gleis messen und speichern;
+    # mit 'load_mA' stattdessen die Steigung an einer bekannten Last. Der Refresh läuft weiter.
+    #
+    @classmethod
+    async def calibrate(cls, load_mA=None):
+        if cls.power_state == False:
+            raise(RuntimeError("Power is off"))
+        calibrator = CALIBRATOR(cls.CALIBRATION_SAMPLES)
+        cls.sampler.add_detector(calibrator)
+        try:
+            while not calibrator.done():
+                await cls.pause(SAMPLER.UPDATE_MS)
+        finally:
+            cls.sampler.remove_detector(calibrator)
+        values = cls.calibration.update(cls.driver, calibrator, load_mA)
+        cls.calibration.save()
+        cls.noise_mA = values["noise"]
+        cls.set_limits()
+        return values
+
+    # Core 1 (opt-in, USE_CORE1): besitzt Bitgenerator und Refresh-Puffer und sendet ohne
+    # Unterbrechung durch Kommandos, Anzeige oder Strommessung auf Core 0. Änderungen kommen
+    # über den Briefkasten (post), Ein- und Ausschalten nur, während Core 1 wartet (suspend).
+    # Gemessen wird in µs der Abstand gleicher Phasen des Refresh (je FUNCTION_INTERVAL Zyklen,
+    # dazwischen ändert sich der Inhalt der Zyklen planmäßig).
+    #
+    @classmethod
+    def start_core1(cls):
+        if _thread == None:
+            raise(RuntimeError("_thread nicht verfügbar"))
+        if cls.core1_running:
+            return
+        cls.mailbox_lock = _thread.allocate_lock()
+        cls.core1_hold = False
+        cls.core1_idle = False
+        cls.core1_done = False
+        cls.reset_jitter()
+        cls.core1_running = True
+        _thread.start_new_thread(cls.core1_main, ())
+
+    @classmethod
+    def stop_core1(cls):
+        if not cls.core1_running:
+            return
+        cls.core1_running = False
+        while not cls.core1_done:
+            utime.sleep_ms(1)
+        cls.deliver()      # was noch im Briefkasten liegt
+
+    @classmethod
+    def core1_main(cls):
+        last = None
+        try:
+            while cls.core1_running:
+                cls.deliver()
+                cls.core1_idle = False     # vor der Abfrage von core1_hold (sh. core1_suspend)
+                # 'hold' mit DMA: weiter Rahmen bauen (sh. refresh_step)
+                if cls.core1_hold or (cls.hold and not cls.statemachine.dma) or cls.power_state != True:
+                    cls.core1_idle = True
+                    last = None
+                    utime.sleep_ms(1)
+                    continue
+                cls.send2track()
+                if cls.cycle % cls.FUNCTION_INTERVAL != 0:
+                    continue
+                now = utime.ticks_us()
+                if last != None:
+                    period = utime.ticks_diff(now, last)
+                    cls.jitter_count += 1
+                    cls.jitter_sum += period
+                    if period < cls.jitter_min:
+                        cls.jitter_min = period
+                    if period > cls.jitter_max:
+                        cls.jitter_max = period
+                last = now
+        finally:
+            cls.core1_running = False
+            cls.core1_idle = True
+            cls.core1_done = True
+
+    # Core 1 zwischen zwei Zyklen anhalten (Bitgenerator wird neu angelegt)
+    #
+    @classmethod
+    def core1_suspend(cls):
+        if cls.core1_running:
+            cls.core1_hold = True
+            while not cls.core1_idle:
+                utime.sleep_ms(1)
+
+    @classmethod
+    def core1_resume(cls):
+        cls.core1_hold = False
+
+    @classmethod
+    def reset_jitter(cls):
+        cls.jitter_count = 0
+        cls.jitter_sum = 0
+        cls.jitter_min = 1 << 29
+        cls.jitter_max = 0
+
+    # (Anzahl, min., max., mittlerer Abstand in µs)
+    #
+    @classmethod
+    def jitter(cls):
+        mean = cls.jitter_sum // cls.jitter_count if cls.jitter_count > 0 else 0
+        return (cls.jitter_count, cls.jitter_min, cls.jitter_max, mean)
+
+    # Richtungswechsel: erst anhalten, nach 'pause_ms' in der neuen Richtung anfahren
+    #
+    @classmethod
+    async def change_direction(cls, richtung, fahrstufe, pause_ms=500):
+        if richtung != cls.active_loco.current_speed["Dir"]:
+            cls.drive(cls.active_loco.current_speed["Dir"], 0)
+            await cls.pause(pause_ms)
+        cls.drive(richtung, fahrstufe)
+
     # Funktionsgruppen-ID
     #
     @classmethod
@@ -1001,6 +1417,7 @@ class OPERATIONS(ELECTRICAL):
             cls.active_loco.aux[grp] |= 1 << aux_msk
         else: 
             cls.active_loco.aux[grp] &= ~(1 << aux_msk)
+        cls.update_aux_slot(cls.active_loco, grp)
             
     # Funktionsbits setzen und an Lok senden
     #
@@ -1013,9 +1430,9 @@ class OPERATIONS(ELECTRICAL):
                 cls.active_loco.functions[function_group] |= ((1 << cls.get_function_shift(function_nr)) | instruction_prefix)
             else:
                 cls.active_loco.functions[function_group] &= (~(1 << cls.get_function_shift(function_nr)) | instruction_prefix)
+            cls.update_function_slot(cls.active_loco, function_group)
         elif 13 <= function_nr <= 68:
             cls.__set_aux(function_nr, status)
-        cls.buffer_dirty = True
         
     # Funktionsbits umschalten und an Lok senden
     #
@@ -1023,14 +1440,13 @@ class OPERATIONS(ELECTRICAL):
     def toggle_function(cls, function_nr):
         status = cls.get_function(function_nr)
         cls.set_function(function_nr, 0 if status else 1)
-        cls.buffer_dirty = True
         
     # fahre mit 14 oder 28/128 FS (128 bevorzugt)
     #
     @classmethod
     def drive(cls, richtung, fahrstufe):  # Fahrstufen
         cls.active_loco.current_speed = {"Dir": richtung, "FS": fahrstufe}
-        cls.buffer_dirty = True
+        cls.update_speed_slot(cls.active_loco)
         cls.loop()
         
     #
@@ -1081,8 +1497,7 @@ class OPERATIONS(ELECTRICAL):
         byte2 |= (D << 3)
         byte2 |= R
         
-        l, w = cls.prepare([byte1, byte2])
-        cls.accessory_buffer = cls.make_buffer([l], [w])
+        cls.set_accessory_packet([byte1, byte2])
         cls.loop()
     
     #
@@ -1104,8 +1519,7 @@ class OPERATIONS(ELECTRICAL):
         byte2 = ~(b >> 3) & 0b01110000 | b2 | (b << 1) & 0b00000110
         byte3 = aspect & 0xff  # set aspects
             
-        l, w = cls.prepare([byte1, byte2, byte3])
-        cls.accessory_buffer = cls.make_buffer([l], [w])
+        cls.set_accessory_packet([byte1, byte2, byte3])
         cls.loop()
         
 
@@ -1166,12 +1580,7 @@ class OPERATIONS(ELECTRICAL):
 
         if DEBUG:
             print(instructions)
-        l, w = cls.prepare(instructions)
-        if DEBUG:
-            print(l, w)
-        cls.pom_buffer = cls.make_buffer([l], [w])
-        if DEBUG:
-            print(cls.pom_buffer)
+        cls.set_pom_packet(instructions)
         cls.loop()
 
     # Multifunction decoder
@@ -1186,8 +1595,7 @@ class OPERATIONS(ELECTRICAL):
         byte4 = value & 0xff
         instructions = [byte1, byte2, byte3, byte4]
         
-        l, w = cls.prepare(instructions)
-        cls.pom_buffer = cls.make_buffer([l], [w])
+        cls.set_pom_packet(instructions)
         cls.loop()
 
 # ----------------------------------------------------------------
@@ -1219,8 +1627,139 @@ class LOCO:
             self.functions = [0b10000000, 0b10110000, 0b10100000]
             # AUX = Functions 13-68
             self.aux = [0b00000000, 0b00000000, 0b00000000, 0b00000000, 0b00000000, 0b00000000, 0b00000000]
+            # kodierte Pakete je Slot (Wortpuffer + Sichten), sh. ELECTRICAL.update_slots()
+            self.words = None
+            self.views = []
+            self.burst = None       # offene Wiederholungen je Slot nach einer Änderung
+            self.aux_active = 0     # Bitmaske der je benutzten AUX-Gruppen
             if(name != None):
                 self.name = name
 
         
-# ------------------------------------------------------------------
\ No newline at end of file
+# ------------------------------------------------------------------
+if __name__ == "__main__":
+    # Aufwand je Änderung der Fahrstufe: nur Slot neu kodieren vs. alle Loks neu kodieren
+    for count in (1, 10, 50):
+        ELECTRICAL.locos = []
+        for address in range(1, count + 1):
+            loco = LOCO(address)
+            ELECTRICAL.update_slots(loco)
+            ELECTRICAL.locos.append(loco)
+        ELECTRICAL.packet_cache.clear()
+        t = utime.ticks_us()
+        for fs in range(1, 21):
+            loco.current_speed["FS"] = fs
+            ELECTRICAL.update_speed_slot(loco)
+        t_slot = utime.ticks_diff(utime.ticks_us(), t) / 20
+        ELECTRICAL.packet_cache.clear()
+        t = utime.ticks_us()
+        for fs in range(1, 21):
+            loco.current_speed["FS"] = fs
+            for l in ELECTRICAL.locos:
+                ELECTRICAL.update_slots(l)
+        t_all = utime.ticks_diff(utime.ticks_us(), t) / 20
+        print(f"{count:>3} Loks: Slot {t_slot:8.1f} µs, alle Loks {t_all:9.1f} µs je Änderung")
+
+    # Refresh-Intervall je Lok (Fahrstufe): alle 11 Pakete je Zyklus vs. Refresh-Klassen
+    for count in (1, 10, 50):
+        ELECTRICAL.locos = []
+        for address in range(1, count + 1):
+            loco = LOCO(address)
+            ELECTRICAL.update_slots(loco)
+            loco.aux[0] = 1              # jede Lok nutzt F13
+            ELECTRICAL.update_aux_slot(loco, 0)
+            for slot in range(ELECTRICAL.SLOTS):
+                loco.burst[slot] = 0
+            ELECTRICAL.locos.append(loco)
+        all_us = 0
+        for loco in ELECTRICAL.locos:
+            for view in loco.views:
+                all_us += ELECTRICAL.airtime(view)
+        b = ELECTRICAL.budget()
+        print(f"{count:>3} Loks: Fahrstufen-Refresh alle {all_us / 1000:7.1f} ms (alle Pakete), "
+              f"{b['speed_ms']:7.1f} ms (Refresh-Klassen, schlechtester Zyklus), "
+              f"Reserve {b['headroom_ms']:7.1f} ms = {b['free_locos']} Loks, "
+              f"Abschaltung ohne DMA nach Haltezeit + {b['watch_ms']:.1f} ms")
+
+    # Sendepfad ohne Speicheranforderung? (nur MicroPython kennt gc.mem_alloc()) - mit
+    # Strommessung nach jedem Paket (watch) wie ohne DMA bei gesperrten Interrupts
+    import gc
+    class SINK:
+        def put(self, words):
+            pass
+    ELECTRICAL.statemachine = SINK()
+    ELECTRICAL.startup_pending = False
+    ELECTRICAL.accessory_len = 0
+    ELECTRICAL.pom_len = 0
+    ELECTRICAL.sampler = sampler(26)
+    ELECTRICAL.short_detector = overload(hbridge("DRV8871", 28, 29, 3), SAMPLER.RATE)
+    ELECTRICAL.sampler.add_detector(ELECTRICAL.short_detector)
+    ELECTRICAL.sampler.begin()
+    ELECTRICAL.transmit(watch=ELECTRICAL.watch)
+    if hasattr(gc, "mem_alloc"):
+        gc.collect()
+        before = gc.mem_alloc()
+        for i in range(100):
+            ELECTRICAL.transmit(watch=ELECTRICAL.watch)
+        delta = gc.mem_alloc() - before
+        print(f"transmit() x 100 mit {len(ELECTRICAL.locos)} Loks und watch: {delta} Bytes angefordert {'OK' if delta == 0 else 'FEHLER'}")
+    ELECTRICAL.sampler.end()
+    ELECTRICAL.sampler.remove_detector(ELECTRICAL.short_detector)
+
+    # DMA-Rahmen größer als DMA_WORDS: 80 Loks, alle Wiederholungen offen. Der hintere Puffer
+    # wächst (frame_words()); kann er nicht wachsen, wird der Rahmen kürzer und jedes Mal neu gebaut
+    generator = bitgenerator(27, model="DRV8871", dma=True)
+    ELECTRICAL.statemachine = generator
+    ELECTRICAL.locos = []
+    for address in range(1, 81):
+        loco = LOCO(address)
+        ELECTRICAL.update_slots(loco)
+        ELECTRICAL.locos.append(loco)
+    for label, limit in (("mit Speicher", None), ("Speicher knapp", generator.DMA_WORDS)):
+        if limit != None:
+            generator.reserve = lambda words: words <= limit
+        for loco in ELECTRICAL.locos:
+            loco.burst[0:] = bytes([2] * ELECTRICAL.SLOTS)
+        ELECTRICAL.frame_dirty = True
+        try:
+            ELECTRICAL.transmit_frame()
+            result = (f"{generator.lengths[generator.front]:>4} Worte im Puffer für "
+                      f"{len(generator.buffers[generator.front]):>4}, {'jedes Mal neu' if ELECTRICAL.frame_dirty else 'läuft'} OK")
+        except ValueError as e:
+            result = f"FEHLER {e}"
+        print(f"DMA-Rahmen, 80 Loks, {label:<14}: {result}")
+
+    # Core 1: Jitter des Refresh ohne und mit Dauerfeuer auf dem Kommandopfad (Core 0).
+    # PACED blockiert wie die Statemachine für die Sendedauer der Worte.
+    if _thread != None:
+        class PACED:
+            dma = False
+            def put(self, words):
+                stop = utime.ticks_add(utime.ticks_us(), ELECTRICAL.airtime(words))
+                while utime.ticks_diff(stop, utime.ticks_us()) > 0:
+                    pass
+        OPERATIONS("DRV8871", 27, 28, 29, 3, 26)
+        OPERATIONS.statemachine = PACED()
+        OPERATIONS.power_state = True
+        for address in range(1, 11):
+            OPERATIONS.ctrl_loco(address)
+            OPERATIONS.active_loco.burst[0:] = bytes(ELECTRICAL.SLOTS)
+        for hammer in (False, True):
+            OPERATIONS.start_core1()
+            posted = 0
+            peak = 0
+            stop = utime.ticks_add(utime.ticks_ms(), 3000)
+            while utime.ticks_diff(stop, utime.ticks_ms()) > 0:
+                if hammer:
+                    loco = OPERATIONS.locos[posted % 10]
+                    loco.current_speed["FS"] = posted % 100
+                    OPERATIONS.update_speed_slot(loco)   # gleiche Paketlänge, nur neue Fahrstufe
+                    posted += 1
+                    peak = max(peak, len(OPERATIONS.mailbox))
+                else:
+                    utime.sleep_ms(10)
+            OPERATIONS.stop_core1()
+            count, t_min, t_max, mean = OPERATIONS.jitter()
+            print(f"Core 1, {'Dauerfeuer' if hammer else 'Ruhe':<10} ({posted:>6} Änderungen): {count:>3} x {ELECTRICAL.FUNCTION_INTERVAL} Zyklen, "
+                  f"Abstand {t_min / 1000:6.1f} .. {t_max / 1000:6.1f} ms (Mittel {mean / 1000:6.1f} ms), "
+                  f"Jitter {(t_max - t_min) / 1000:5.1f} ms, Briefkasten max. {peak}")
@@ -0,0 +1,65 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Cache für fertig kodierte DCC-Pakete
+#
+# Schlüssel: die Instruktionsbytes (ohne XOR), Wert: Tupel der 32-Bit-Worte,
+# so wie sie an die Statemachine gehen. Begrenzte Größe, bei Überlauf wird
+# der am längsten nicht benutzte Eintrag verworfen (LRU).
+#
+# ----------------------------------------------------------------------
+
+from collections import OrderedDict
+
+
+class PACKETCACHE:
+
+    def __init__(self, size=128):
+        if size < 1:
+            raise(ValueError("Cache-Größe muss > 0 sein"))
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # liefert die Worte zum Schlüssel oder None
+    def get(self, key):
+        words = self.entries.get(key)
+        if words == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # ans Ende stellen = zuletzt benutzt
+        del self.entries[key]
+        self.entries[key] = words
+        return words
+
+    def put(self, key, words):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.size:
+            del self.entries[next(iter(self.entries))]  # ältester Eintrag
+        self.entries[key] = words
+
+    def clear(self):
+        self.entries = OrderedDict()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    # (Treffer, Fehlschläge, Einträge)
+    def stats(self):
+        return (self.hits, self.misses, len(self.entries))
+
+
+if __name__ == "__main__":
+    cache = PACKETCACHE(2)
+    cache.put(b'\x03\x60', (1, 2))
+    cache.put(b'\x03\x80', (3, 4))
+    cache.get(b'\x03\x60')
+    cache.put(b'\x04\x60', (5, 6))   # verdrängt b'\x03\x80'
+    print(cache.get(b'\x03\x80'), cache.get(b'\x03\x60'), cache.stats())
@@ -0,0 +1,114 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Lok-Erkennung auf dem Programmiergleis
+#
+# PRESENCEDETECTOR hängt wie SHORTDETECTOR und ACKDETECTOR am Datenstrom von
+# SAMPLER, wertet aber nur alle PERIOD_MS einen Block aus (Mittelwert über
+# höchstens BLOCK Werte) - alle anderen Blöcke kosten nur eine Addition. Liegt
+# der Mittelwert DEBOUNCE Auswertungen in Folge über 'limit' (Rohwert wie
+# read_u16()), steht eine Lok auf dem Gleis: 'present' wird gesetzt, 'events'
+# zählt und ein 'callback(True)' wird per micropython.schedule() außerhalb des
+# Interrupts aufgerufen. Wird die Lok wieder abgenommen, entsprechend mit False.
+#
+# Gewartet wird so, ohne get_current() in einer Schleife abzufragen; mit Timer
+# (und DMA) erledigt SAMPLER die Messung im Hintergrund.
+#
+# ----------------------------------------------------------------------
+
+import micropython
+from micropython import const
+
+
+class PRESENCEDETECTOR:
+
+    PERIOD_MS = 100             # Abstand der Auswertungen
+    BLOCK = const(16)           # Werte je Auswertung
+    DEBOUNCE = const(3)         # Auswertungen in Folge für einen Wechsel
+
+    def __init__(self, rate, limit=0, callback=None):
+        self.period = rate * self.PERIOD_MS // 1000   # Werte zwischen zwei Auswertungen
+        self.limit = limit
+        self.callback = callback
+        self.present = False
+        self.events = 0
+        self.enabled = False
+        self.clear()
+
+    def clear(self):
+        self.skip = 0
+        self.run = 0
+        self.level = 0          # Mittelwert der letzten Auswertung (Rohwert)
+
+    # ab jetzt auswerten, 'limit' als Rohwert
+    def arm(self, limit=None):
+        if limit != None:
+            self.limit = limit
+        self.clear()
+        self.present = False
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def feed(self, samples, shift=0, start=0, end=None):
+        if not self.enabled:
+            return
+        if end == None:
+            end = len(samples)
+        n = end - start
+        if self.skip > 0:
+            self.skip -= n
+            return
+        self.skip = self.period - n
+        total = 0
+        count = min(n, self.BLOCK)
+        for k in range(start, start + count):
+            total += samples[k]
+        if count == 0:
+            return
+        self.level = (total // count) << shift
+        if (self.level >= self.limit) != self.present:
+            self.run += 1
+            if self.run >= self.DEBOUNCE:
+                self.run = 0
+                self.present = not self.present
+                self.events += 1
+                if self.callback != None:
+                    try:
+                        micropython.schedule(self.callback, self.present)
+                    except RuntimeError:
+                        pass    # Warteschlange voll, 'present' stimmt trotzdem
+        else:
+            self.run = 0
+
+
+if __name__ == "__main__":
+    # bisher belegt die Schleife mit get_current() die CPU, bis eine Lok Strom zieht;
+    # hier die CPU-Zeit von PRESENCEDETECTOR je Sekunde Wartezeit (Blöcke wie von
+    # SAMPLER je UPDATE_MS), nach 2 s wird eine Lok (20 mA) aufgesetzt
+    import utime
+    from classes.sampler import SAMPLER
+    from classes.hbridge import DRV8871
+
+    driver = DRV8871(28, 29, 3)
+    rate = SAMPLER.RATE
+    block = rate * SAMPLER.UPDATE_MS // 1000
+    idle = [driver.mA2raw(2 + k % 3) >> 4 for k in range(block)]
+    loco = [driver.mA2raw(20 + k % 3) >> 4 for k in range(block)]
+    seen = []
+    detector = PRESENCEDETECTOR(rate, driver.mA2raw(10), seen.append)
+    detector.arm()
+    blocks = 0
+    t = utime.ticks_us()
+    for k in range(400):                            # 4 s
+        detector.feed(idle if k < 200 else loco, 4)
+        blocks += 1
+        if detector.present:
+            break
+    t = utime.ticks_diff(utime.ticks_us(), t)
+    print(f"Lok erkannt nach {(blocks - 200) * SAMPLER.UPDATE_MS} ms, Ereignis {seen}, "
+          f"CPU {t * 1000 // (blocks * SAMPLER.UPDATE_MS)} µs je s Wartezeit")
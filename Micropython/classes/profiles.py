@@ -0,0 +1,115 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Gespeicherte Dekoder-Profile für die Lok-Suche ("L?")
+#
+# Ein Profil hält, was beim Auslesen auf dem Programmiergleis herauskam, und
+# steht unter Hersteller (CV 8), Version (CV 7) und Adresse in einer kleinen
+# JSON-Datei im Flash (wie CALIBRATION):
+#
+#   {"151/40/3": {"address": 3, "long": false, "speedsteps": 128,
+#                 "cvs": {"8": 151, "7": 40, "29": 6, "1": 3}, "used": 7}, ...}
+#
+# Bei der nächsten Suche bestätigt identify() ein Profil mit je einer Byte-
+# Prüfung (CVREADER.confirm()) für die gespeicherten CVs - 4 bis 5 Pakete statt
+# Bit für Bit lesen (9 Pakete je CV). Probiert werden die zuletzt benutzten
+# Profile zuerst, höchstens TRIES; ein fremder Dekoder fällt meist schon bei
+# CV 8 durch. Ohne Treffer wird wie bisher gelesen und das Profil mit add()
+# gespeichert, mehr als MAX Profile verdrängen das am längsten unbenutzte.
+#
+# ----------------------------------------------------------------------
+
+import json
+
+
+class PROFILES:
+
+    FILE = "profiles.json"
+    MAX = 16                    # Profile in der Datei
+    TRIES = 3                   # Profile je Suche, danach wird gelesen
+
+    def __init__(self, path=FILE):
+        self.path = path
+        self.data = {}
+        self.used = 0           # Zähler für 'used' (zuletzt benutzt = größter Wert)
+
+    # gespeicherte Profile lesen, ohne Datei bleibt alles leer
+    @classmethod
+    def load(cls, path=FILE):
+        profiles = cls(path)
+        try:
+            with open(path) as f:
+                profiles.data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        for profile in profiles.data.values():
+            profiles.used = max(profiles.used, profile["used"])
+        return profiles
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.data, f)
+
+    @staticmethod
+    def key(cv8, cv7, address):
+        return f"{cv8}/{cv7}/{address}"
+
+    # Profile, zuletzt benutzte zuerst
+    def candidates(self):
+        return sorted(self.data.values(), key=lambda profile: -profile["used"])
+
+    def touch(self, profile):
+        self.used += 1
+        profile["used"] = self.used
+
+    # Profil des Dekoders auf dem Gleis oder None; 'reader' ist ein CVREADER
+    def identify(self, reader):
+        for profile in self.candidates()[:self.TRIES]:
+            cvs = profile["cvs"]
+            if reader.confirm({int(cv): cvs[cv] for cv in cvs}):
+                self.touch(profile)
+                return profile
+        return None
+
+    # gelesene CVs ({CV: Wert}, mindestens 8 und 7) als Profil übernehmen
+    def add(self, cvs, address, long, speedsteps):
+        profile = {"address": address, "long": bool(long), "speedsteps": speedsteps,
+                   "cvs": {str(cv): cvs[cv] for cv in cvs}, "used": 0}
+        self.touch(profile)
+        self.data[self.key(cvs[8], cvs[7], address)] = profile
+        while len(self.data) > self.MAX:
+            oldest = min(self.data, key=lambda key: self.data[key]["used"])
+            del self.data[oldest]
+        return profile
+
+
+if __name__ == "__main__":
+    # Lok-Suche wie get_loco_profile() in den Zentralen, Gleiszeit (RECORDER) beim ersten
+    # Mal (Auslesen) und beim zweiten Mal (gespeichertes Profil bestätigen)
+    import os
+    from classes.recorder import RECORDER, DECODER
+    from classes.servicemode import SERVICEMODE
+    from classes.cvreader import CVREADER
+
+    SERVICEMODE.TRACK_BACKEND = RECORDER()
+    sm = SERVICEMODE("DRV8871", 27, 28, 29, 3, 26)
+    sm.begin()
+    sm.loop()   # Einschaltzyklus
+    profiles = PROFILES("profiles_test.json")
+    profiles.add({8: 145, 7: 32, 29: 6, 1: 5}, 5, False, 128)          # andere Lok
+    for scan in ("erste Suche", "zweite Suche"):
+        decoder = DECODER(sm, {8: 151, 7: 40, 29: 0x26, 17: 0xc4, 18: 0xd2})
+        sm.cv_cache.clear()
+        reader = CVREADER(decoder)
+        profile = PROFILES.load(profiles.path).identify(reader) if scan != "erste Suche" else None
+        if profile == None:
+            cvs = {cv: reader.read(cv) for cv in (8, 7, 29, 17, 18)}
+            profile = profiles.add(cvs, (cvs[17] - 192) * 256 + cvs[18], True, 128)
+            profiles.save()
+        print(f"{scan:<13}: Lok {profile['address']}, {reader.packets} Pakete, "
+              f"{decoder.time_us / 1000:.0f} ms Gleiszeit")
+    sm.end()
+    os.remove(profiles.path)
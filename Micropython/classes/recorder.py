@@ -0,0 +1,208 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Aufzeichnendes Gleis: Ersatz für die Statemachine in BITGENERATOR.put()
+#
+# Jedes Wort wird mit dem Zeitpunkt (µs) aufgezeichnet, zu dem die Statemachine
+# es zu senden beginnen würde. Die Zeit ergibt sich aus den Bitlängen des
+# PIO-Programms 'dccbit' (1 = 2 x 58 µs, 0 = 2 x 100 µs), nicht aus der Uhr -
+# die Aufzeichnung ist damit auf Host und pico gleich.
+#
+#   RECORDER()          Worte im Speicher (times, words)
+#   RECORDER("gleis.txt")  je Wort eine Zeile "<µs> <Wort hex>" in die Datei
+#
+# Benutzung (im Verzeichnis Micropython, mit den Ersatzmodulen aus host/):
+#     import sys; sys.path[:0] = ["host", "."]
+#     from classes.recorder import RECORDER
+#     from classes.operationmode import OPERATIONS as OP
+#     OP.TRACK_BACKEND = RECORDER()
+#     OP("DRV8871", 27, 28, 29, 3, 26); OP.begin(); OP.ctrl_loco(3); OP.drive(1, 20)
+#     for t, packet, ok in OP.TRACK_BACKEND.packets(): print(t, packet.hex(), ok)
+#
+# DECODER bildet für Messungen im Servicemode einen Dekoder auf dem Programmier-
+# gleis nach: ack() wertet die aufgezeichneten Prüf-Pakete aus und bestätigt
+# wie ein echter Dekoder mit den Werten aus 'values' ({CV: Wert}).
+#
+# ----------------------------------------------------------------------
+
+from micropython import const
+
+ONE_US = const(116)
+ZERO_US = const(200)
+MIN_PREAMBLE = const(10)       # so viele Einsen muss ein Dekoder mindestens sehen
+
+
+class RECORDER:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.file = None
+        if path != None:
+            self.file = open(path, "w")
+        self.clear()
+
+    def clear(self):
+        self.times = []
+        self.words = []
+        self.time_us = 0        # Sendebeginn des nächsten Wortes
+        self.count = 0
+
+    # Sendedauer eines Wortes in µs
+    @staticmethod
+    def airtime(word):
+        ones = bin(word).count("1")
+        return ones * ONE_US + (32 - ones) * ZERO_US
+
+    # wie StateMachine.put(): ein Wort oder ein Puffer von Worten
+    def put(self, words):
+        if type(words) == int:
+            words = (words,)
+        for word in words:
+            word &= 0xffffffff
+            if self.file != None:
+                self.file.write(f"{self.time_us} {word:08x}\n")
+            else:
+                self.times.append(self.time_us)
+                self.words.append(word)
+            self.time_us += self.airtime(word)
+            self.count += 1
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+    # Aufzeichnung aus einer Datei wieder einlesen
+    @classmethod
+    def load(cls, path):
+        recorder = cls()
+        f = open(path)
+        for line in f:
+            t, word = line.split()
+            recorder.times.append(int(t))
+            recorder.words.append(int(word, 16))
+        f.close()
+        if len(recorder.words) > 0:
+            recorder.time_us = recorder.times[-1] + cls.airtime(recorder.words[-1])
+            recorder.count = len(recorder.words)
+        return recorder
+
+    # Bitstrom zurück in DCC-Pakete: [(µs am Startbit, Bytes ohne XOR, XOR ok), ...]
+    def packets(self):
+        result = []
+        ones = 0
+        state = 0               # 0 = Präambel, 1 = Datenbits, 2 = Trenn- oder Endbit
+        byte = 0
+        nbits = 0
+        data = []
+        start = 0
+        for n in range(len(self.words)):
+            t = self.times[n]
+            word = self.words[n]
+            for i in range(31, -1, -1):
+                bit = (word >> i) & 1
+                if state == 0:
+                    if bit:
+                        ones += 1
+                    else:
+                        if ones >= MIN_PREAMBLE:
+                            state = 1
+                            data = []
+                            byte = 0
+                            nbits = 0
+                            start = t
+                        ones = 0
+                elif state == 1:
+                    byte = (byte << 1) | bit
+                    nbits += 1
+                    if nbits == 8:
+                        data.append(byte)
+                        state = 2
+                elif bit == 0:
+                    state = 1
+                    byte = 0
+                    nbits = 0
+                else:
+                    err = 0
+                    for b in data:
+                        err ^= b
+                    result.append((start, bytes(data[:-1]), err == 0 and len(data) > 1))
+                    state = 0
+                    ones = 1    # das Endbit darf zur nächsten Präambel gehören
+                t += ONE_US if bit else ZERO_US
+        return result
+
+
+class DECODER:
+
+    def __init__(self, sm, values, bits=True):
+        self.sm = sm            # SERVICEMODE mit RECORDER als TRACK_BACKEND
+        self.values = values
+        self.bits = bits        # beantwortet Bit-Prüfungen
+        self.time_us = 0        # Gleiszeit aller Prüfungen
+
+    def verify(self, cv, value):
+        self.sm.verify(cv, value)
+
+    def verify_bit(self, cv, bit, value):
+        self.sm.verify_bit(cv, bit, value)
+
+    def write(self, cv, value):
+        self.sm.write(cv, value)
+        self.values[cv] = value
+        self.ack()
+
+    def ack(self):
+        self.sm.ack()
+        recorder = self.sm.TRACK_BACKEND
+        ack = False
+        for t, packet, ok in recorder.packets():
+            if ok and len(packet) == 3 and packet[0] & 0xf0 == 0x70:
+                value = self.values.get(((packet[0] & 3) << 8 | packet[1]) + 1, 0)
+                if packet[0] & 0x0c == 0x04:
+                    ack = packet[2] == value
+                elif packet[0] & 0x0c == 0x08 and packet[2] & 0xf0 == 0xe0 and self.bits:
+                    ack = (value >> (packet[2] & 7) & 1) == (packet[2] >> 3 & 1)
+        self.time_us += recorder.time_us
+        recorder.clear()
+        return ack
+
+    def __getattr__(self, name):    # recall(), remember() von SERVICEMODE
+        return getattr(self.sm, name)
+
+
+if __name__ == "__main__":
+    from classes.encoder import DCCENCODER
+    recorder = RECORDER()
+    for packet in ([0x03, 0x74], [0xc4, 0xd2, 0x3f, 0xb4], [0xff, 0x00]):
+        recorder.put(DCCENCODER.encode(packet))
+    for t, packet, ok in recorder.packets():
+        print(f"{t:>8} µs  {packet.hex():<10} {'OK' if ok else 'FEHLER'}")
+    print(f"{recorder.count} Worte, {recorder.time_us / 1000} ms")
+
+    # Refresh mit 10 Loks aufzeichnen: gemessener Abstand der Fahrstufen-Pakete je Lok
+    # gegen das Zeitbudget aus ELECTRICAL.budget()
+    from classes.operationmode import OPERATIONS as OP
+    OP.TRACK_BACKEND = RECORDER()
+    OP("DRV8871", 27, 28, 29, 3, 26)
+    OP.begin()
+    for address in range(1, 11):
+        OP.ctrl_loco(address)
+    for i in range(2 * OP.AUX_INTERVAL):
+        OP.loop()
+    OP.TRACK_BACKEND.clear()
+    for i in range(OP.AUX_INTERVAL + 1):
+        OP.loop()
+    last = {}
+    worst = 0
+    packets = OP.TRACK_BACKEND.packets()
+    for t, packet, ok in packets:
+        if len(packet) == 2 and packet[1] & 0xc0 == 0x40:   # Fahrstufe 14/28
+            if packet[0] in last:
+                worst = max(worst, t - last[packet[0]])
+            last[packet[0]] = t
+    print(f"{len(packets)} Pakete in {OP.TRACK_BACKEND.time_us / 1000:.1f} ms, "
+          f"Fahrstufe je Lok spätestens alle {worst / 1000:.1f} ms (Budget {OP.budget()['speed_ms']:.1f} ms)")
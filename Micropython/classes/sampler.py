@@ -0,0 +1,309 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Strommessung im Hintergrund: ADC im Dauerbetrieb, DMA schreibt die Werte
+# aus der ADC-FIFO in einen Ringpuffer
+#
+# Der ADC tastet mit RATE Werten/s ab (START_MANY), jedes Ergebnis landet in
+# der FIFO und löst einen DREQ aus. Ein Datenkanal schreibt die 12-Bit-Werte
+# in den Ring; ist er voll, startet der Datenkanal per chain_to einen Steuerkanal,
+# der die Ringadresse in WRITE_ADDR_TRIG des Datenkanals schreibt - der Ring
+# wird so endlos ohne CPU gefüllt (wie der Refresh-Rahmen in BITGENERATOR).
+#
+# update() filtert nur die seit dem letzten Aufruf neuen Werte (ganzzahliger
+# gleitender Mittelwert, Spitzenwert je Block) und läuft per Timer alle
+# UPDATE_MS ms. value() liefert den letzten gefilterten Wert (0..65535 wie
+# read_u16()) ohne zu messen.
+#
+# Ohne DMA (Host, oder dma=False) liest update() einen Block mit read_u16(),
+# ohne Timer rechnet value() vorher selbst nach.
+#
+# Ein 'detector' (z.B. SHORTDETECTOR, weitere per add_detector()) bekommt jeden
+# neuen Block ungefiltert, bevor er in den Mittelwert eingeht, eine 'telemetry' (TELEMETRY) je update()
+# mit neuen Werten den gefilterten Wert. Blöcke aus dem Ring gehen als (Ring, Anfang,
+# Ende) an feed() statt als Ausschnitt - update() fordert so keinen Speicher an und
+# darf auch nach jedem Paket bei gesperrten Interrupts laufen (ELECTRICAL.watch()).
+#
+# Der Ring hält nur RING / RATE s (ca. 100 ms). Kam update() länger nicht dran
+# (z.B. bei gesperrten Interrupts), ist der Ring übergelaufen: das merkt process()
+# an der Zeit seit dem letzten Aufruf, gibt den ganzen Ring (älteste Werte zuerst)
+# weiter, zählt 'overruns' und meldet die verlorenen Werte an Detektoren mit
+# lost(n) (SHORTDETECTOR rechnet das I²t-Konto damit weiter).
+#
+# Der ADC hat genau einen Besitzer: sampler(pin) liefert je Pin immer dieselbe
+# Instanz, Betriebs- und Servicemode melden ihre Verbraucher beim Einschalten an
+# und beim Ausschalten wieder ab; Anzeige und Telemetrie lesen nur value(). Ein
+# langsamer Kanal (add_channel(), z.B. VSYS) wird im Filtertakt mitgemessen: der
+# Dauerbetrieb hält kurz an, eine Einzelwandlung läuft am FIFO vorbei (RESULT),
+# dann geht es weiter - höchstens ein Wert des Stroms fehlt.
+#
+# ----------------------------------------------------------------------
+
+import machine
+import utime
+from array import array
+from micropython import const
+try:
+    import rp2
+    import uctypes
+except ImportError:
+    rp2 = None
+
+ADC_CS = const(0x4004c000)
+ADC_RESULT = const(0x4004c004)
+ADC_FCS = const(0x4004c008)
+ADC_FIFO = const(0x4004c00c)
+ADC_DIV = const(0x4004c010)
+ADC_CLOCK = const(48000000)
+DREQ_ADC = const(36)
+DMA_BASE = const(0x50000000)
+DMA_CH_SIZE = const(0x40)
+DMA_AL2_WRITE_ADDR_TRIG = const(0x2c)
+TREQ_UNPACED = const(0x3f)
+FIRST_ADC_PIN = const(26)
+START_ONCE = const(1 << 2)
+START_MANY = const(1 << 3)
+READY = const(1 << 8)
+
+
+class SAMPLER:
+
+    RATE = 5000                 # Abtastwerte/s
+    RING = const(512)           # Größe des Ringpuffers (Potenz von 2)
+    UPDATE_MS = 10              # Takt des Filters
+    BLOCK = const(16)           # Werte je update() ohne DMA
+
+    def __init__(self, pin, adc=None, rate=RATE, smoothing=0.175, dma=None, detector=None, telemetry=None):
+        self.channel = pin - FIRST_ADC_PIN
+        self.adc = adc if adc != None else machine.ADC(machine.Pin(pin))
+        self.rate = rate
+        self.us_per_sample = 1000000 // rate
+        self.alpha = round(smoothing * 256)     # Glättung in 1/256
+        if dma == None:
+            dma = rp2 != None and hasattr(rp2, "DMA") and hasattr(machine, "mem32")
+        self.dma = dma
+        self.detectors = [] if detector == None else [detector]
+        self.telemetry = telemetry
+        self.channels = []      # langsame Kanäle [Kanal, Verbraucher, Takte, Zähler]
+        self.ring = array('H', bytes(2 * self.RING))
+        self.block = array('H', bytes(2 * self.BLOCK))
+        self.mask = self.RING - 1
+        self.tail = 0
+        self.last_us = 0
+        self.overruns = 0       # Überläufe des Rings
+        self.lost = 0           # dabei verlorene Werte (geschätzt)
+        self.ema = 0
+        self.level = 0
+        self.running = False
+        self.busy = False
+        self.timer = None
+        self.data_channel = None
+        self.control_channel = None
+
+    def begin(self):
+        if self.running:
+            return
+        self.tail = 0
+        if self.dma:
+            self.dma_begin()
+            self.last_us = utime.ticks_us()
+        if hasattr(machine, "Timer"):
+            self.timer = machine.Timer()
+            self.timer.init(mode=machine.Timer.PERIODIC, period=self.UPDATE_MS, callback=self.tick)
+        self.running = True
+
+    def end(self):
+        if not self.running:
+            return
+        if self.timer != None:
+            self.timer.deinit()
+            self.timer = None
+        if self.dma:
+            self.dma_end()
+        self.running = False
+
+    def add_detector(self, detector):
+        self.detectors.append(detector)
+
+    def remove_detector(self, detector):
+        if detector in self.detectors:
+            self.detectors.remove(detector)
+
+    # langsamer Kanal: 'consumer' hat 'pin', 'adc' und add(raw) (wie VSYSMONITOR),
+    # bekommt alle 'period_ms' einen Rohwert 0..65535
+    def add_channel(self, consumer, period_ms=20):
+        self.channels.append([consumer.pin - FIRST_ADC_PIN, consumer, max(1, period_ms // self.UPDATE_MS), 0])
+        consumer.source = self
+
+    def remove_channel(self, consumer):
+        for channel in self.channels:
+            if channel[1] == consumer:
+                self.channels.remove(channel)
+                consumer.source = None
+                return
+
+    def tick(self, timer):
+        self.update()
+
+    # ohne Timer jetzt nachrechnen
+    def poll(self):
+        if self.timer == None:
+            self.update()
+
+    # letzter gefilterter Wert
+    def value(self):
+        self.poll()
+        return self.level
+
+    # Werte samples[start:end] filtern; 'shift' hebt 12-Bit-Werte aus dem Ring auf 16 Bit
+    def feed(self, samples, shift=0, start=0, end=None):
+        if end == None:
+            end = len(samples)
+        for detector in self.detectors:
+            detector.feed(samples, shift, start, end)
+        ema = self.ema
+        alpha = self.alpha
+        peak = 0
+        for i in range(start, end):
+            ema += (((samples[i] << shift) - ema) * alpha) >> 8
+            if ema > peak:
+                peak = ema
+        self.ema = ema
+        if end > start:
+            self.level = peak
+        return end - start
+
+    # neue Werte seit dem letzten Aufruf filtern, höchstens einen Ring
+    def update(self):
+        if self.busy:           # Timer während eines direkten Aufrufs
+            return 0
+        self.busy = True
+        try:
+            n = self.process()
+            if n > 0 and self.telemetry != None:
+                self.telemetry.add(self.level)
+            for channel in self.channels:
+                channel[3] += 1
+                if channel[3] >= channel[2]:
+                    channel[3] = 0
+                    channel[1].add(self.read_channel(channel[0], channel[1].adc))
+            return n
+        finally:
+            self.busy = False
+
+    def process(self):
+        if not (self.dma and self.running):
+            block = self.block
+            for i in range(self.BLOCK):
+                block[i] = self.adc.read_u16()
+            return self.feed(block)
+        head = ((self.data_channel.write - self.address) >> 1) & self.mask
+        tail = self.tail
+        self.tail = head
+        now = utime.ticks_us()
+        due = utime.ticks_diff(now, self.last_us) // self.us_per_sample   # Werte seit dem letzten Mal
+        self.last_us = now
+        ring = self.ring
+        size = self.RING
+        if due >= self.RING - (self.RING >> 3):     # übergelaufen (mit Reserve für Zeitfehler)
+            lost = max(0, due - self.RING)
+            self.overruns += 1
+            self.lost += lost
+            n = self.feed(ring, 4, head, size) + self.feed(ring, 4, 0, head)
+            for detector in self.detectors:
+                if hasattr(detector, "lost"):
+                    detector.lost(lost)
+            return n
+        if head == tail:
+            return 0
+        if head > tail:
+            return self.feed(ring, 4, tail, head)
+        n = self.feed(ring, 4, tail, size)
+        return n + self.feed(ring, 4, 0, head)
+
+    # einen Wert eines anderen Kanals; im Dauerbetrieb an FIFO und Ring vorbei
+    def read_channel(self, channel, adc):
+        if not (self.dma and self.running):
+            return adc.read_u16()
+        cs = 1 | (self.channel << 12)
+        machine.mem32[ADC_CS] = cs                                    # START_MANY aus
+        while not machine.mem32[ADC_CS] & READY:
+            pass
+        fcs = machine.mem32[ADC_FCS]
+        machine.mem32[ADC_FCS] = fcs & ~1                             # nicht in die FIFO
+        machine.mem32[ADC_CS] = 1 | (channel << 12) | START_ONCE
+        while not machine.mem32[ADC_CS] & READY:
+            pass
+        raw = machine.mem32[ADC_RESULT] << 4
+        machine.mem32[ADC_FCS] = fcs
+        machine.mem32[ADC_CS] = cs | START_MANY
+        return raw
+
+    # ---------------- DMA-Betrieb -----------------
+    def dma_begin(self):
+        self.address = uctypes.addressof(self.ring)
+        self.pointer = array('I', [self.address])
+        machine.mem32[ADC_CS] = 1 | (self.channel << 12)              # EN, AINSEL
+        machine.mem32[ADC_DIV] = (ADC_CLOCK // self.rate - 1) << 8
+        machine.mem32[ADC_FCS] = 1 | (1 << 3) | (1 << 24)             # EN, DREQ_EN, THRESH = 1
+        while not machine.mem32[ADC_FCS] & (1 << 8):                  # FIFO leeren
+            machine.mem32[ADC_FIFO]
+        self.data_channel = rp2.DMA()
+        self.control_channel = rp2.DMA()
+        trigger = DMA_BASE + self.data_channel.channel * DMA_CH_SIZE + DMA_AL2_WRITE_ADDR_TRIG
+        ctrl = self.control_channel.pack_ctrl(size=2, inc_read=False, inc_write=False, treq_sel=TREQ_UNPACED)
+        self.control_channel.config(read=self.pointer, write=trigger, count=1, ctrl=ctrl)
+        ctrl = self.data_channel.pack_ctrl(size=1, inc_read=False, inc_write=True, treq_sel=DREQ_ADC,
+                                           chain_to=self.control_channel.channel)
+        self.data_channel.config(read=ADC_FIFO, write=self.ring, count=self.RING, ctrl=ctrl, trigger=True)
+        machine.mem32[ADC_CS] = 1 | START_MANY | (self.channel << 12)
+
+    def dma_end(self):
+        machine.mem32[ADC_CS] = 1 | (self.channel << 12)
+        machine.mem32[ADC_FCS] = 0
+        if self.control_channel != None:
+            self.control_channel.active(0)
+            self.control_channel.close()
+            self.control_channel = None
+        if self.data_channel != None:
+            self.data_channel.active(0)
+            self.data_channel.close()
+            self.data_channel = None
+        while not machine.mem32[ADC_FCS] & (1 << 8):
+            machine.mem32[ADC_FIFO]
+
+
+# der eine Besitzer des ADC an 'pin' (Betriebs- und Servicemode teilen ihn sich)
+SAMPLERS = {}
+
+
+def sampler(pin, adc=None, smoothing=0.175):
+    if pin not in SAMPLERS:
+        SAMPLERS[pin] = SAMPLER(pin, adc, smoothing=smoothing)
+    return SAMPLERS[pin]
+
+
+if __name__ == "__main__":
+    import utime
+    # alt: 200 x read_u16() mit Gleitkomma-Glättung je Aufruf, neu: letzter gefilterter Wert
+    adc = machine.ADC(machine.Pin(26))
+    t = utime.ticks_us()
+    for n in range(10):
+        value = 0
+        peak = 0
+        for i in range(200):
+            value = (adc.read_u16() - value) * 0.175 + value * (1 - 0.175)
+            peak = max(value, peak)
+    t_old = utime.ticks_diff(utime.ticks_us(), t) / 10
+    sampler = SAMPLER(26, adc)
+    sampler.begin()
+    utime.sleep_ms(50)
+    t = utime.ticks_us()
+    for n in range(1000):
+        sampler.value()
+    t_new = utime.ticks_diff(utime.ticks_us(), t) / 1000
+    sampler.end()
+    print(f"get_current alt {t_old:8.1f} µs, neu {t_new:6.1f} µs ({'DMA' if sampler.dma else 'ohne DMA'})")
@@ -64,8 +64,19 @@
 #
 import machine
 from classes.bitgenerator import BITGENERATOR as bitgenerator
+from classes.encoder import DCCENCODER
+from classes.sampler import SAMPLER, sampler
+from classes.shortdetector import fixed
+from classes.hbridge import hbridge
+from classes.ackdetector import ACKDETECTOR
+from classes.calibration import CALIBRATION, CALIBRATOR
+from classes.presencedetector import PRESENCEDETECTOR
 from micropython import const
 import utime
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 DEBUG = False
 #DEBUG = True
@@ -80,19 +91,21 @@ DEBUG = False
                                
 class ELECTRICAL_SM:
 
-    LMD18200_QUIESCENT_CURRENT = 17.0
-    DRV8871_QUIESCENT_CURRENT = 13.0
-    LMD18200_SENS_SHUNT = 20000                # Ohm
-    AREF_VOLT = 3300                           # mV !!
-    DENOISE_SAMPLES = 200                      # Anzahl der Messzyklen, für Rauschunterdrückung
-    LMD18200_SENS_AMPERE_PER_AMPERE = 0.000377 # Empfindlichkeit: 377µA / A lt. Datenblatt
     SHORT = 1000                               # erlaubter max. Strom in mA
-    SM_SHORT = 250                             # im Servicemode Power-On-Cycle für die zul. Dauer erlaubter max. Strom (mA)
+    SM_SHORT = 250                             # im Servicemode für die zul. Dauer erlaubter max. Strom (mA), jederzeit
     SM_SHORT_MS = 100                          # zul. Dauer des erhöhten Stromes
     PREAMBLE = 14                              # Standard Präambel für DCC-Instruktionen
     LONG_PREAMBLE = 24                         # Präambel f. Servicemode
-    ACK_TRESHOLD = 40                          # Hub f. Ack
+    ACK_TRESHOLD = 40                          # Hub f. Ack, höchstens (sonst nach gemessenem Rauschen)
+    ACK_TRESHOLD_MIN = 15                      # Hub f. Ack, mindestens
+    ACK_MIN_US = 5000                          # kürzere Impulse sind Störungen (ACK: 6 ms +/- 1 ms)
+    ACK_MAX_US = 12000                         # längere eine Laststufe
     CURRENT_SMOOTHING = 0.175                  # Glättung der Messergebnisse versuchen
+    PRESENCE_FACTOR = 4                        # Lok erkannt ab so viel x Rauschen über dem Ruhestrom
+    CALIBRATION_SAMPLES = 2048                 # Werte je Phase der Kalibrierung (bei 5 kS/s ca. 0,4 s)
+    WAIT_PACKETS = 2                           # IDLE-Pakete je Runde in wait_for_loco() (füllen die TX-FIFO)
+    WAIT_MS = 15                               # danach so lange warten, kürzer als die FIFO ausgibt (2 x ca. 8,3 ms)
+    TRACK_BACKEND = None                       # statt der Statemachine, z.B. RECORDER (classes/recorder.py)
     
     # preamble 0 11111111 0 00000000 0 11111111 1
     IDLE =      [ const(0b11111111111111111111111111111111), const(0b11110111111110000000000111111111) ]
@@ -105,12 +118,20 @@ class ELECTRICAL_SM:
     # DCC- und H-Bridge-LMD18200T-Modul elektrische Steuerung
     def __init__(self, H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN):
         self.motordriver = H_BRIDGE   
-        self.brake = machine.Pin(BRAKE_PIN, machine.Pin.OUT)
-        self.pwm = machine.Pin(PWM_PIN, machine.Pin.OUT)
-        self.power = machine.Pin(POWER_PIN, machine.Pin.OUT)
+        self.driver = hbridge(H_BRIDGE, BRAKE_PIN, PWM_PIN, POWER_PIN)   # Pins und Kalibrierung (classes/hbridge.py)
         self.dir_pin = machine.Pin(DIR_PIN, machine.Pin.OUT)
         self.analog_in = machine.ADC(machine.Pin(ACK_PIN))
-        self.power_state = self.power.value()
+        self.calibration = CALIBRATION.load()       # Ruhestrom, Rauschen, Steigung (classes/calibration.py)
+        self.noise_mA = self.calibration.apply(self.driver)
+        self.sampler = sampler(ACK_PIN, self.analog_in, smoothing=self.CURRENT_SMOOTHING)   # gemeinsamer Besitzer des ADC
+        self.short_detector = None
+        self.sm_detector = None
+        self.ack_detector = ACKDETECTOR(SAMPLER.RATE, 0, 0, self.ACK_MIN_US, self.ACK_MAX_US)
+        self.presence = PRESENCEDETECTOR(SAMPLER.RATE, callback=self.loco_found)   # Lok-Erkennung, nur während wait_for_loco()
+        self.found = None                           # Flag, auf das wait_for_loco() wartet
+        self.power_state = self.driver.power.value()
+        self.set_limits()
+        self.ack_threshold = self.ACK_TRESHOLD   # zuletzt benutzte Schwelle in mA
         self.ack_committed = False
         self.buffer_dirty = False
         self.set_initial_state()
@@ -121,118 +142,154 @@ class ELECTRICAL_SM:
         self.hardreset = False
         self.power_on_cycle = 20
         
-        self.statemachine = bitgenerator(self.dir_pin, model=self.motordriver)
+        self.statemachine = bitgenerator(self.dir_pin, model=self.motordriver, backend=self.TRACK_BACKEND)
 #        self.statemachine.begin()
 
-        self.messtimer = utime.ticks_ms()
-
-    # LMD18200T
-    # Logiktabelle:
-    # PWM | Dir | Brake | Output
-    # ----+-----+-------+-------
-    #  H  |  H  |   L   | A1, B2 -> A = VCC, B = GND
-    #  H  |  L  |   L   | A2, B1 -> A = GND, B = VCC
-    #  L  |  X  |   L   | A1, B1 -> Brake (Motor kurzgeschlossen über VCC
-    #  H  |  H  |   H   | A1, B1 -> Brake (Motor kurzgeschlossen über VCC
-    #  H  |  L  |   H   | A2, B2 -> Brake (Motor kurzgeschlossen über GND
-    #  L  |  X  |   H   | None   -> Power off
-    #
-    # DRV8871 Logiktabelle:
-    # IN1 | IN2 | Output
-    # ----+-----+-------
-    # PWM |  L  | Vorwärts
-    #  L  | PWM | Rückwärts
-    #  L  |  L  | Stop
-    #  H  |  H  | nicht definiert
+    # Schwellen als Rohwerte aus den (ggf. kalibrierten) Werten der H-Brücke
+    def set_limits(self):
+        zero = self.driver.mA2raw(0)
+        self.connect(False)
+        # Programmiergleis: eigene, engere Grenzen statt der des Betriebsmodus (kein I²t)
+        self.short_detector = fixed(self.driver, SAMPLER.RATE, self.SHORT, self.driver.SHORT_HOLD_US)
+        self.sm_detector = fixed(self.driver, SAMPLER.RATE, self.SM_SHORT, self.SM_SHORT_MS * 1000)
+        self.connect(self.power_state == True)
+        self.ack_detector.limits(self.driver.mA2raw(self.ACK_TRESHOLD_MIN) - zero, self.driver.mA2raw(self.ACK_TRESHOLD) - zero)
+        if self.noise_mA != None:
+            self.ack_detector.preset(self.driver.mA2raw(self.noise_mA) - zero)
 
+    # Verbraucher am gemeinsamen SAMPLER an- bzw. abmelden (nur solange eingeschaltet)
+    def connect(self, on):
+        for detector in (self.short_detector, self.sm_detector, self.ack_detector, self.presence):
+            self.sampler.remove_detector(detector)
+            if on:
+                self.sampler.add_detector(detector)
+        if on:
+            self.sampler.telemetry = None
+
+    # Ruhestrom und Rauschen bei eingeschaltetem, leerem Gleis messen und speichern;
+    # mit 'load_mA' stattdessen die Steigung an einer bekannten Last
+    def calibrate(self, load_mA=None):
+        if self.power_state == False:
+            raise(RuntimeError("Power is off"))
+        calibrator = CALIBRATOR(self.CALIBRATION_SAMPLES)
+        self.sampler.add_detector(calibrator)
+        try:
+            while not calibrator.done():
+                self.send2track()
+        finally:
+            self.sampler.remove_detector(calibrator)
+        values = self.calibration.update(self.driver, calibrator, load_mA)
+        self.calibration.save()
+        self.noise_mA = values["noise"]
+        self.set_limits()
+        self.ack_detector.forget()
+        return values
+
+    # Grenze der Lok-Erkennung in mA; ohne Kalibrierung gilt 'fallback'
+    def presence_mA(self, fallback=-1):
+        if self.noise_mA == None:
+            return fallback
+        return self.PRESENCE_FACTOR * self.noise_mA
+
+    # (Lok auf dem Gleis?, Strom in mA)
+    def loco_present(self, fallback=-1):
+        I = self.get_current()
+        return (I >= self.presence_mA(fallback), I)
+
+    # Callback des PRESENCEDETECTOR (über micropython.schedule): wartende Task wecken
+    def loco_found(self, present):
+        if present and self.found != None:
+            self.found.set()
+
+    # auf eine Lok warten: True, sobald PRESENCEDETECTOR sie erkennt, False nach 'timeout_ms'.
+    # Je Runde nur WAIT_PACKETS IDLE-Pakete in die FIFO, dann bis zu WAIT_MS auf das Flag warten:
+    # das Gleis bekommt weiter Pakete, die CPU ist die meiste Zeit frei für andere Tasks.
+    async def wait_for_loco(self, timeout_ms, fallback=-1):
+        if self.power_state == False:
+            raise(RuntimeError("Power is off"))
+        try:
+            self.found = asyncio.ThreadSafeFlag()   # MicroPython: aus dem Scheduler heraus sicher
+        except AttributeError:
+            self.found = asyncio.Event()            # Host (CPython)
+        self.presence.arm(self.driver.mA2raw(self.presence_mA(fallback)))
+        end = utime.ticks_add(utime.ticks_ms(), timeout_ms)
+        try:
+            while not self.presence.present:
+                left = utime.ticks_diff(end, utime.ticks_ms())
+                if left <= 0:
+                    break
+                for i in range(self.WAIT_PACKETS):
+                    self.loop()               # misst dabei auch (SAMPLER.update), ggf. setzt der Callback das Flag
+                if self.presence.present:
+                    break
+                try:
+                    await asyncio.wait_for(self.found.wait(), min(left, self.WAIT_MS) / 1000)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.presence.stop()
+            self.found = None
+        return self.presence.present
+
+    # Logiktabellen der H-Brücken sh. classes/hbridge.py
     def power_off(self):
-        self.brake.value(1)  
-        self.pwm.value(0)
+        self.driver.off()
         self.statemachine.end()
-        self.power.value(False)
         self.power_state = False
+        self.ack_detector.forget()
+        self.connect(False)
+        self.sampler.end()
 
 
     def power_on(self):
         self.set_initial_state()
-        self.pwm.value(1)
         self.power_time = utime.ticks_ms()
-        self.brake.value(0)  
-        self.power.value(True)
+        self.driver.on()
         self.power_state = True
+        self.ack_detector.forget()        # Ruhestrom nach dem Einschalten neu lernen
+        self.short_detector.reset()
+        self.sm_detector.reset()
+        self.connect(True)
+        self.sampler.begin()
         self.statemachine.begin()
         self.chk_short()
 
-    def raw2mA(self, analog_value):
-        analog_value = analog_value * self.AREF_VOLT / 65535  # ADC mappt auf 0..65535
-        if self.motordriver == "DRV8871":
-            return analog_value - self.DRV8871_QUIESCENT_CURRENT
-        analog_value /= self.LMD18200_SENS_SHUNT  # Rsense
-        return (analog_value / self.LMD18200_SENS_AMPERE_PER_AMPERE) - self.LMD18200_QUIESCENT_CURRENT  # lt. Datenblatt 377 µA / A +/- 10 %
-
+    # frisch gefiltert: die ACK-Prüfung läuft bei gesperrten Interrupts, ohne Timer
     def get_current(self):
-        analog_value = 0
-        max_value = 0
-        for i in range(0, self.DENOISE_SAMPLES):
-            analog_value = (self.analog_in.read_u16() - analog_value) * self.CURRENT_SMOOTHING + analog_value * (1 - self.CURRENT_SMOOTHING)
-            max_value = max(analog_value, max_value)
-        return round(self.raw2mA(max_value))
+        self.sampler.update()
+        return self.driver.raw2mA(self.sampler.level)
     
+    # der SHORTDETECTOR hat die Pins schon abgeschaltet, hier wird nur noch aufgeräumt
     def chk_short(self):
-        if self.get_current() > self.SHORT: # Kurzschluss (ggf. im Servicemode
+        self.sampler.update()
+        if self.short_detector.tripped:
+            self.power_off()
             raise(RuntimeError("!!! KURZSCHLUSS !!!"))
-
-    def chk_sm_short(self, end_time):  #end_time = start + 100ms
-        if end_time < utime.ticks_ms() and self.get_current() > self.SM_SHORT: # Kurzschluss (ggf. im Servicemode
+        if self.sm_detector.tripped:    # SM_SHORT länger als SM_SHORT_MS, nicht nur im Power-On-Cycle
+            self.power_off()
             raise(RuntimeError("!!! ZU HOHER STROM IM SERVICEMODE !!!"))
 
-    def chk_ack(self, quiescent_current):
-        I_load = self.get_current()
+    # Ruhestrom und Rauschen während der RESET-Pakete lernen, dann Schwelle festlegen
+    def arm_ack(self):
+        self.sampler.update()
+        self.ack_detector.arm()
+        self.ack_threshold = self.driver.raw2mA(self.ack_detector.threshold) + self.driver.offset
         if DEBUG:
-            print(f"Laststrom {I_load} mA, Ruhestrom: {quiescent_current} mA, Diff: {I_load - quiescent_current} mA, Schwelle: {self.ACK_TRESHOLD} mA, ACK: {I_load - quiescent_current >= self.ACK_TRESHOLD} ")
-        return I_load - quiescent_current >= self.ACK_TRESHOLD
+            print(f"Ruhestrom: {self.driver.raw2mA(self.ack_detector.baseline)} mA, Schwelle: {self.ack_threshold} mA")
+
+    # (ACK, Impulsbreite µs, Beginn µs nach dem ersten Prüfpaket) der letzten Prüfung
+    def ack_pulse(self):
+        d = self.ack_detector
+        return (d.acked, d.width_us, d.start_us)
         
    
-    def to_bin(self, num):
-        stream = 0
-        for j in range(0, 8):
-            if num & 1 << (7 - j):
-                stream |= 1
-            stream <<= 1
-        return (stream >> 1) & 0xff 
-        
-    def prepare(self, packet=[]):  # Daten in den Puffer stellen
-        stream = 0
-        bits = 0
-        padding = 0
-        if 2 <= len(packet) <= 5:  # Anzahl Bytes ohne XOR
-            # Streamlänge = jedem Byte ein 0 voran, das XOR-byte + 1 ans Ende + Preamble + Padding auf Wortgrenze (32 Bit)
-            err = 0;
-            for byte in packet:
-                err ^= byte
-            packet.append(err)
-            preamble = self.LONG_PREAMBLE
-            bits = preamble + len(packet) * 9 + 1
-            padding = 32 - (bits % 32) # links mit 1 erweitern bis Wortgrenze
-            for i in range(0, padding + preamble):
-                stream <<= 1
-                stream |= 1
-            for i in packet:
-                stream <<= 9
-                stream |= self.to_bin(i)
-            stream <<= 1
-            stream |= 1
-        return (padding + bits) // 32, stream  # Anzahl der Worte + Bitstream
-            
-                    
     # Long-preamble 0 0111CCAA 0 AAAAAAAA 0 DDDDDDDD 0 EEEEEEEE 1
     # CC=10 Bit Manipulation
     # CC=01 Verify byte
     # CC=11 Write byte
     # CC=10: DDDDDDDD = 111KDBBB mit K=0: Read, K=1: Write, D=0|1 (Datenbit), BBB = Bit 0..7
     def generate_servicemode_instructions(self):  # Schreiben oder Prüfen, CV 1..1024, value=0..255, bit=0..7        
-        words  = []
-        lengths = []
+        packets = []
         
         if self.servicemode_instruction["valid"] == True:
             
@@ -252,12 +309,10 @@ class ELECTRICAL_SM:
                     byte2 |= 0b1000
                 byte2 |= self.servicemode_instruction["bit"]
 
-            l, w = self.prepare([byte0, byte1, byte2])
+            packets.append(DCCENCODER.encode([byte0, byte1, byte2], self.LONG_PREAMBLE))
             self.servicemode_instruction["valid"] = False
-            words.append(w)
-            lengths.append(l)
 
-        return lengths, words
+        return packets
         
 
     def set_servicemode_instruction(self, cv=0, value=0, bit=-1, write=0):  # Schreiben oder Prüfen, CV 1..1024, value=0..255, bit=0..7
@@ -305,11 +360,8 @@ class ELECTRICAL_SM:
             self.hardreset = False
             
         else:
-            l, w = self.generate_servicemode_instructions()
-            for i in range(len(l)):
-                while l[i] > 0:
-                    l[i] -= 1
-                    buffer.append(w[i] >> l[i] * 32 & 0xffffffff)
+            for words in self.generate_servicemode_instructions():
+                buffer.extend(words)
 
             if buffer == []:
                 buffer = self.RESET
@@ -320,17 +372,13 @@ class ELECTRICAL_SM:
         buffer = []
         try:
             if self.power_state == True:
-                if (utime.ticks_ms() - self.messtimer > 100):
-                    self.chk_short()
-                    self.messtimer = utime.ticks_ms()
-     
+                self.chk_short()
                 if self.buffer_dirty:
-                    quiescent_current = self.get_current()   # ermittle Ruhestrom
+                    hardreset = self.hardreset
                     buffer = self.buffering()
                     if self.power_on_cycle > 0:
-                        end_time = utime.ticks_ms() + 100
                         while self.power_on_cycle > 0:
-                            self.chk_sm_short(end_time)
+                            self.chk_short()
                             for word in self.IDLE:
                                 self.statemachine.put(word)
                             self.power_on_cycle -= 1
@@ -339,39 +387,63 @@ class ELECTRICAL_SM:
 
                     if not DEBUG:
                         state = machine.disable_irq()
-
-                    for i in range(5):  #Start min. 3x Reset
-                        for word in self.RESET:
-                            self.statemachine.put(word)
-                    for i in range(6):  # 5+ x verify or write command
-                        if DEBUG:
-                            print("Service Mode Track signal:", i, end=": ")
-                        for word in buffer:
+                    try:
+                        # der ADC misst per DMA durchgehend mit, update() wertet nach jedem
+                        # Paket die neuen Werte aus (Interrupts sind gesperrt). Ist der Ruhestrom
+                        # aus der letzten Transaktion noch gültig, wird er während der RESETs nur
+                        # nachgeführt und es reichen die vorgeschriebenen 3 RESETs.
+                        self.sampler.update()
+                        if self.ack_detector.valid():
+                            resets = 3
+                            self.ack_detector.learn(True)
+                        else:
+                            resets = 3 if self.ack_detector.noise_floor else 5   # Rauschen aus der Kalibrierung
+                            self.ack_detector.learn()
+                        for i in range(resets):  #Start min. 3x Reset
+                            for word in self.RESET:
+                                self.statemachine.put(word)
+                            self.sampler.update()
+                        self.arm_ack()
+                        for i in range(6):  # 5+ x verify or write command
                             if DEBUG:
-                                print("["+bin(word)+"]", end=" ")
-                            self.statemachine.put(word)
-                        if i > 2:
-                            self.ack_committed |= self.chk_ack(quiescent_current)
-                            if self.ack_committed:
-                                while self.chk_ack(quiescent_current):
-                                    pass
+                                print("Service Mode Track signal:", i, end=": ")
+                            for word in buffer:
+                                if DEBUG:
+                                    print("["+bin(word)+"]", end=" ")
+                                self.statemachine.put(word)
+                            self.sampler.update()
+                            if self.ack_detector.busy() or self.ack_detector.done():
                                 break
+                        while self.ack_detector.busy():  # Impuls bis zur fallenden Flanke ausmessen
+                            for word in self.RESET:
+                                self.statemachine.put(word)
+                            self.sampler.update()
+                        load_step = self.ack_detector.done() and not self.ack_detector.acked
+                        self.ack_detector.stop()
+                        self.ack_committed |= self.ack_detector.acked
                         if DEBUG:
                             print()
-                            print(f"{'No ' if not self.ack_committed else '   '} ACK")
+                            print(f"{'No ' if not self.ack_committed else '   '} ACK, Impuls {self.ack_detector.width_us} µs, "
+                                  f"{self.ack_detector.rejected} Störimpuls(e)")
 
-                    if self.servicemode_instruction["write"] == True:
-                        for i in range(7):  # 6+ x identical write command (Recovery)
-                            for word in buffer:
-                                self.statemachine.put(word)
+                        if self.servicemode_instruction["write"] == True:
+                            for i in range(7):  # 6+ x identical write command (Recovery)
+                                for word in buffer:
+                                    self.statemachine.put(word)
                         
-                    for i in range(3):
-                        for word in self.RESET: # 1 x RESET
-                            self.statemachine.put(word)
+                        for i in range(3):
+                            for word in self.RESET: # 1 x RESET
+                                self.statemachine.put(word)
                         
-                    
-                    if not DEBUG:
-                        machine.enable_irq(state)
+                        # Ruhestrom bis zur nächsten Transaktion weiter verfolgen (Timer), nach
+                        # einer Laststufe oder einem Hard-Reset neu lernen
+                        if load_step or hardreset:
+                            self.ack_detector.forget()
+                        else:
+                            self.ack_detector.learn(True)
+                    finally:
+                        if not DEBUG:
+                            machine.enable_irq(state)
 
                     self.buffer_dirty = False
                         
@@ -389,8 +461,26 @@ class SERVICEMODE(ELECTRICAL_SM):
     REPETITIONS = 5
 
     def __init__(self, H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN):
+        self.cv_cache = {}      # {CV: Wert} des Dekoders auf dem Gleis, bis Schreiben oder Aus-/Einschalten
         super().__init__(H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN)
         
+    # nach dem Ausschalten kann ein anderer Dekoder auf dem Gleis stehen
+    def power_off(self):
+        self.cv_cache.clear()
+        super().power_off()
+
+    def power_on(self):
+        self.cv_cache.clear()
+        super().power_on()
+
+    # gelesener Wert der CV oder None
+    def recall(self, cv):
+        return self.cv_cache.get(cv)
+
+    def remember(self, cv, value):
+        if value != None:
+            self.cv_cache[cv] = value
+
     def end(self):
         if self.power_state == True:
             self.power_off()
@@ -413,7 +503,7 @@ class SERVICEMODE(ELECTRICAL_SM):
         self.ack_committed = False
         return ack
     
-    def manufacturer_reset():
+    def manufacturer_reset(self):
         self.write(8,0)
         self.loop()
 
@@ -429,9 +519,50 @@ class SERVICEMODE(ELECTRICAL_SM):
 
     def write(self, cv=1, value=3):
         # {Long-preamble} 0 011111AA 0 AAAAAAAA 0 DDDDDDDD 0 EEEEEEEE 1
+        if cv == 8:
+            self.cv_cache.clear()       # Rücksetzen, alle Werte können sich ändern
+        else:
+            self.cv_cache.pop(cv, None)
         self.set_servicemode_instruction(cv=cv, value=value, write=True)
         self.loop()
     
             
 # --------------------------------------
 
+
+
+if __name__ == "__main__":
+    # Gleiszeit je CV (Bitweise lesen wie read() in servicemode-pc-interaktiv.py:
+    # 8 x verify_bit + 1 x verify) ohne und mit dem Ruhestrom der letzten Transaktion
+    # bzw. mit dem Rauschen aus der Kalibrierung
+    from classes.recorder import RECORDER
+
+    SERVICEMODE.TRACK_BACKEND = RECORDER()
+    sm = SERVICEMODE("DRV8871", 27, 28, 29, 3, 26)
+    sm.begin()
+    sm.loop()   # Einschaltzyklus
+    for label, cached, noise in (("ohne gespeicherten Ruhestrom", False, 0), ("mit gespeichertem Ruhestrom", True, 0),
+                                 ("mit Rauschen aus der Kalibrierung", False, sm.driver.mA2raw(3) - sm.driver.mA2raw(0))):
+        sm.ack_detector.preset(noise)
+        SERVICEMODE.TRACK_BACKEND.clear()
+        for cv in range(1, 9):
+            for bit in range(8):
+                if not cached:
+                    sm.ack_detector.forget()
+                sm.verify_bit(cv, bit, 1)
+                sm.ack()
+            if not cached:
+                sm.ack_detector.forget()
+            sm.verify(cv, 0)
+            sm.ack()
+        ms = SERVICEMODE.TRACK_BACKEND.time_us / 1000 / 8
+        print(f"{label:<34}: {ms:.1f} ms je CV (Gleiszeit, ohne ACK)")
+
+    # wait_for_loco() ohne Lok: Gleiszeit der IDLE-Pakete gegen die Wartezeit
+    # (Lücken im Datenstrom, wenn die Gleiszeit deutlich kleiner ist)
+    SERVICEMODE.TRACK_BACKEND.clear()
+    start = utime.ticks_ms()
+    found = asyncio.run(sm.wait_for_loco(300))
+    waited = utime.ticks_diff(utime.ticks_ms(), start)
+    print(f"wait_for_loco(300) = {found}: {waited} ms gewartet, {SERVICEMODE.TRACK_BACKEND.time_us / 1000:.0f} ms Gleiszeit")
+    sm.end()
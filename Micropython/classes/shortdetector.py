@@ -0,0 +1,250 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Kurzschluss- und Überlast-Abschaltung im Datenstrom der Strommessung
+#
+# SAMPLER gibt jeden neuen Block von Rohwerten vor dem Filtern an feed(). Die
+# H-Brücke wird in zwei Fällen sofort über ihre Pins abgeschaltet
+# (HBRIDGE.off(): brake = 1, pwm = 0, power = 0) - noch im Timer-Callback, ohne
+# auf die Hauptschleife zu warten:
+#
+#   SHORT     'hold' Werte in Folge über der harten Grenze 'limit' (Kurzschluss)
+#   OVERLOAD  das I²t-Konto ist leer: je Wert kommt I² - I_dauer² dazu, unter dem
+#             Dauerstrom kühlt es wieder ab (nie unter 0). Kurze Einschaltströme
+#             (Servos, Weichendekoder) passen ins Konto, ein anhaltender Überstrom
+#             nicht - je höher, desto schneller.
+#
+# Gerechnet wird nur mit ganzen Zahlen: Grenzen in mA werden einmal in ADC-Rohwerte
+# umgerechnet, das Konto in (12-Bit-Rohwert)² >> SQ_SHIFT je Wert, damit alles
+# unter 2**30 bleibt (keine Speicheranforderung im Callback).
+#
+# Nach dem Abschalten kühlt das Konto mit der Zeit ab (Strom 0); cooldown_ms()
+# sagt, wie lange noch, reset() (beim Einschalten) rechnet die Abkühlung an und
+# lässt wieder einschalten. Wiederholtes Einschalten in einen Kurzschluss füllt
+# das Konto also weiter, bis OVERLOAD eine Pause erzwingt.
+#
+# Schlechteste Abschaltzeit bei SHORT = Haltezeit + Abstand zweier SAMPLER.update():
+#   - mit Timer (Gleissignal per DMA, USE_DMA, oder auf Core 1): Takt des Filters
+#     (SAMPLER.UPDATE_MS = 10 ms)
+#   - ohne DMA sendet ELECTRICAL.transmit() bei gesperrten Interrupts und rechnet
+#     nach jedem Paket selbst nach: Sendedauer des längsten Pakets (budget()
+#     "watch_ms"; nachgerechnet RESET 9,7 ms, Lok-Pakete 8,9 .. 10,0 ms, POM für
+#     Zubehör bis 12,3 ms) - bisher bis zum Ende des ganzen Zyklus (bei 10 Loks
+#     ca. 220 ms, dabei lief der Ring mit ca. 100 ms über)
+# Ist der Ring von SAMPLER trotzdem übergelaufen, rechnet lost() das I²t-Konto für
+# die verlorenen Werte mit dem letzten Strom weiter.
+#
+# ----------------------------------------------------------------------
+
+import utime
+from micropython import const
+
+SHORT = const(1)
+OVERLOAD = const(2)
+SQ_SHIFT = const(8)
+
+
+class SHORTDETECTOR:
+
+    def __init__(self, limit, hold, driver, rate=5000, cont=None, budget=0):
+        self.limit = limit      # harte Grenze als ADC-Rohwert (16 Bit)
+        self.hold = max(1, hold)  # so viele Werte in Folge über der Schwelle
+        self.driver = driver    # HBRIDGE (classes/hbridge.py)
+        self.rate = rate
+        self.cont = 0           # Dauerstrom als (12-Bit-Rohwert)² >> SQ_SHIFT
+        self.budget = budget    # I²t-Konto in denselben Einheiten je Wert, 0 = aus
+        if cont != None:
+            c = cont >> 4
+            self.cont = (c * c) >> SQ_SHIFT
+        self.heat = 0
+        self.sq = 0             # letzter Wert im Konto (für lost())
+        self.last_ms = utime.ticks_ms()   # letzter Block bzw. Abschaltung
+        self.reset()
+
+    def reset(self):
+        self.heat = self.cooled()
+        self.count = 0
+        self.tripped = False
+        self.cause = None       # SHORT oder OVERLOAD
+        self.trip_ms = None
+
+    # Stand des I²t-Kontos, seit dem letzten Block (bzw. dem Abschalten) stromlos abgekühlt
+    def cooled(self):
+        samples = utime.ticks_diff(utime.ticks_ms(), self.last_ms) * self.rate // 1000
+        return max(0, self.heat - samples * self.cont)
+
+    # so lange muss die H-Brücke noch aus bleiben (0 = darf wieder an)
+    def cooldown_ms(self):
+        if self.cont == 0 or self.cause != OVERLOAD:
+            return 0
+        return (self.cooled() * 1000 + self.cont * self.rate - 1) // (self.cont * self.rate)
+
+    # Block samples[start:end] prüfen; 'shift' wie in SAMPLER.feed() (12-Bit-Werte aus dem Ring)
+    def feed(self, samples, shift=0, start=0, end=None):
+        if self.tripped:
+            return True
+        if end == None:
+            end = len(samples)
+        limit = self.limit >> shift
+        down = 4 - shift        # auf 12 Bit für das Konto
+        count = self.count
+        hold = self.hold
+        heat = self.heat
+        cont = self.cont
+        budget = self.budget
+        for i in range(start, end):
+            s = samples[i]
+            if s >= limit:
+                count += 1
+                if count >= hold:
+                    self.heat = heat
+                    self.trip(SHORT)
+                    return True
+            else:
+                count = 0
+            if budget:
+                s >>= down
+                heat += ((s * s) >> SQ_SHIFT) - cont
+                if heat < 0:
+                    heat = 0
+                elif heat >= budget:
+                    self.heat = heat
+                    self.trip(OVERLOAD)
+                    return True
+        self.count = count
+        self.heat = heat
+        if budget and end > start:
+            self.sq = (s * s) >> SQ_SHIFT
+        self.last_ms = utime.ticks_ms()
+        return False
+
+    # 'n' Werte sind verloren (Überlauf des Rings): mit dem letzten Strom weiterrechnen
+    def lost(self, n):
+        if self.tripped or not self.budget or n <= 0:
+            return self.tripped
+        self.heat = max(0, self.heat + n * (self.sq - self.cont))
+        if self.heat >= self.budget:
+            self.trip(OVERLOAD)
+        return self.tripped
+
+    def trip(self, cause=SHORT):
+        self.driver.off()
+        self.tripped = True
+        self.cause = cause
+        self.trip_ms = utime.ticks_ms()
+        self.last_ms = self.trip_ms
+
+
+# Abschaltung mit den Grenzen der H-Brücke (SHORT_MA, SHORT_HOLD_US, OVERLOAD_MA, OVERLOAD_I2T),
+# nur im Betriebsmodus
+def overload(driver, rate):
+    full = (1000 << driver.shift) // driver.scale       # Rohwerte je A (auch über dem Endwert)
+    budget = 0
+    if driver.OVERLOAD_I2T > 0:
+        budget = int(driver.OVERLOAD_I2T * rate * (full >> 4) ** 2) >> SQ_SHIFT
+    return SHORTDETECTOR(driver.mA2raw(driver.SHORT_MA), driver.SHORT_HOLD_US * rate // 1000000, driver,
+                         rate, driver.mA2raw(driver.OVERLOAD_MA), budget)
+
+
+# feste Grenze ohne I²t: länger als 'us' über 'mA' (Servicemode, Programmiergleis)
+def fixed(driver, rate, mA, us):
+    return SHORTDETECTOR(driver.mA2raw(mA), us * rate // 1000000, driver, rate)
+
+
+if __name__ == "__main__":
+    # Abschaltzeiten an nachgespielten Stromverläufen (mA je Abtastwert), bisher (feste
+    # Grenze 1000 mA, 500 µs) gegen Kurzschluss + I²t. Die Blöcke kommen wie im
+    # Betrieb je UPDATE_MS als 12-Bit-Werte. Eine aufgezeichnete Messreihe (mA je
+    # Zeile, RATE Werte/s) lässt sich als Argument anhängen.
+    import sys
+    from classes.sampler import SAMPLER
+    from classes.hbridge import DRV8871
+
+    rate = SAMPLER.RATE
+    block = rate * SAMPLER.UPDATE_MS // 1000
+    us_per_sample = 1000000 // rate
+    driver = DRV8871(28, 29, 3)
+
+    def noisy(mA, n, seed=12345):
+        values = []
+        for k in range(n):
+            seed = (seed * 1103515245 + 12345) & 0x7fffffff
+            values.append(mA + (seed >> 16) % 60 - 30)
+        return values
+
+    def ramp(mA, n):           # induktiver Anstieg über 3 Werte
+        return [120 + (mA - 120) * min(k + 1, 3) // 3 for k in range(n)]
+
+    ms = rate // 1000
+    traces = [("Servo-Anlauf 1,6 A / 150 ms", noisy(150, 50 * ms) + noisy(1600, 150 * ms) + noisy(200, 1000 * ms)),
+              ("Lok-Anfahren 1,2 A / 1 s", noisy(150, 50 * ms) + noisy(1200, 1000 * ms) + noisy(400, 500 * ms)),
+              ("Überlast 1,3 A", noisy(150, 50 * ms) + noisy(1300, 3000 * ms)),
+              ("weicher Kurzschluss 1,8 A", noisy(150, 50 * ms) + noisy(1800, 1000 * ms)),
+              ("harter Kurzschluss", noisy(150, 50 * ms) + ramp(4000, 100 * ms))]
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            traces.append((sys.argv[1], [int(float(line)) for line in f if line.strip()]))
+
+    # Zeit bis zur Abschaltung in µs ab dem ersten Wert über 'start' mA, None = keine
+    def replay(detector, trace, start=1000):
+        samples = [driver.mA2raw(mA) >> 4 for mA in trace]
+        onset = 0
+        while onset < len(trace) and trace[onset] < start:
+            onset += 1
+        for k in range(0, len(samples), block):
+            if detector.feed(samples[k:k + block], 4):
+                return max(0, k + block - onset) * us_per_sample
+        return None
+
+    def show(us):
+        return "-" if us == None else (f"{us / 1000:.1f} ms")
+
+    print(f"{driver.NAME}: Kurzschluss ab {driver.SHORT_MA} mA / {driver.SHORT_HOLD_US} µs, "
+          f"I²t {driver.OVERLOAD_I2T} A²s über {driver.OVERLOAD_MA} mA")
+    for name, trace in traces:
+        old = SHORTDETECTOR(driver.mA2raw(1000), 500 // us_per_sample, driver)
+        new = overload(driver, rate)
+        t_old = replay(old, trace)
+        t_new = replay(new, trace)
+        cause = {SHORT: "Kurzschluss", OVERLOAD: "Überlast", None: ""}[new.cause]
+        print(f"{name:<28} bisher {show(t_old):>9}, neu {show(t_new):>9} {cause:<11} Abkühlen {new.cooldown_ms()} ms")
+
+    # schlechteste Abschaltzeit, der harte Kurzschluss beginnt an jeder Stelle eines Blocks
+    worst = 0
+    for phase in range(block):
+        t = replay(overload(driver, rate), noisy(150, 4 * block + phase) + ramp(4000, 20 * block), driver.SHORT_MA)
+        worst = max(worst, t)
+    print(f"harter Kurzschluss: schlechteste Abschaltzeit {worst} µs "
+          f"(Grenze {driver.SHORT_HOLD_US + SAMPLER.UPDATE_MS * 1000} µs)")
+
+    # Programmiergleis (ELECTRICAL_SM): 1000 mA hart, 250 mA höchstens 100 ms - jederzeit
+    sm_traces = [("Dekoder-Anlauf 400 mA / 50 ms", noisy(20, 50 * ms) + noisy(400, 50 * ms) + noisy(30, 500 * ms)),
+                 ("ACK 80 mA / 6 ms", noisy(20, 50 * ms) + noisy(80, 6 * ms) + noisy(20, 500 * ms)),
+                 ("Motor 300 mA anhaltend", noisy(20, 50 * ms) + noisy(300, 1000 * ms)),
+                 ("Kurzschluss", noisy(20, 50 * ms) + ramp(4000, 100 * ms))]
+    for name, trace in sm_traces:
+        short = fixed(driver, rate, 1000, driver.SHORT_HOLD_US)
+        sm_short = fixed(driver, rate, 250, 100000)
+        t_short = replay(short, trace)
+        t_sm = replay(sm_short, trace, 250)
+        print(f"Servicemode {name:<30} 1000 mA {show(t_short):>9}, 250 mA/100 ms {show(t_sm):>9}")
+
+    # Wiedereinschalten: erst nach dem Abkühlen, wiederholt in einen Kurzschluss füllt das Konto
+    detector = overload(driver, rate)
+    attempts = 0
+    while detector.cooldown_ms() == 0 and attempts < 1000:
+        detector.reset()
+        replay(detector, ramp(4000, 10 * ms))
+        attempts += 1
+    print(f"{attempts} x in den Kurzschluss eingeschaltet, dann Überlast, {detector.cooldown_ms()} ms Pause")
+
+    samples = [driver.mA2raw(1300) >> 4] * block
+    detector = overload(driver, rate)
+    t = utime.ticks_us()
+    for n in range(100):
+        detector.heat = 0
+        detector.feed(samples, 4)
+    print(f"{utime.ticks_diff(utime.ticks_us(), t) / 100:.1f} µs je Block")
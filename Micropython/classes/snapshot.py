@@ -0,0 +1,231 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Sicherung der CVs eines Dekoders (binär, kompakt)
+#
+#   Kopf     <3sBHBBBIH  "CVS", Version, Adresse, Flags (1 = lange Adresse,
+#                        2 = Zubehör), CV 7, CV 8, Zeit (s seit 1970), höchste CV n
+#   Bitmap   (n + 7) // 8 Bytes, Bit (CV - 1) gesetzt = CV gesichert
+#   Werte    je gesicherter CV ein Byte, aufsteigend
+#
+# 50 CVs bis CV 190 brauchen so 40 + 50 Bytes, geschrieben mit einem write().
+# Die Zeit ist immer Unix-Zeit: MicroPython zählt je nach Port ab 2000, der Host ab
+# 1970 - EPOCH gleicht das aus, so stimmen Sicherungen von beiden Seiten überein.
+# from_bytes() prüft die Länge gegen Kopf, Bitmap und gesetzte Bits und lehnt
+# abgeschnittene oder fremde Dateien mit ValueError ab.
+# Für den PC gibt es den Weg nach JSON und CSV und zurück, auf dem Host z.B.
+#
+#   python3 classes/snapshot.py "Lok#3_ESU.cvs" json    (oder csv)
+#   python3 classes/snapshot.py Lok3.json cvs
+#
+# diff() vergleicht zwei Sicherungen ohne Gleis, changed() den Dekoder per
+# Byte-Prüfung (ein Paket je CV statt neun beim Lesen) - die Liste taugt zum
+# gezielten Zurückschreiben. CV 7 und 8 (nur lesbar, Schreiben auf CV 8 setzt
+# zurück) stehen nie darin.
+#
+# ----------------------------------------------------------------------
+
+import json
+import struct
+import time
+
+MAGIC = b"CVS"
+VERSION = 1
+HEADER = "<3sBHBBBIH"
+LONG = 1
+ACCESSORY = 2
+EPOCH = 946684800 if time.gmtime(0)[0] == 2000 else 0     # 1970-01-01 .. 2000-01-01 in s
+
+
+class SNAPSHOT:
+
+    READONLY = (7, 8)
+
+    def __init__(self, address, cv7=0, cv8=0, values=None, timestamp=None, flags=0):
+        self.address = address
+        self.cv7 = cv7
+        self.cv8 = cv8
+        self.values = {} if values == None else values     # {CV: Wert}
+        self.timestamp = int(time.time()) + EPOCH if timestamp == None else timestamp   # Unix-Zeit
+        self.flags = flags
+
+    # ------------------ binär -------------------
+    def to_bytes(self):
+        cvs = sorted(self.values)
+        n = cvs[-1] if len(cvs) > 0 else 0
+        bitmap = bytearray((n + 7) // 8)
+        for cv in cvs:
+            bitmap[(cv - 1) >> 3] |= 1 << ((cv - 1) & 7)
+        return struct.pack(HEADER, MAGIC, VERSION, self.address, self.flags, self.cv7, self.cv8,
+                           self.timestamp, n) + bitmap + bytes(self.values[cv] for cv in cvs)
+
+    @classmethod
+    def from_bytes(cls, data):
+        size = struct.calcsize(HEADER)
+        if len(data) < size:
+            raise(ValueError("Keine CV-Sicherung"))
+        magic, version, address, flags, cv7, cv8, timestamp, n = struct.unpack(HEADER, data[:size])
+        k = size + (n + 7) // 8         # erster Wert
+        if magic != MAGIC or version != VERSION or len(data) < k:
+            raise(ValueError("Keine CV-Sicherung"))
+        values = {}
+        for i in range(size, size + (n + 7) // 8):
+            bits = data[i]
+            cv = (i - size) * 8 + 1
+            while bits:
+                if bits & 1:
+                    if k >= len(data) or cv > n:
+                        raise(ValueError("Keine CV-Sicherung"))
+                    values[cv] = data[k]
+                    k += 1
+                bits >>= 1
+                cv += 1
+        if k != len(data):              # je gesetztem Bit genau ein Wert
+            raise(ValueError("Keine CV-Sicherung"))
+        return cls(address, cv7, cv8, values, timestamp, flags)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    # ------------------ JSON / CSV -------------------
+    def to_json(self):
+        return json.dumps({"address": self.address, "long": bool(self.flags & LONG),
+                           "accessory": bool(self.flags & ACCESSORY), "cv7": self.cv7, "cv8": self.cv8,
+                           "timestamp": self.timestamp,
+                           "cvs": {str(cv): self.values[cv] for cv in sorted(self.values)}})
+
+    @classmethod
+    def from_json(cls, text):
+        d = json.loads(text)
+        flags = (LONG if d["long"] else 0) | (ACCESSORY if d["accessory"] else 0)
+        return cls(d["address"], d["cv7"], d["cv8"], {int(cv): d["cvs"][cv] for cv in d["cvs"]},
+                   d["timestamp"], flags)
+
+    def to_csv(self):
+        lines = ["address,long,accessory,cv7,cv8,timestamp",
+                 f"{self.address},{self.flags & LONG},{self.flags >> 1 & 1},{self.cv7},{self.cv8},{self.timestamp}",
+                 "cv,value"]
+        for cv in sorted(self.values):
+            lines.append(f"{cv},{self.values[cv]}")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def from_csv(cls, text):
+        lines = [line.strip() for line in text.split("\n") if line.strip() != ""]
+        address, long, accessory, cv7, cv8, timestamp = [int(v) for v in lines[1].split(",")]
+        values = {}
+        for line in lines[3:]:
+            cv, value = line.split(",")
+            values[int(cv)] = int(value)
+        return cls(address, cv7, cv8, values, timestamp, (LONG if long else 0) | (ACCESSORY if accessory else 0))
+
+    # ------------------ Vergleich -------------------
+    # [(CV, Wert hier, Wert in 'other'), ...] der abweichenden CVs, None = nicht gesichert
+    def diff(self, other):
+        result = []
+        for cv in sorted(set(self.values) | set(other.values)):
+            mine = self.values.get(cv)
+            theirs = other.values.get(cv)
+            if mine != theirs:
+                result.append((cv, mine, theirs))
+        return result
+
+    # CVs, deren gesicherter Wert auf dem Dekoder nicht (mehr) stimmt; 'reader' ist ein
+    # CVREADER, schon gelesene Werte kommen aus SERVICEMODE.cv_cache
+    def changed(self, reader):
+        result = []
+        for cv in sorted(self.values):
+            if cv in self.READONLY:
+                continue
+            value = reader.sm.recall(cv)
+            if value != None:
+                if value != self.values[cv]:
+                    result.append(cv)
+            elif not reader.confirm({cv: self.values[cv]}):
+                result.append(cv)
+        return result
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 2:
+        # auf dem Host umwandeln: Datei und Zielformat (json, csv, cvs)
+        path, kind = sys.argv[1], sys.argv[2]
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:3] == MAGIC:
+            snapshot = SNAPSHOT.from_bytes(data)
+        elif data.lstrip()[:1] == b"{":
+            snapshot = SNAPSHOT.from_json(data.decode())
+        else:
+            snapshot = SNAPSHOT.from_csv(data.decode())
+        target = path.rsplit(".", 1)[0] + "." + kind
+        if kind == "cvs":
+            snapshot.save(target)
+        else:
+            with open(target, "w") as f:
+                f.write(snapshot.to_json() if kind == "json" else snapshot.to_csv())
+        print(f"{target}: {len(snapshot.values)} CVs")
+    else:
+        # bisher: Text "cvs:[ (1, 3), ...]" mit einem write() je CV; neu: binär in einem Stück,
+        # zurücklesen, Vergleich mit einem Dekoder (RECORDER), bei dem CV 3 verstellt ist
+        import os
+        from classes.recorder import RECORDER, DECODER
+        from classes.servicemode import SERVICEMODE
+        from classes.cvreader import CVREADER
+
+        cvs = [1, 2, 3, 4, 5, 6, 8, 9, 17, 18, 19, 27, 29, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44,
+               48, 49, 50, 51, 52, 53, 66, 95, 97, 116, 117, 118, 119, 120, 121, 122, 123, 124, 141, 186, 188, 189, 190]
+        values = {cv: (cv * 37) & 0xff for cv in cvs}
+        values[8] = 151
+        f = open("snapshot_test.txt", "wt")
+        trenn = "\t"
+        f.write("cvs:[\n")
+        for cv in cvs:
+            f.write(f"{trenn}({cv:>4}, {values[cv]:>3})")
+            trenn = ",\n\t"
+        f.write("\n]\n")
+        f.close()
+        size_old = os.stat("snapshot_test.txt")[6]
+        snapshot = SNAPSHOT(3, 40, 151, dict(values))
+        snapshot.save("snapshot_test.cvs")
+        size_new = os.stat("snapshot_test.cvs")[6]
+        loaded = SNAPSHOT.load("snapshot_test.cvs")
+        os.remove("snapshot_test.txt")
+        os.remove("snapshot_test.cvs")
+        print(f"Text {size_old} Bytes, binär {size_new} Bytes, zurückgelesen "
+              f"{'gleich' if loaded.diff(snapshot) == [] else 'FEHLER'}, JSON/CSV "
+              f"{'gleich' if SNAPSHOT.from_json(loaded.to_json()).diff(snapshot) == [] and SNAPSHOT.from_csv(loaded.to_csv()).diff(snapshot) == [] else 'FEHLER'}")
+        # abgeschnittene, verlängerte und fremde Daten
+        data = snapshot.to_bytes()
+        rejected = 0
+        for bad in (data[:10], data[:-1], data[:struct.calcsize(HEADER) + 3], data + b"\0", b"CVS" + bytes(40)[3:],
+                    b"cvs:[\n\t(1, 3)]\n"):
+            try:
+                SNAPSHOT.from_bytes(bad)
+            except ValueError:
+                rejected += 1
+        print(f"Defekte Sicherungen abgelehnt: {rejected} von 6 {'OK' if rejected == 6 else 'FEHLER'}, "
+              f"Zeit {time.gmtime(snapshot.timestamp - EPOCH)[0]} (Unix {snapshot.timestamp})")
+
+        SERVICEMODE.TRACK_BACKEND = RECORDER()
+        sm = SERVICEMODE("DRV8871", 27, 28, 29, 3, 26)
+        sm.begin()
+        sm.loop()   # Einschaltzyklus
+        decoder = DECODER(sm, dict(values))
+        decoder.values[3] = 7
+        reader = CVREADER(decoder)
+        changed = loaded.changed(reader)
+        print(f"Vergleich mit dem Dekoder: CV {changed} abweichend, {reader.packets} Pakete, "
+              f"{decoder.time_us / 1000:.0f} ms Gleiszeit (Lesen: ca. {9 * len(cvs)} Pakete)")
+        sm.end()
@@ -0,0 +1,206 @@
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Strom-Telemetrie: Ring der letzten RING Messwerte mit Zeitstempel
+#
+# add() bekommt je Filtertakt von SAMPLER (update()) den gefilterten Rohwert
+# (0..65535 wie read_u16()) und ist im Timer-Callback erlaubt: nur ganze Zahlen,
+# keine Speicheranforderung. Erst stats() und die Rahmen rechnen mit 'raw2mA'
+# in mA um. mark() merkt sich Kommandos (ein Byte), damit sich Stromspitzen den
+# Kommandos zuordnen lassen.
+#
+# Binärer Rahmen (UART oder USB):
+#   0xA5 | Art (1 Byte) | Länge n (uint16 LE) | n Bytes Nutzdaten | XOR der Nutzdaten
+#   Art 'S': Statistik      <IHhhhh  Zeit ms, Anzahl, min., max., Mittel, p99 (mA)
+#   Art 'C': Messwerte      <IH      Zeit ms des ersten Wertes, Anzahl,
+#                                    je Wert <Bh Abstand zum vorigen in ms (max. 255), mA
+#   Art 'E': Kommandos      <H       Anzahl, je Kommando <IB Zeit ms, Zeichen
+#
+# ----------------------------------------------------------------------
+
+import struct
+import utime
+from array import array
+from micropython import const
+
+SYNC = const(0xa5)
+MAX_PAYLOAD = const(512)
+
+
+class TELEMETRY:
+
+    RING = const(512)           # Messwerte (bei 10 ms Filtertakt ca. 5 s)
+    EVENTS = const(32)          # Kommandos
+    CHUNK = const(80)           # max. Messwerte je Rahmen 'C'
+
+    def __init__(self, raw2mA=None):
+        self.raw2mA = raw2mA if raw2mA != None else (lambda raw: raw)
+        self.times = array('I', bytes(4 * self.RING))
+        self.values = array('H', bytes(2 * self.RING))
+        self.event_times = array('I', bytes(4 * self.EVENTS))
+        self.event_codes = bytearray(self.EVENTS)
+        self.mask = self.RING - 1
+        self.clear()
+
+    def clear(self):
+        self.count = 0          # Messwerte insgesamt (Position im Ring = count & mask)
+        self.event_count = 0
+        self.streamed = 0       # bis hier per stream() verschickt
+        self.events_streamed = 0
+
+    # gefilterter Rohwert aus SAMPLER.update()
+    def add(self, raw):
+        i = self.count & self.mask
+        self.times[i] = utime.ticks_ms()
+        self.values[i] = raw
+        self.count += 1
+
+    def mark(self, code):
+        if type(code) == str:
+            code = ord(code[:1]) if len(code) > 0 else 0
+        i = self.event_count % self.EVENTS
+        self.event_times[i] = utime.ticks_ms()
+        self.event_codes[i] = code & 0xff
+        self.event_count += 1
+
+    # Rohwerte der letzten 'ms' Millisekunden (bzw. des ganzen Rings), neueste zuerst
+    def window(self, ms=None):
+        count = self.count
+        n = min(count, self.RING)
+        if n == 0:
+            return []
+        now = self.times[(count - 1) & self.mask]
+        values = []
+        for k in range(count - 1, count - 1 - n, -1):
+            i = k & self.mask
+            if ms != None and utime.ticks_diff(now, self.times[i]) > ms:
+                break
+            values.append(self.values[i])
+        return values
+
+    # {"count", "min", "max", "mean", "p99"} in mA, None ohne Messwerte
+    def stats(self, ms=None):
+        values = self.window(ms)
+        n = len(values)
+        if n == 0:
+            return None
+        values.sort()
+        mA = self.raw2mA
+        return {"count": n,
+                "min": round(mA(values[0])),
+                "max": round(mA(values[-1])),
+                "mean": round(mA(sum(values) // n)),
+                "p99": round(mA(values[(99 * n + 99) // 100 - 1]))}
+
+    # ------------------ Rahmen -------------------
+    @staticmethod
+    def frame(kind, payload):
+        xor = 0
+        for b in payload:
+            xor ^= b
+        return bytes([SYNC, ord(kind)]) + struct.pack("<H", len(payload)) + payload + bytes([xor])
+
+    def stats_frame(self, ms=None):
+        s = self.stats(ms)
+        if s == None:
+            s = {"count": 0, "min": 0, "max": 0, "mean": 0, "p99": 0}
+        return self.frame("S", struct.pack("<IHhhhh", utime.ticks_ms(), s["count"], s["min"], s["max"], s["mean"], s["p99"]))
+
+    # Messwerte ab Position 'start' (höchstens CHUNK), Rahmen und nächste Position
+    def samples_frame(self, start):
+        count = self.count
+        start = max(start, count - self.RING)
+        n = min(count - start, self.CHUNK)
+        if n <= 0:
+            return None, start
+        mA = self.raw2mA
+        payload = bytearray(struct.pack("<IH", self.times[start & self.mask], n))
+        last = self.times[start & self.mask]
+        for k in range(start, start + n):
+            i = k & self.mask
+            dt = min(255, utime.ticks_diff(self.times[i], last))
+            last = self.times[i]
+            payload.extend(struct.pack("<Bh", dt, max(-32768, min(32767, round(mA(self.values[i]))))))
+        return self.frame("C", payload), start + n
+
+    def events_frame(self, start):
+        count = self.event_count
+        start = max(start, count - self.EVENTS)
+        if count <= start:
+            return None, start
+        payload = bytearray(struct.pack("<H", count - start))
+        for k in range(start, count):
+            i = k % self.EVENTS
+            payload.extend(struct.pack("<IB", self.event_times[i], self.event_codes[i]))
+        return self.frame("E", payload), count
+
+    # alles seit dem letzten Aufruf, als Liste von Rahmen
+    def stream(self):
+        frames = []
+        while True:
+            frame, self.streamed = self.samples_frame(self.streamed)
+            if frame == None:
+                break
+            frames.append(frame)
+        frame, self.events_streamed = self.events_frame(self.events_streamed)
+        if frame != None:
+            frames.append(frame)
+        return frames
+
+    # Gegenstelle: Rahmen aus einem Bytestrom, [(Art, Nutzdaten), ...] und der unvollständige Rest
+    @staticmethod
+    def decode(data):
+        frames = []
+        i = 0
+        while True:
+            while i < len(data) and data[i] != SYNC:
+                i += 1
+            if len(data) - i < 5:
+                break
+            n = struct.unpack("<H", data[i + 2:i + 4])[0]
+            if n > MAX_PAYLOAD:
+                i += 1          # zufälliges 0xA5, kein Rahmenanfang
+                continue
+            if len(data) - i < n + 5:
+                break
+            payload = data[i + 4:i + 4 + n]
+            xor = 0
+            for b in payload:
+                xor ^= b
+            if xor != data[i + 4 + n]:
+                i += 1          # kein gültiger Rahmen, ab dem nächsten Byte suchen
+                continue
+            frames.append((chr(data[i + 1]), bytes(payload)))
+            i += n + 5
+        return frames, data[i:]
+
+
+if __name__ == "__main__":
+    # Ring mit Messwerten wie aus SAMPLER füllen, Kommando dazwischen, Rahmen zurücklesen
+    telemetry = TELEMETRY(lambda raw: raw * 3300 / 65535)
+    for n in range(600):
+        telemetry.add(20000 if n == 550 else 2000 + n % 50)
+        if n == 549:
+            telemetry.mark("v")
+    print(telemetry.stats())
+    data = telemetry.stats_frame()
+    for frame in telemetry.stream():
+        data += frame
+    frames, rest = TELEMETRY.decode(b"\x00\xa5" + data)     # Störung vor dem ersten Rahmen
+    for kind, payload in frames:
+        if kind == "S":
+            print(kind, struct.unpack("<IHhhhh", payload))
+        elif kind == "C":
+            t, n = struct.unpack("<IH", payload[:6])
+            values = [struct.unpack("<Bh", payload[6 + 3 * k:9 + 3 * k])[1] for k in range(n)]
+            print(kind, n, "Werte, max.", max(values), "mA")
+        else:
+            print(kind, struct.unpack("<H", payload[:2])[0], "Kommando(s)", chr(payload[-1]))
+    print(f"{len(data)} Bytes, Rest {len(rest)}")
+    t = utime.ticks_us()
+    for n in range(1000):
+        telemetry.add(n)
+    print(f"add() {utime.ticks_diff(utime.ticks_us(), t) / 1000:.1f} µs")
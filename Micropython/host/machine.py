@@ -0,0 +1,54 @@
+#
+# "pico Lo" - Host-Ersatz für das MicroPython-Modul machine
+#
+# Nur so viel, wie classes/* zum Import und Betrieb unter CPython brauchen.
+#
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=None, pull=None, value=None):
+        self.id = id
+        self.state = 0 if value == None else value
+
+    def value(self, v=None):
+        if v == None:
+            return self.state
+        self.state = 1 if v else 0
+
+    def on(self):
+        self.state = 1
+
+    def off(self):
+        self.state = 0
+
+    def irq(self, handler=None, trigger=None):
+        pass
+
+
+class ADC:
+    # liefert 'level' (0..65535), für Tests von außen setzbar
+    def __init__(self, pin):
+        self.pin = pin
+        self.level = 0
+
+    def read_u16(self):
+        return self.level
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state):
+    pass
+
+
+def idle():
+    pass
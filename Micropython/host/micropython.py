@@ -0,0 +1,12 @@
+#
+# "pico Lo" - Host-Ersatz für das MicroPython-Modul micropython
+#
+
+
+def const(value):
+    return value
+
+
+# ohne Interrupts: gleich ausführen
+def schedule(func, arg):
+    func(arg)
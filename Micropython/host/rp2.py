@@ -0,0 +1,180 @@
+#
+# "pico Lo" - Host-Ersatz für das MicroPython-Modul rp2
+#
+# StateMachine sammelt alle Worte, die in die TX-FIFO gehen, in 'words'.
+# DMA bildet die Register eines RP2040-DMA-Kanals nach, soweit BITGENERATOR sie
+# benutzt: Transfer aus Puffern (Adressen über host/uctypes.py) in die TX-FIFO
+# von PIO0 oder in die Register anderer Kanäle, chain_to und Trigger.
+# Die Übertragung läuft nicht von selbst, sondern mit run(n) Wort für Wort.
+#
+# Benutzung (im Verzeichnis Micropython):
+#     import sys; sys.path[:0] = ["host", "."]
+#     import rp2
+#     from classes.bitgenerator import BITGENERATOR
+#     g = BITGENERATOR(27, model="DRV8871", dma=True); g.begin()
+#     g.frame_begin(); g.put((0xffffffff, 0xf019d0ef)); g.frame_end()
+#     rp2.run(8); print(g.statemachine.words)
+#
+
+import uctypes
+
+PIO0_TXF0 = 0x50200010
+DMA_BASE = 0x50000000
+DMA_CH_SIZE = 0x40
+DMA_CHANNELS = 12
+
+
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+
+# das PIO-Programm wird auf dem Host nicht assembliert
+def asm_pio(**kwargs):
+    def program(f):
+        return f
+    return program
+
+
+def bootsel_button():
+    return 0
+
+
+class StateMachine:
+    machines = {}
+
+    def __init__(self, id, program=None, freq=None, **kwargs):
+        self.id = id
+        self.running = False
+        self.words = []
+        StateMachine.machines[id] = self
+
+    def active(self, value=None):
+        if value == None:
+            return self.running
+        self.running = bool(value)
+
+    def exec(self, instruction):
+        pass
+
+    def put(self, value, shift=0):
+        if type(value) == int:
+            self.words.append(value & 0xffffffff)
+        else:
+            for w in value:
+                self.words.append(w & 0xffffffff)
+
+
+class DMA:
+    channels = [None] * DMA_CHANNELS
+
+    def __init__(self):
+        for ch in range(DMA_CHANNELS):
+            if DMA.channels[ch] == None:
+                DMA.channels[ch] = self
+                self.channel = ch
+                break
+        else:
+            raise(OSError("kein freier DMA-Kanal"))
+        self.read = 0
+        self.write = 0
+        self.count = 0
+        self.ctrl = 0
+        self.remaining = 0
+        self.busy = False
+
+    def pack_ctrl(self, enable=True, high_pri=False, size=2, inc_read=True, inc_write=True, ring_size=0,
+                  ring_sel=False, chain_to=None, treq_sel=0x3f, irq_quiet=True, bswap=False, sniff_en=False):
+        if chain_to == None:
+            chain_to = self.channel
+        return (int(enable) | int(high_pri) << 1 | size << 2 | int(inc_read) << 4 | int(inc_write) << 5 |
+                ring_size << 6 | int(ring_sel) << 10 | chain_to << 11 | treq_sel << 15 | int(irq_quiet) << 21 |
+                int(bswap) << 22 | int(sniff_en) << 23)
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        if read != None:
+            self.read = read if type(read) == int else uctypes.addressof(read)
+        if write != None:
+            self.write = write if type(write) == int else uctypes.addressof(write)
+        if count != None:
+            self.count = count
+        if ctrl != None:
+            self.ctrl = ctrl
+        if trigger:
+            self.trigger()
+
+    def trigger(self):
+        if self.ctrl & 1:
+            self.remaining = self.count   # TRANS_COUNT wird beim Trigger neu geladen
+            self.busy = self.remaining > 0
+
+    def active(self, value=None):
+        if value == None:
+            return self.busy
+        if value:
+            self.ctrl |= 1
+            self.trigger()
+        else:
+            self.ctrl &= ~1
+            self.busy = False
+
+    def close(self):
+        self.busy = False
+        DMA.channels[self.channel] = None
+
+    # ein Element übertragen
+    def step(self):
+        source = uctypes.resolve(self.read)
+        if source == None:
+            raise(ValueError(f"DMA {self.channel}: Leseadresse {self.read:#x} unbekannt"))
+        buffer, index = source
+        value = buffer[index] & 0xffffffff
+        if self.write == PIO0_TXF0:
+            StateMachine.machines[0].put(value)
+        elif DMA_BASE <= self.write < DMA_BASE + DMA_CHANNELS * DMA_CH_SIZE:
+            target = DMA.channels[(self.write - DMA_BASE) // DMA_CH_SIZE]
+            register = (self.write - DMA_BASE) % DMA_CH_SIZE
+            if register == 0x3c:        # AL3_READ_ADDR_TRIG
+                target.read = value
+                target.trigger()
+            elif register == 0x38:      # AL3_TRANS_COUNT
+                target.count = value
+        else:
+            destination = uctypes.resolve(self.write)
+            if destination == None:
+                raise(ValueError(f"DMA {self.channel}: Schreibadresse {self.write:#x} unbekannt"))
+            buffer, index = destination
+            buffer[index] = value
+        if self.ctrl & (1 << 4):
+            self.read += 4
+        if self.ctrl & (1 << 5):
+            self.write += 4
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.busy = False
+            chain_to = (self.ctrl >> 11) & 0xf
+            if chain_to != self.channel and DMA.channels[chain_to] != None:
+                DMA.channels[chain_to].trigger()
+
+
+# 'words' Worte in die TX-FIFO übertragen; nicht getaktete Kanäle laufen sofort durch
+def run(words=1):
+    sent = 0
+    while sent < words:
+        progress = False
+        for ch in DMA.channels:
+            if ch != None and ch.busy:
+                paced = ((ch.ctrl >> 15) & 0x3f) != 0x3f
+                ch.step()
+                progress = True
+                if paced:
+                    sent += 1
+                    break
+        if not progress:
+            break
+    return sent
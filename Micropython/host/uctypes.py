@@ -0,0 +1,29 @@
+#
+# "pico Lo" - Host-Ersatz für das MicroPython-Modul uctypes (nur addressof)
+#
+# Jedem Puffer wird beim ersten Aufruf eine fiktive, wortausgerichtete Adresse
+# zugeteilt. rp2.DMA (host/rp2.py) löst diese Adressen wieder auf.
+#
+
+_next = 0x20000000
+buffers = {}       # Adresse -> Puffer
+_by_id = {}        # id(Puffer) -> Adresse
+
+
+def addressof(obj):
+    global _next
+    addr = _by_id.get(id(obj))
+    if addr == None:
+        addr = _next
+        _next += (len(obj) * 4 + 0x100) & ~0xff
+        _by_id[id(obj)] = addr
+        buffers[addr] = obj
+    return addr
+
+
+# (Puffer, Index) zur Adresse oder None
+def resolve(addr):
+    for base, obj in buffers.items():
+        if base <= addr < base + len(obj) * 4:
+            return obj, (addr - base) // 4
+    return None
@@ -0,0 +1,47 @@
+#
+# "pico Lo" - Host-Ersatz für das MicroPython-Modul utime
+#
+# Ticks laufen wie in MicroPython in einem Bereich von 2**30 über, ticks_diff()
+# und ticks_add() rechnen modulo, damit Code mit Überlauf auch hier getestet wird.
+#
+
+import time
+
+TICKS_PERIOD = 1 << 30
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+def ticks_ms():
+    return int(time.monotonic() * 1000) % TICKS_PERIOD
+
+
+def ticks_us():
+    return int(time.monotonic() * 1000000) % TICKS_PERIOD
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALF) % TICKS_PERIOD) - TICKS_HALF
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+
+def time_ns():
+    return time.time_ns()
@@ -1,17 +1,187 @@
-from machine import Pin, ADC
-import utime
-
-def get_vsys():
-    samples = 300
-    reads = 10
-    vsys = ADC(Pin(29))
-    u = 0
-    umax = 0
-    t = utime.ticks_us()
-    for j in range(0, reads):
-        for i in range(0, samples):
-            u += vsys.read_u16()
-        u /= samples
-        umax = max(u, umax)
-
-    print(f"Zeit = {round((utime.ticks_us() - t)/1000)} ms  Samples = {samples:<4}  Uvsys = {round(u * 3300 / 65535)} mV  Umax = {round(umax * 3300 / 65535)} mV")
+#
+# "pico Lo" - Digitalsteuerung mit RPI pico
+#
+# (c) 2025 Thomas Borrmann
+# Lizenz: GPLv3 (sh. https://www.gnu.org/licenses/gpl-3.0.html.en)
+#
+# Überwachung der Versorgung (VSYS) im Hintergrund
+#
+# VSYSMONITOR liest per Timer alle PERIOD_MS einen Wert (am RP pico VSYS / 3 an
+# ADC3 = GPIO29) und führt je SLOT_MS das Minimum und den Mittelwert in einem Ring
+# von HISTORY Slots. Gerechnet wird im Timer-Callback nur mit ganzen Zahlen.
+#
+# Sinkt die Spannung unter WARN_MV, gibt es eine Warnung (Brownout): 'warnings'
+# zählt, 'warning' bleibt gesetzt, bis die Spannung wieder über RECOVER_MV liegt,
+# und ein 'callback' wird per micropython.schedule() außerhalb des Interrupts
+# aufgerufen - früh genug, bevor die H-Brücke das DCC-Signal nicht mehr sauber
+# ausgeben kann. Über einen Spannungsteiler am Eingang (12 V) passen 'pin',
+# 'divider' und die Schwellen.
+#
+# Solange SAMPLER (classes/sampler.py) den ADC besitzt, misst der Monitor nicht
+# selbst ('skipped'): SAMPLER.add_channel() liefert die Werte per add() und setzt
+# 'source'. Ohne laufenden SAMPLER misst der Timer wieder selbst.
+#
+# boot.py startet den Monitor (start()), der Start wartet auf nichts.
+#
+# ----------------------------------------------------------------------
+
+import machine
+import micropython
+import utime
+from array import array
+from micropython import const
+
+ADC_CS = const(0x4004c000)
+START_MANY = const(1 << 3)
+
+
+class VSYSMONITOR:
+
+    PIN = 29
+    DIVIDER = 3                 # VSYS über 200k / 100k am ADC (RP pico)
+    AREF_MV = 3300
+    PERIOD_MS = 20              # Abtastung im Hintergrund
+    SLOT_MS = 1000              # je Slot Minimum und Mittelwert
+    HISTORY = const(60)         # Slots im Ring (1 Minute)
+    WARN_MV = 4400              # Warnung, Spannung bricht ein
+    RECOVER_MV = 4600           # Warnung vorbei (Hysterese)
+
+    def __init__(self, pin=PIN, divider=DIVIDER, warn_mv=WARN_MV, recover_mv=RECOVER_MV, callback=None):
+        self.pin = pin
+        self.adc = machine.ADC(machine.Pin(pin))
+        self.source = None      # SAMPLER, der den Kanal mitmisst
+        self.factor = self.AREF_MV * divider          # mV = raw * factor >> 16, unter 2**30
+        self.warn_mv = warn_mv
+        self.recover_mv = recover_mv
+        self.callback = callback
+        self.mins = array('H', bytes(2 * self.HISTORY))
+        self.means = array('H', bytes(2 * self.HISTORY))
+        self.per_slot = max(1, self.SLOT_MS // self.PERIOD_MS)
+        self.timer = None
+        self.clear()
+
+    def clear(self):
+        self.mv = 0             # letzter Wert
+        self.slots = 0          # Slots insgesamt (Position im Ring = slots % HISTORY)
+        self.n = 0              # Werte im laufenden Slot
+        self.total = 0
+        self.low = 0xffff
+        self.warning = False
+        self.warnings = 0
+        self.warn_ms = None
+        self.skipped = 0
+
+    def begin(self):
+        if self.timer == None and hasattr(machine, "Timer"):
+            self.timer = machine.Timer()
+            self.timer.init(mode=machine.Timer.PERIODIC, period=self.PERIOD_MS, callback=self.tick)
+
+    def end(self):
+        if self.timer != None:
+            self.timer.deinit()
+            self.timer = None
+
+    def tick(self, timer):
+        self.sample()
+
+    # einen Wert selbst lesen, außer der ADC gehört gerade SAMPLER
+    def sample(self):
+        if (self.source != None and self.source.running) or \
+           (hasattr(machine, "mem32") and machine.mem32[ADC_CS] & START_MANY):
+            self.skipped += 1
+            return
+        self.add(self.adc.read_u16())
+
+    # Rohwert 0..65535 wie read_u16()
+    def add(self, raw):
+        mv = (raw * self.factor) >> 16
+        self.mv = mv
+        self.total += mv
+        self.n += 1
+        if mv < self.low:
+            self.low = mv
+        if self.n >= self.per_slot:
+            i = self.slots % self.HISTORY
+            self.mins[i] = self.low
+            self.means[i] = self.total // self.n
+            self.slots += 1
+            self.n = 0
+            self.total = 0
+            self.low = 0xffff
+        if not self.warning:
+            if mv < self.warn_mv:
+                self.warning = True
+                self.warnings += 1
+                self.warn_ms = utime.ticks_ms()
+                if self.callback != None:
+                    try:
+                        micropython.schedule(self.callback, mv)
+                    except RuntimeError:
+                        pass    # Warteschlange voll, 'warning' bleibt trotzdem gesetzt
+        elif mv >= self.recover_mv:
+            self.warning = False
+
+    # [(Minimum, Mittelwert), ...] der abgeschlossenen Slots in mV, neueste zuerst
+    def history(self):
+        n = min(self.slots, self.HISTORY)
+        return [(self.mins[k % self.HISTORY], self.means[k % self.HISTORY])
+                for k in range(self.slots - 1, self.slots - 1 - n, -1)]
+
+    # {"mv", "min", "mean", "warnings"} über den Ring, None ohne Messwerte
+    def stats(self):
+        h = self.history()
+        if len(h) == 0:
+            if self.n == 0:
+                return None
+            h = [(self.low, self.total // self.n)]
+        return {"mv": self.mv,
+                "min": min(m for m, a in h),
+                "mean": sum(a for m, a in h) // len(h),
+                "warnings": self.warnings}
+
+
+monitor = None
+
+
+# Monitor im Hintergrund starten (boot.py), ein zweiter Aufruf liefert denselben
+def start(callback=None):
+    global monitor
+    if monitor == None:
+        monitor = VSYSMONITOR(callback=callback)
+        monitor.begin()
+    elif callback != None:
+        monitor.callback = callback
+    return monitor
+
+
+# VSYS in mV: der letzte Wert des Monitors, sonst einmal kurz gemessen
+def get_vsys():
+    if monitor != None and monitor.mv > 0:
+        return monitor.mv
+    vsys = machine.ADC(machine.Pin(VSYSMONITOR.PIN))
+    u = 0
+    for i in range(16):
+        u += vsys.read_u16()
+    return (u // 16 * VSYSMONITOR.AREF_MV * VSYSMONITOR.DIVIDER) >> 16
+
+
+if __name__ == "__main__":
+    # bisher: 3000 x read_u16() beim Booten; neu: ein Wert je Timer-Aufruf
+    t = utime.ticks_us()
+    adc = machine.ADC(machine.Pin(VSYSMONITOR.PIN))
+    u = 0
+    for j in range(10):
+        for i in range(300):
+            u += adc.read_u16()
+        u /= 300
+    t_old = utime.ticks_diff(utime.ticks_us(), t)
+    warned = []
+    m = VSYSMONITOR(callback=warned.append)
+    raw_per_mv = 65536 / (m.AREF_MV * VSYSMONITOR.DIVIDER)
+    t = utime.ticks_us()
+    for k in range(3000):                           # 60 s mit einem Einbruch auf 4,2 V nach 30 s
+        mv = 5000 - (800 if 1500 <= k < 1510 else 0) - k % 7
+        m.add(round(mv * raw_per_mv))
+    t_add = utime.ticks_diff(utime.ticks_us(), t) / 3000
+    print(f"bisher {t_old / 1000:.1f} ms beim Booten, neu {t_add:.1f} µs je Wert im Hintergrund")
+    print(m.stats(), f"{len(m.history())} Slots, Warnung(en) bei {warned} mV")
@@ -2,11 +2,17 @@
 # Version 0.6ß 2025-10-13
 #
 from classes.servicemode import SERVICEMODE as SM
+from classes.cvreader import CVREADER, BITS, BYTES
+from classes.snapshot import SNAPSHOT, LONG, ACCESSORY
 from classes.manufacturers import MANUFACTURER as MAN
 from classes.prompt import PROMPT
 from classes.parser import DCCPARSER as DCCP
 import time
 from micropython import const
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 # mcu = "XIAO-RP2040"
 # mcu = "XIAO-RP2350"
@@ -43,6 +49,7 @@ __DEBUG__ = const(0)
 # __DEBUG__ = const(1)
 
 directmode_support = False
+reader = None      # CVREADER, nach der Lok-Erkennung
 
 set_address = False
 factory_reset = False
@@ -50,74 +57,21 @@ factory_reset = False
 acc_address = None
 loc_address = None
 
-def command(cv, bit):
-      sm.verify_bit(cv, bit, 1)
-        
-
-def evaluate(bit, val):
-    if sm.ack():
-        val |= 1 << bit
-    return val
-
 def loco_on_rail():
-    I = sm.get_current()
-    if I < -4:
-        print(f"Keine Lok erkannt ({I:>3} mA)", end="\r")
-        return False
+    print("Keine Lok erkannt, warte ...", end="\r")
+    present = asyncio.run(sm.wait_for_loco(1 * 60000, -4))  ## 1 Minute Timeout
     print(30 * " ")
-    return True
+    return present
 
 
-def read_cv(cv, required=False):
-    cv_val = 0
-    for cv_val in range(256):
-        print(".", end="")
-        repetitions = sm.REPETITIONS
-        while repetitions > 0:
-            if (__DEBUG__):
-                print(f"Durchlauf {sm.REPETITIONS - repetitions}, CV {cv} == {bin(cv_val):010}?", end=" ")
-            sm.verify(cv, cv_val)
-            if(__DEBUG__):
-                print(sm.get_current(), "mA")
-            if sm.ack():
-                return cv_val
-            else:
-                repetitions -= 1
-    print()       
-    if cv_val == 255 and repetitions == 0:
-        if(required == True):
-            sm.end()
-            raise(ValueError("Fehler beim Lesen, Hinweise in der Anleitung beachten!"))
-        else:
-            print(f"Lesen von CV {cv} nicht erfolgreich")
-            return None
-    return cv_val
-
-def read(cv, required=False, nur_schreiben=False):
+# bereits gelesene Werte kommen aus SERVICEMODE.cv_cache, 'fresh' liest immer vom Dekoder
+def read(cv, required=False, nur_schreiben=False, fresh=False):
     if nur_schreiben:
         return 0
-    if directmode_support == False:
-        return read_cv(cv, required)
-    cv_val = 0
-    chk_val = -1
-    repetitions = sm.REPETITIONS
-    while chk_val != cv_val and repetitions >= 0:
-        if (__DEBUG__):
-            print(f"Durchlauf {sm.REPETITIONS - repetitions}, CV {cv} == {bin(cv_val):010}?", end=" ")
-        for bit in range(8):
-            sm.verify_bit(cv, bit, 1)
-            if sm.ack():
-                if(__DEBUG__):
-                    print(sm.get_current(), "mA")
-                cv_val |= 1 << bit
-            if(__DEBUG__):
-                print(cv_val)
-        sm.verify(cv, cv_val)
-        if sm.ack():
-            chk_val = cv_val
-        else:
-            repetitions -= 1
-    if repetitions < 0:
+    cv_val = reader.read(cv, fresh)
+    if (__DEBUG__):
+        print(f"CV {cv} = {cv_val}, {reader.last[0]} Pakete, {reader.last[1]} ms")
+    if cv_val == None:
         if(required == True):
             sm.end()
             raise(ValueError("Fehler beim Lesen, Hinweise in der Anleitung beachten!"))
@@ -186,16 +140,6 @@ def describe_cv29(cv29_val):
 # 6)
 # Note: If the decoder does not support a featu
 
-def test_directmode_support():
-    sm.verify_bit(8, 7, 1)
-    sm.loop()
-    directmode_support = sm.ack()
-    sm.verify_bit(8, 7, 0)
-    sm.loop()
-    directmode_support ^= sm.ack()
-    return directmode_support
-
-
 # Liest eine Gruppe von CVs
 def get_cvs(cvs = []):
     cv_array = []
@@ -226,7 +170,7 @@ def auto_list(addr):
     
     if cv_array != None:
         stop = time.ticks_ms()
-        print(f"{len(cv_array)} CVs, {stop - start} ms, {(stop-start)/len(cv_array)} ms/CV")
+        print(f"{len(cv_array)} CVs, {stop - start} ms, {(stop-start)/len(cv_array)} ms/CV, {reader.stats()['packets_per_cv']:.1f} Pakete/CV, {reader.hits} aus dem Speicher")
         for i in cv_array:
             print(f"CV{i[0]:<3}", end="  ")
         print()
@@ -234,20 +178,30 @@ def auto_list(addr):
             print(f"{i[1]:<7}", end="")
         print()
         
-## TODO: schreiben der Daten aktivieren?
+        # binäre Sicherung (classes/snapshot.py), auf dem PC nach JSON/CSV umwandeln
+        path = f"/data/Lok#{addr}_{hersteller.replace(' ', '-')}.cvs"
+        cv7 = read(7)
+        cv8 = read(8)
+        snapshot = SNAPSHOT(addr, cv7 if cv7 != None else 0, cv8 if cv8 != None else 0,
+                            {cv: val for cv, val in cv_array if val != None},
+                            flags=(LONG if use_long_address else 0) | (ACCESSORY if accessory else 0))
+        try:
+            saved = SNAPSHOT.load(path)
+        except (OSError, ValueError):
+            saved = None
+        if saved != None:
+            diff = saved.diff(snapshot)
+            for cv, old, new in diff:
+                print(f"CV{cv:<3} gesichert {old}, Dekoder {new}")
+            restore = [(cv, old) for cv, old, new in diff if old != None and cv not in SNAPSHOT.READONLY]
+            if len(restore) > 0 and kbd.prompt(f"{len(restore)} CVs aus der Sicherung zurückschreiben? (J/N)").upper() == "J":
+                for cv, old in restore:
+                    if write(cv, old):
+                        snapshot.values[cv] = old
+
         save = (kbd.prompt("Dekoderdaten sichern? (J/N)").upper() == "J")
         if (save):
-            dn = "/data/"
-            file = open(f"/data/Lok#{addr}_{hersteller.replace(' ', '-')}.json", "wt")
-            try:
-                trenn = "\t"
-                file.write("cvs:[\n")
-                for i in cv_array:
-                    file.write(f"{trenn}({i[0]:>4}, {i[1]:>3})")
-                    trenn = ",\n\t"
-                file.write("\n]\n")
-            finally:
-                file.close()    
+            snapshot.save(path)
     
 
 def calc_accessory_address(address):
@@ -298,15 +252,10 @@ dccp = DCCP()
 
 cv_array = None
 
-t = time.ticks_ms() + 1 * 6e4  ## 1 Minute Timeout
-
 auto = (kbd.prompt("Automatisch lesen? (J/N)").upper() == "J")
 nur_schreiben = (kbd.prompt("Nur Schreiben? (J/N)").upper() == "J")
 try:
-    while not loco_on_rail() and t > time.ticks_ms():
-        sm.loop()
-    
-    timeout = t <= time.ticks_ms()
+    timeout = not loco_on_rail()
     
     
     if timeout:
@@ -317,7 +266,9 @@ try:
         sm.loop()
         
     print("Beginne")
-    directmode_support = test_directmode_support()
+    reader = CVREADER(sm, repetitions=sm.REPETITIONS, progress=lambda cv, value: print(".", end=""))
+    directmode_support = reader.test_directmode()
+    reader.mode = BITS if directmode_support else BYTES
     print(f"{'Direct mode' if directmode_support else 'CV mode'}")
 
     if factory_reset == True:
@@ -4,21 +4,30 @@
 
 from classes.operationmode import OPERATIONS as OP
 from classes.servicemode import SERVICEMODE as SM
+from classes.cvreader import CVREADER
+from classes.profiles import PROFILES
 from classes.prompt import PROMPT
 from classes.map import MAP
 import time
-from machine import Timer, Pin, UART, idle, reset, PWM, deepsleep
-import os, re
+from machine import Pin, UART, idle, reset, PWM, deepsleep
+import os, re, sys
 from tools.byte_print import int2bin
 from micropython import const
 from classes.parser import DCCPARSER as DCCP
+import libraries.vsys as vsys
 import rp2
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 # __DEBUG__ = const(0)
 __DEBUG__ = const(1)
 # __DEBUG__ = const(2)
 # __DEBUG__ = const(3)
 
+TELEMETRY_MS = const(500)   # Takt der laufend gesendeten Telemetrie-Rahmen (T+)
+
 AUTO_DETECTION = const(False)  # Lok erkennen beim Einschalten
 
 mcu = "XIAO-RP2040"
@@ -118,9 +127,8 @@ client_kbd = False
         
 
 def finish():
-    if not timer_current == None:
-        timer_current.deinit()
     if not (op == None):
+        op.stop()
         op.emergency_stop()
         op.power_off()
         op.end()
@@ -132,79 +140,44 @@ def finish():
         pwm_high_current.duty_u16(0)
     deepsleep()
 
-def get_loco_profile():
-    def read_cv(cv):
-        cv_val = 0
-        for cv_val in range(256):
-            repetitions = 3
-            while repetitions > 0:
-                sm.verify(cv, cv_val)
-                if sm.ack():
-                    return cv_val
-                else:
-                    repetitions -= 1
-                
-        if cv_val == 255 and repetitions == 0:
-            sm.end()
-            raise(ValueError(f"Lesen von CV {cv} nicht erfolgreich"))
-        return cv_val
-
+async def get_loco_profile():
     def read(cv):
-        if directmode == False:
-            return read_cv(cv)
-        cv_val = 0
-        chk_val = -1
-        repetitions = sm.REPETITIONS
-        while chk_val != cv_val and repetitions >= 0:
-            for bit in range(8):
-                sm.verify_bit(cv, bit, 1)
-                if sm.ack():
-                    cv_val |= 1 << bit
-            sm.verify(cv, cv_val)
-            if sm.ack():
-                chk_val = cv_val
-            else:
-                repetitions -= 1
-        if repetitions < 0:
+        value = reader.read(cv)
+        if value == None:
             sm.end()
             raise(ValueError(f"Lesen von CV {cv} nicht erfolgreich"))
-        return cv_val
-
-    def test_directmode_support():
-        sm.verify_bit(8, 7, 1)
-        directmode_support = sm.ack()
-        sm.verify_bit(8, 7, 0)
-        directmode_support ^= sm.ack()
-        return directmode_support
-        
+        return value
         
     sm = SM(H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN)
     sm.begin()
 
-    t = time.ticks_ms() + 5 * 6e4  ## 5 Minuten Timeout
-
     try:
-        while t > time.ticks_ms():
-            I = sm.get_current()
-            if I < -1:
-                log_print(f"Keine Lok erkannt ({I:>4} mA)", end="\r")
-            else:
-                break
-     
+        log_print("Keine Lok erkannt, warte ...", end="\r")
+        found = await sm.wait_for_loco(5 * 60000)  ## 5 Minuten Timeout, andere Tasks laufen weiter
         log_print(30 * " ")
 
-        timeout = t <= time.ticks_ms()
-
-        if timeout:
+        if not found:
             sm.statemachine.end()
             return(None, 0, 0)
 
         for i in range(100):
             sm.loop()
         
-        directmode = test_directmode_support()
-        
-        cv29 = read(29)
+        reader = CVREADER(sm)   # Bit- oder Byte-Prüfung, je nach Dekoder
+        profiles = PROFILES.load()
+        profile = profiles.identify(reader)     # bekannter Dekoder: nur Byte-Prüfungen
+        if profile != None:
+            sm.end()
+            profiles.save()                     # Reihenfolge 'zuletzt benutzt'
+            log_print(f"Profil bestätigt, {reader.packets} Pakete")
+            return (profile["address"], profile["long"], profile["speedsteps"])
+
+        cvs = {}                                # Hersteller und Version nur für das Profil:
+        for cv in (8, 7):                       # nicht lesbar = Lok trotzdem übernehmen
+            value = reader.read(cv)
+            if value != None:
+                cvs[cv] = value
+        cv29 = cvs[29] = read(29)
         use_long_address = cv29 & 0x20
         if not cv29 & 0x02:
             speedsteps = 14
@@ -218,11 +191,14 @@ def get_loco_profile():
                 speedsteps = 14
         
         if use_long_address:
-            cv17 = read(17)
-            cv18 = read(18)
+            cv17 = cvs[17] = read(17)
+            cv18 = cvs[18] = read(18)
             loco = (cv17 - 192) * 256 + cv18
         else:
-            loco = read(1)
+            loco = cvs[1] = read(1)
+        if 8 in cvs and 7 in cvs:
+            profiles.add(cvs, loco, use_long_address, speedsteps)
+            profiles.save()
         
     except KeyboardInterrupt:
         sm.end()
@@ -322,15 +298,91 @@ def show_locos():
         log_print(loco.name)
         show_fn()
         log_print()
+    hits, misses, entries = op.cache_stats()
+    log_print(f"Paket-Cache: {hits} Treffer, {misses} Fehlschläge, {entries} Einträge")
+
+def show_budget():
+    b = op.budget()
+    log_print(f"Gleis: {b['locos']} Loks, {b['bits']} Bits in {b['us'] / 1000:.1f} ms")
+    log_print(f"Refresh je Lok: Fahrstufe {b['speed_ms']:.1f} ms, Funktionen {b['function_ms']:.1f} ms, AUX {b['aux_ms']:.1f} ms")
+    log_print(f"Reserve bis {op.REFRESH_LIMIT_MS} ms: {b['headroom_ms']:.1f} ms, ca. {b['free_locos']} weitere Loks")
+    if uart != None:
+        uart.write(f">>>B,{b['locos']},{b['bits']},{b['us']},{round(b['speed_ms'])},{round(b['function_ms'])},{round(b['aux_ms'])},{round(b['headroom_ms'])},{b['free_locos']}<<<")
         
-def get_loco():
-    global loco, use_long_address, speedsteps
+# Telemetrie-Rahmen binär über UART, sonst über USB
+def send_frame(frame):
+    if uart != None:
+        uart.write(frame)
+    else:
+        sys.stdout.buffer.write(frame)
+
+def show_telemetry():
+    s = op.telemetry.stats()
+    if s == None:
+        log_print("Noch keine Strommessung")
+        return
+    log_print(f"Strom ({s['count']} Werte): min. {s['min']} mA, max. {s['max']} mA, Mittel {s['mean']} mA, p99 {s['p99']} mA")
+    send_frame(op.telemetry.stats_frame())
+
+def stream_telemetry(on, history=False):
+    global telemetry_stream
+    telemetry_stream = on
+    if history:
+        op.telemetry.streamed = 0   # ab dem ältesten Wert im Ring
+    elif on:
+        op.telemetry.streamed = op.telemetry.count
+        op.telemetry.events_streamed = op.telemetry.event_count
+
+# Versorgung (VSYS) aus dem Monitor im Hintergrund (libraries/vsys.py, Start in boot.py)
+def show_vsys():
+    s = vsys.monitor.stats() if vsys.monitor != None else None
+    if s == None:
+        log_print("Noch keine Messung der Versorgung")
+        return
+    log_print(f"VSYS {s['mv']} mV, min. {s['min']} mV, Mittel {s['mean']} mV, {s['warnings']} Warnung(en)")
+    if uart != None:
+        uart.write(f">>>U,{s['mv']},{s['min']},{s['mean']},{s['warnings']}<<<")
+
+# vom Monitor per micropython.schedule(), nicht im Interrupt
+def vsys_warning(mv):
+    log_print(f"!!! Versorgung bricht ein: {mv} mV !!!")
+    if op != None:
+        op.telemetry.mark("U")      # im Strom-Verlauf
+
+vsys.start(vsys_warning)    # läuft seit boot.py, hier nur die Warnung anhängen
+
+# Strommessung kalibrieren: K = leeres Gleis, K{mA} = bekannte Last am Gleis
+async def calibrate(load):
+    load_mA = None
+    if load != "":
+        try:
+            load_mA = int(load)
+        except ValueError:
+            log_print("Last in mA angeben, z.B. K100")
+            return
+    log_print("Kalibrieren an leerem Gleis ..." if load_mA == None else f"Kalibrieren mit {load_mA} mA Last ...")
+    try:
+        c = await op.calibrate(load_mA)
+    except (RuntimeError, ValueError) as e:
+        log_print(f"Kalibrieren fehlgeschlagen: {e}")
+        return
+    log_print(f"Ruhestrom {c['offset']} mA, Rauschen {c['noise']} mA, Steigung {c['gain']:.3f}")
+    if uart != None:
+        uart.write(f">>>K,{c['offset']},{c['noise']},{c['gain']:.3f}<<<")
+
+async def get_loco():
+    global loco, use_long_address, speedsteps, scanning, auto_sleep_timer
     clear_input_buffer()
-    op.end()
-    loco, use_long_address, speedsteps = get_loco_profile()
-    set_loco_data(loco)
-    log_print(f"Lok {loco}, {'Lange' if use_long_address else 'Kurze'} Adresse, {speedsteps} Fahrstufen")
-    op.begin()
+    scanning = True     # bis op.begin() gehört Statemachine 0 dem Servicemode (sh. button_task)
+    try:
+        op.end()
+        loco, use_long_address, speedsteps = await get_loco_profile()
+        set_loco_data(loco)
+        log_print(f"Lok {loco}, {'Lange' if use_long_address else 'Kurze'} Adresse, {speedsteps} Fahrstufen")
+        op.begin()
+    finally:
+        scanning = False
+        auto_sleep_timer = time.ticks_ms() + AUTO_SLEEP_TIME
     op.ctrl_loco(loco, use_long_address, speedsteps)
     log_print(f"Lok {loco} bereit")
     return (loco, use_long_address, speedsteps)
@@ -385,6 +437,13 @@ W{a},{d}           | Weiche {a} Richtung {d} mit d = 0: geradeaus, d != 0 abzwei
                    |
 S{a},{d}           | Signal {a} Bild (Aspect) {d}
                    |
+B                  | Bandbreite am Gleis: Refresh-Intervalle, Reserve bis zum Refresh-Limit
+T                  | Strom-Telemetrie: min., max., Mittel, p99 der letzten Sekunden
+T+ / T-            | Telemetrie-Rahmen laufend senden ein / aus (UART, sonst USB)
+TD                 | alle Messwerte im Ring als Telemetrie-Rahmen senden
+U                  | Versorgung (VSYS): aktuell, min., Mittel, Warnungen bei Einbruch
+K                  | Strommessung kalibrieren: Ruhestrom und Rauschen (Gleis ein, leer)
+K{mA}              | Strommessung kalibrieren: Steigung mit bekannter Last {mA} am Gleis
 QUIT               | Beenden, alles ausschalten
 RESET              | Layout in Grundstellung versetzen
 -------------------+---------------------------------------------------------------------
@@ -400,8 +459,8 @@ A{aaa, cv, value}  | für Accessory-Decoder, aaa = Adresse, cv = CV, value = Wer
 def set_loco_data(addr=3, use_long_address=0, speedsteps=28):
     op.ctrl_loco(addr, use_long_address, speedsteps)
 
-def send_loco_data(addr=3, use_long_address=0, speedsteps=28):
-    time.sleep(0.5)
+async def send_loco_data(addr=3, use_long_address=0, speedsteps=28):
+    await asyncio.sleep_ms(500)
     log_print(f">>>{addr},{use_long_address},{speedsteps}<<<")
     if uart != None:
         uart.write(f">>>{addr},{use_long_address},{speedsteps}<<<")
@@ -432,11 +491,12 @@ def wait(millis=None):
         return True
 
 #############################PARSER###########################
-def process_input_buffer(buffer):
+async def process_input_buffer(buffer):
     cmd = None
     value = 0
     if len(buffer) > 0:
         b = buffer.lower()
+        op.telemetry.mark(b)    # Kommando im Strom-Verlauf
         if(b == 'run'):
             return True   # Kein Kommando
         
@@ -456,6 +516,32 @@ def process_input_buffer(buffer):
         elif b == '?':
             usage()
             return True
+
+        elif b == 'b': # Bandbreite am Gleis
+            show_budget()
+            return True
+
+        elif b == 't': # Strom-Telemetrie
+            show_telemetry()
+            return True
+
+        elif b == 'u': # Versorgung
+            show_vsys()
+            return True
+
+        elif b == 't+' or b == 't-':
+            stream_telemetry(b == 't+')
+            return True
+
+        elif b[:1] == 'k' and (len(b) == 1 or dccp.is_number(b[1])): # Strommessung kalibrieren
+            await calibrate(b[1:])
+            return True
+
+        elif b == 'td':
+            stream_telemetry(telemetry_stream, True)
+            for frame in op.telemetry.stream():
+                send_frame(frame)
+            return True
             
 
         log_print(buffer)
@@ -475,9 +561,9 @@ def process_input_buffer(buffer):
             if cmd == 'l':
                 if len(buffer) == 2 and buffer[1] == '?':
                     log_print(f"Scan angefordert: {buffer}")
-                    addr, use_long_address, speedsteps = get_loco()
+                    addr, use_long_address, speedsteps = await get_loco()
                     if(addr):
-                        send_loco_data(addr, use_long_address, speedsteps)
+                        await send_loco_data(addr, use_long_address, speedsteps)
                 else:
                     cnt = len(op.locos)
                     if(use_long_address == None):
@@ -501,10 +587,8 @@ def process_input_buffer(buffer):
                     if op.active_loco.address == addr:
                         log_print(f"Aktive Lok kann nicht aus Liste entfernt werden")
                     else:
-                        for l in op.locos:
-                            if l.address == addr:
-                                op.locos.remove(l)
-                                log_print(f"Keine Pakete mehr an Lok {value} senden")
+                        if op.remove_loco(addr):
+                            log_print(f"Keine Pakete mehr an Lok {addr} senden")
 
             elif cmd == 'f':
                 if len(buffer) == 1:
@@ -562,11 +646,9 @@ def process_input_buffer(buffer):
                 else:
                     cmd = 0
                 if(op.direction() != cmd):
-                    halt()
                     log_print("HALT")
-                    time.sleep(.5)
                 log_print(f"Lok {op.active_loco.address} <<- Fahrstufe {speed if speed <= max_speed else max_speed}")
-                op.drive(cmd, speed if speed <= max_speed else max_speed)
+                await op.change_direction(cmd, speed if speed <= max_speed else max_speed)
                 
         else:
             cmd = None
@@ -611,7 +693,7 @@ def poll_cmd():
     return None
 
 
-def eventloop():
+async def eventloop():
     global input_buffer, auto_sleep_timer
     answer = True
     input_buffer = poll_cmd()
@@ -621,14 +703,14 @@ def eventloop():
             log_print(input_buffer)
             for buffer in input_buffer[3:-3].split('#'):
                 if(buffer > ""):
-                    answer = process_input_buffer(buffer)
+                    answer = await process_input_buffer(buffer)
                     if (answer != True):
                         return answer
         clear_input_buffer()
     return answer
 
 
-def show_current(t):
+def show_current():
     i = op.get_current()
     duty_high_current = m.map(i, 0, HIGH_CURRENT, 0, 4098)
     duty_low_current = 4098 - duty_high_current
@@ -637,30 +719,27 @@ def show_current(t):
     if(__DEBUG__ > 1):
         log_print(f"DCC-Strom: {i:>4} mA, duty_high={pwm_high_current.duty_u16()}, duty_low={pwm_low_current.duty_u16()}", end="\r")
         
-def wait_t(milliseconds=None):
+async def wait_t(milliseconds=None):
     if(milliseconds != None):
-        start = time.ticks_ms()
-        stop = start + milliseconds
-        while(time.ticks_ms() <= stop):
-            op.loop()
+        await op.pause(milliseconds)
             
     
-def startup_sequence():
-    time.sleep(2)
-#     process_input_buffer("W103,1")
+async def startup_sequence():
+    await asyncio.sleep_ms(2000)
+#     await process_input_buffer("W103,1")
 #     for i in range(3):
-#         process_input_buffer("W102,1")
-#         wait_t(300)
-#     process_input_buffer("W101,1")
-#     wait_t(300)
-#     process_input_buffer("W101,0")
-#     wait_t(300)
-#     process_input_buffer("W103,0")
-#     process_input_buffer("W2,1")
-#     wait_t(300)
-#     process_input_buffer("W2,0")
-#     wait_t(300)
-#     process_input_buffer("W1,0")
+#         await process_input_buffer("W102,1")
+#         await wait_t(300)
+#     await process_input_buffer("W101,1")
+#     await wait_t(300)
+#     await process_input_buffer("W101,0")
+#     await wait_t(300)
+#     await process_input_buffer("W103,0")
+#     await process_input_buffer("W2,1")
+#     await wait_t(300)
+#     await process_input_buffer("W2,0")
+#     await wait_t(300)
+#     await process_input_buffer("W1,0")
     
 ##############################################################
 
@@ -699,33 +778,36 @@ time.sleep(.3)
 usage()
 auto_sleep_timer = time.ticks_ms() + AUTO_SLEEP_TIME
 emergency = False
-try:
-    t = time.ticks_ms() + 20000
-    timer_current = Timer()
+scanning = False        # Lok-Suche läuft (get_loco), op ist beendet
+telemetry_stream = False
 
-#     1 Minute auf eine Lok warten, wenn "auto_detection" aktiv
-    if(AUTO_DETECTION):
-        while t > time.ticks_ms():
-            I = op.get_current()
-            if I < -1:
-                log_print(f"Keine Lok erkannt ({I:>4} mA)", end="\r")
-            else:
-                log_print("\nBeginne")
-                break
-        addr, use_long_address, speedsteps = get_loco()
-        if(addr):
-            send_loco_data(addr, use_long_address, speedsteps)
-            
-    startup_sequence()
-    log_print(10 * "-")
-    timer_current.init(mode=Timer.PERIODIC, freq=1, period=333, callback=show_current)
-    op = OP(H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN)
-    op.begin()
-    current_A = op.get_current()
+# Tasks: Gleis-Refresh (op.run), Kommandos, Strom, Taster
 
+async def command_task():
     while True:
-        
-        if time.ticks_ms() >= auto_sleep_timer:
+        if not scanning and await eventloop() == False:
+            finish()
+        await asyncio.sleep_ms(20)
+
+async def current_task():
+    while True:
+        if(not emergency and not scanning):
+            show_current()
+        await asyncio.sleep_ms(333)
+
+async def telemetry_task():
+    while True:
+        if telemetry_stream:
+            for frame in op.telemetry.stream():
+                send_frame(frame)
+        await asyncio.sleep_ms(TELEMETRY_MS)
+
+async def button_task():
+    global emergency
+    while True:
+        # während der Lok-Suche weder schlafen noch Nothalt umschalten: op.begin() würde
+        # Statemachine 0 unter dem Servicemode neu anlegen (auf dem Programmiergleis fährt keine Lok)
+        if time.ticks_ms() >= auto_sleep_timer and not scanning:
             finish()
             machine.deepsleep()
             log_print("Erwache...")
@@ -738,41 +820,64 @@ try:
                     if(time.ticks_ms() >= start):
                         finish()
                         reset()
+                    await asyncio.sleep_ms(20)
 
         if EMERG_PIN != None:
             if __DEBUG__ > 2:
                 log_print(f"{time.ticks_ms() / 1000.0:12} Nothalt-Pin ist {'HIGH' if emerg_pin.value() else 'LOW'}", end="\r")
-            if (emerg_pin.value() == LOW):
+            if (emerg_pin.value() == LOW and not scanning):
                 if(not emergency):
                     op.emergency_stop()
                     log_print("Red alert")
                     emergency = True
-                    timer_current.deinit()
+                    op.hold = True
                     pwm_low_current.duty_u16(0)
                     pwm_high_current.duty_u16(4096)
                 else:
                     emergency = False
-                    timer_current.init(mode=Timer.PERIODIC, freq=1, period=333, callback=show_current)
+                    op.hold = False
                     op.begin()
                     pwm_low_current.duty_u16(4096)
                     pwm_high_current.duty_u16(4096)
                 while (emerg_pin.value() == LOW):
-                    pass
+                    await asyncio.sleep_ms(20)
 
-            
         if rp2.bootsel_button():
             finish()
             raise(RuntimeError("BootSel - Abbruch"))
-        if(not emergency):
-            op.loop()
-        if eventloop() == False:
-            finish()
-        idle()
+        await asyncio.sleep_ms(20)
 
+async def main():
+    global op, current_A
+    t = time.ticks_ms() + 20000
+
+#     1 Minute auf eine Lok warten, wenn "auto_detection" aktiv
+    if(AUTO_DETECTION):
+        while t > time.ticks_ms():
+            present, I = op.loco_present()
+            if not present:
+                log_print(f"Keine Lok erkannt ({I:>4} mA)", end="\r")
+            else:
+                log_print("\nBeginne")
+                break
+        addr, use_long_address, speedsteps = await get_loco()
+        if(addr):
+            await send_loco_data(addr, use_long_address, speedsteps)
+            
+    await startup_sequence()
+    log_print(10 * "-")
+    op = OP(H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN)
+    op.begin()
+    if vsys.monitor != None:
+        op.sampler.add_channel(vsys.monitor)   # VSYS misst der Besitzer des ADC mit (auch im Servicemode)
+    current_A = op.get_current()
+    await asyncio.gather(op.run(), command_task(), current_task(), telemetry_task(), button_task())
+
+try:
+    asyncio.run(main())
         
 except KeyboardInterrupt:
     finish()
     raise(KeyboardInterrupt("Benutzer hat abgebrochen"))
 
 finish()
-
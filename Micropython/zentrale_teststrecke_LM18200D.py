@@ -7,21 +7,30 @@ mcu = "RPi RP2040"
 
 from classes.operationmode import OPERATIONS as OP
 from classes.servicemode import SERVICEMODE as SM
+from classes.cvreader import CVREADER
+from classes.profiles import PROFILES
 from classes import prompt
 from classes.map import MAP
 import time
-from machine import Timer, Pin, UART, idle, reset, PWM, deepsleep, I2C
-import os, re
+from machine import Pin, UART, idle, reset, PWM, deepsleep, I2C
+import os, re, sys
 from tools.byte_print import int2bin
 from micropython import const
 from classes.parser import DCCPARSER as DCCP
+import libraries.vsys as vsys
 import rp2
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 # __DEBUG__ = const(0)
 __DEBUG__ = const(1)
 # __DEBUG__ = const(2)
 # __DEBUG__ = const(3)
 
+TELEMETRY_MS = const(500)   # Takt der laufend gesendeten Telemetrie-Rahmen (T+)
+
 USE_UART = const(False)
 
 def log_print(string="", end=""):
@@ -130,9 +139,8 @@ client_kbd = False
         
 
 def finish():
-    if not timer_current == None:
-        timer_current.deinit()
     if not (op == None):
+        op.stop()
         op.emergency_stop()
         op.power_off()
         op.end()
@@ -155,79 +163,44 @@ def finish():
             oled.cleanup()
     deepsleep()
 
-def get_loco_profile():
-    def read_cv(cv):
-        cv_val = 0
-        for cv_val in range(256):
-            repetitions = 3
-            while repetitions > 0:
-                sm.verify(cv, cv_val)
-                if sm.ack():
-                    return cv_val
-                else:
-                    repetitions -= 1
-                
-        if cv_val == 255 and repetitions == 0:
-            sm.end()
-            raise(ValueError(f"Lesen von CV {cv} nicht erfolgreich"))
-        return cv_val
-
+async def get_loco_profile():
     def read(cv):
-        if directmode == False:
-            return read_cv(cv)
-        cv_val = 0
-        chk_val = -1
-        repetitions = sm.REPETITIONS
-        while chk_val != cv_val and repetitions >= 0:
-            for bit in range(8):
-                sm.verify_bit(cv, bit, 1)
-                if sm.ack():
-                    cv_val |= 1 << bit
-            sm.verify(cv, cv_val)
-            if sm.ack():
-                chk_val = cv_val
-            else:
-                repetitions -= 1
-        if repetitions < 0:
+        value = reader.read(cv)
+        if value == None:
             sm.end()
             raise(ValueError(f"Lesen von CV {cv} nicht erfolgreich"))
-        return cv_val
-
-    def test_directmode_support():
-        sm.verify_bit(8, 7, 1)
-        directmode_support = sm.ack()
-        sm.verify_bit(8, 7, 0)
-        directmode_support ^= sm.ack()
-        return directmode_support
-        
+        return value
         
     sm = SM(H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN)
     sm.begin()
 
-    t = time.ticks_ms() + 5 * 6e4  ## 5 Minuten Timeout
-
     try:
-        while t > time.ticks_ms():
-            I = sm.get_current()
-            if I < -1:
-                log_print(f"Keine Lok erkannt ({I:>4} mA)", end="\r")
-            else:
-                break
-     
+        log_print("Keine Lok erkannt, warte ...", end="\r")
+        found = await sm.wait_for_loco(5 * 60000)  ## 5 Minuten Timeout, andere Tasks laufen weiter
         log_print(30 * " ")
 
-        timeout = t <= time.ticks_ms()
-
-        if timeout:
+        if not found:
             sm.statemachine.end()
             return(None, 0, 0)
 
         for i in range(100):
             sm.loop()
         
-        directmode = test_directmode_support()
-        
-        cv29 = read(29)
+        reader = CVREADER(sm)   # Bit- oder Byte-Prüfung, je nach Dekoder
+        profiles = PROFILES.load()
+        profile = profiles.identify(reader)     # bekannter Dekoder: nur Byte-Prüfungen
+        if profile != None:
+            sm.end()
+            profiles.save()                     # Reihenfolge 'zuletzt benutzt'
+            log_print(f"Profil bestätigt, {reader.packets} Pakete")
+            return (profile["address"], profile["long"], profile["speedsteps"])
+
+        cvs = {}                                # Hersteller und Version nur für das Profil:
+        for cv in (8, 7):                       # nicht lesbar = Lok trotzdem übernehmen
+            value = reader.read(cv)
+            if value != None:
+                cvs[cv] = value
+        cv29 = cvs[29] = read(29)
         use_long_address = cv29 & 0x20
         if not cv29 & 0x02:
             speedsteps = 14
@@ -241,11 +214,14 @@ def get_loco_profile():
                 speedsteps = 14
         
         if use_long_address:
-            cv17 = read(17)
-            cv18 = read(18)
+            cv17 = cvs[17] = read(17)
+            cv18 = cvs[18] = read(18)
             loco = (cv17 - 192) * 256 + cv18
         else:
-            loco = read(1)
+            loco = cvs[1] = read(1)
+        if 8 in cvs and 7 in cvs:
+            profiles.add(cvs, loco, use_long_address, speedsteps)
+            profiles.save()
         
     except KeyboardInterrupt:
         sm.end()
@@ -345,15 +321,91 @@ def show_locos():
         log_print(loco.name)
         show_fn()
         log_print()
+    hits, misses, entries = op.cache_stats()
+    log_print(f"Paket-Cache: {hits} Treffer, {misses} Fehlschläge, {entries} Einträge")
+
+def show_budget():
+    b = op.budget()
+    log_print(f"Gleis: {b['locos']} Loks, {b['bits']} Bits in {b['us'] / 1000:.1f} ms")
+    log_print(f"Refresh je Lok: Fahrstufe {b['speed_ms']:.1f} ms, Funktionen {b['function_ms']:.1f} ms, AUX {b['aux_ms']:.1f} ms")
+    log_print(f"Reserve bis {op.REFRESH_LIMIT_MS} ms: {b['headroom_ms']:.1f} ms, ca. {b['free_locos']} weitere Loks")
+    if uart != None:
+        uart.write(f">>>B,{b['locos']},{b['bits']},{b['us']},{round(b['speed_ms'])},{round(b['function_ms'])},{round(b['aux_ms'])},{round(b['headroom_ms'])},{b['free_locos']}<<<")
         
-def get_loco():
-    global loco, use_long_address, speedsteps
+# Telemetrie-Rahmen binär über UART, sonst über USB
+def send_frame(frame):
+    if uart != None:
+        uart.write(frame)
+    else:
+        sys.stdout.buffer.write(frame)
+
+def show_telemetry():
+    s = op.telemetry.stats()
+    if s == None:
+        log_print("Noch keine Strommessung")
+        return
+    log_print(f"Strom ({s['count']} Werte): min. {s['min']} mA, max. {s['max']} mA, Mittel {s['mean']} mA, p99 {s['p99']} mA")
+    send_frame(op.telemetry.stats_frame())
+
+def stream_telemetry(on, history=False):
+    global telemetry_stream
+    telemetry_stream = on
+    if history:
+        op.telemetry.streamed = 0   # ab dem ältesten Wert im Ring
+    elif on:
+        op.telemetry.streamed = op.telemetry.count
+        op.telemetry.events_streamed = op.telemetry.event_count
+
+# Versorgung (VSYS) aus dem Monitor im Hintergrund (libraries/vsys.py, Start in boot.py)
+def show_vsys():
+    s = vsys.monitor.stats() if vsys.monitor != None else None
+    if s == None:
+        log_print("Noch keine Messung der Versorgung")
+        return
+    log_print(f"VSYS {s['mv']} mV, min. {s['min']} mV, Mittel {s['mean']} mV, {s['warnings']} Warnung(en)")
+    if uart != None:
+        uart.write(f">>>U,{s['mv']},{s['min']},{s['mean']},{s['warnings']}<<<")
+
+# vom Monitor per micropython.schedule(), nicht im Interrupt
+def vsys_warning(mv):
+    log_print(f"!!! Versorgung bricht ein: {mv} mV !!!")
+    if op != None:
+        op.telemetry.mark("U")      # im Strom-Verlauf
+
+vsys.start(vsys_warning)    # läuft seit boot.py, hier nur die Warnung anhängen
+
+# Strommessung kalibrieren: K = leeres Gleis, K{mA} = bekannte Last am Gleis
+async def calibrate(load):
+    load_mA = None
+    if load != "":
+        try:
+            load_mA = int(load)
+        except ValueError:
+            log_print("Last in mA angeben, z.B. K100")
+            return
+    log_print("Kalibrieren an leerem Gleis ..." if load_mA == None else f"Kalibrieren mit {load_mA} mA Last ...")
+    try:
+        c = await op.calibrate(load_mA)
+    except (RuntimeError, ValueError) as e:
+        log_print(f"Kalibrieren fehlgeschlagen: {e}")
+        return
+    log_print(f"Ruhestrom {c['offset']} mA, Rauschen {c['noise']} mA, Steigung {c['gain']:.3f}")
+    if uart != None:
+        uart.write(f">>>K,{c['offset']},{c['noise']},{c['gain']:.3f}<<<")
+
+async def get_loco():
+    global loco, use_long_address, speedsteps, scanning, auto_sleep_timer
     clear_input_buffer()
-    op.end()
-    loco, use_long_address, speedsteps = get_loco_profile()
-    set_loco_data(loco)
-    log_print(f"Lok {loco}, {'Lange' if use_long_address else 'Kurze'} Adresse, {speedsteps} Fahrstufen")
-    op.begin()
+    scanning = True     # bis op.begin() gehört Statemachine 0 dem Servicemode (sh. button_task)
+    try:
+        op.end()
+        loco, use_long_address, speedsteps = await get_loco_profile()
+        set_loco_data(loco)
+        log_print(f"Lok {loco}, {'Lange' if use_long_address else 'Kurze'} Adresse, {speedsteps} Fahrstufen")
+        op.begin()
+    finally:
+        scanning = False
+        auto_sleep_timer = time.ticks_ms() + AUTO_SLEEP_TIME
     op.ctrl_loco(loco, use_long_address, speedsteps)
     log_print(f"Lok {loco} bereit")
     return (loco, use_long_address, speedsteps)
@@ -408,6 +460,13 @@ W{a},{d}           | Weiche {a} Richtung {d} mit d = 0: geradeaus, d != 0 abzwei
                    |
 S{a},{d}           | Signal {a} Bild (Aspect) {d}
                    |
+B                  | Bandbreite am Gleis: Refresh-Intervalle, Reserve bis zum Refresh-Limit
+T                  | Strom-Telemetrie: min., max., Mittel, p99 der letzten Sekunden
+T+ / T-            | Telemetrie-Rahmen laufend senden ein / aus (UART, sonst USB)
+TD                 | alle Messwerte im Ring als Telemetrie-Rahmen senden
+U                  | Versorgung (VSYS): aktuell, min., Mittel, Warnungen bei Einbruch
+K                  | Strommessung kalibrieren: Ruhestrom und Rauschen (Gleis ein, leer)
+K{mA}              | Strommessung kalibrieren: Steigung mit bekannter Last {mA} am Gleis
 QUIT               | Beenden, alles ausschalten
 RESET              | Layout in Grundstellung versetzen
 -------------------+---------------------------------------------------------------------
@@ -439,8 +498,8 @@ def start_display():
 def set_loco_data(addr=3, use_long_address=0, speedsteps=28):
     op.ctrl_loco(addr, use_long_address, speedsteps)
 
-def send_loco_data(addr=3, use_long_address=0, speedsteps=28):
-    time.sleep(0.5)
+async def send_loco_data(addr=3, use_long_address=0, speedsteps=28):
+    await asyncio.sleep_ms(500)
     log_print(f">>>{addr},{use_long_address},{speedsteps}<<<")
     uart.write(f">>>{addr},{use_long_address},{speedsteps}<<<")
         
@@ -469,11 +528,12 @@ def wait(millis=None):
         return True
 
 #############################PARSER###########################
-def process_input_buffer(buffer):
+async def process_input_buffer(buffer):
     cmd = None
     value = 0
     if len(buffer) > 0:
         b = buffer.lower()
+        op.telemetry.mark(b)    # Kommando im Strom-Verlauf
         if(b == 'run'):
             return True   # Kein Kommando
         
@@ -493,6 +553,32 @@ def process_input_buffer(buffer):
         elif b == '?':
             usage()
             return True
+
+        elif b == 'b': # Bandbreite am Gleis
+            show_budget()
+            return True
+
+        elif b == 't': # Strom-Telemetrie
+            show_telemetry()
+            return True
+
+        elif b == 'u': # Versorgung
+            show_vsys()
+            return True
+
+        elif b == 't+' or b == 't-':
+            stream_telemetry(b == 't+')
+            return True
+
+        elif b[:1] == 'k' and (len(b) == 1 or dccp.is_number(b[1])): # Strommessung kalibrieren
+            await calibrate(b[1:])
+            return True
+
+        elif b == 'td':
+            stream_telemetry(telemetry_stream, True)
+            for frame in op.telemetry.stream():
+                send_frame(frame)
+            return True
             
 
         log_print(buffer)
@@ -512,9 +598,9 @@ def process_input_buffer(buffer):
             if cmd == 'l':
                 if len(buffer) == 2 and buffer[1] == '?':
                     log_print(f"Scan angefordert: {buffer}")
-                    addr, use_long_address, speedsteps = get_loco()
+                    addr, use_long_address, speedsteps = await get_loco()
                     if(addr):
-                        send_loco_data(addr, use_long_address, speedsteps)
+                        await send_loco_data(addr, use_long_address, speedsteps)
                 else:
                     cnt = len(op.locos)
                     if(use_long_address == None):
@@ -538,10 +624,8 @@ def process_input_buffer(buffer):
                     if op.active_loco.address == addr:
                         log_print(f"Aktive Lok kann nicht aus Liste entfernt werden")
                     else:
-                        for l in op.locos:
-                            if l.address == addr:
-                                op.locos.remove(l)
-                                log_print(f"Keine Pakete mehr an Lok {value} senden")
+                        if op.remove_loco(addr):
+                            log_print(f"Keine Pakete mehr an Lok {addr} senden")
 
             elif cmd == 'f':
                 if len(buffer) == 1:
@@ -599,11 +683,9 @@ def process_input_buffer(buffer):
                 else:
                     cmd = 0
                 if(op.direction() != cmd):
-                    halt()
                     log_print("HALT")
-                    time.sleep(.5)
                 log_print(f"Lok {op.active_loco.address} <<- Fahrstufe {speed if speed <= max_speed else max_speed}")
-                op.drive(cmd, speed if speed <= max_speed else max_speed)
+                await op.change_direction(cmd, speed if speed <= max_speed else max_speed)
                 
         else:
             cmd = None
@@ -636,7 +718,7 @@ def poll_cmd():
     return None
 
 
-def eventloop():
+async def eventloop():
     global input_buffer, auto_sleep_timer
     answer = True
     input_buffer = poll_cmd()
@@ -648,22 +730,27 @@ def eventloop():
             log_print(input_buffer)
             for buffer in input_buffer[3:-3].split('#'):
                 if(buffer > ""):
-                    answer = process_input_buffer(buffer)
+                    answer = await process_input_buffer(buffer)
                     if (answer != True):
                         return answer
         clear_input_buffer()
     return answer
 
 
-def show_current(t):
+def show_current():
     i = op.get_current()
     duty_high_current = m.map(i, 0, 1000, 0, 4096)
     duty_low_current = 4096 - duty_high_current
     if(mcu == "XIAO-RP2040"):
         pwm_low_current.duty_u16(duty_low_current)
         pwm_high_current.duty_u16(duty_high_current)
-    elif (mcu == "RPi RP2040"):
-        response(5, 45 if oled.height > 32 else 24, f"DCC-Strom: {op.get_current():>6} mA")
+    if(__DEBUG__ > 1):
+        log_print(f"DCC-Strom: {i:>4} mA, duty_high={duty_high_current}, duty_low={duty_low_current}", end="\r")
+    return i
+
+def show_display(i):
+    if (mcu == "RPi RP2040"):
+        response(5, 45 if oled.height > 32 else 24, f"DCC-Strom: {i:>6} mA")
         if op.active_loco != None:
             if __DEBUG__ == 2:
                 print(f"'{op.active_loco.name}' [{op.active_loco.address}]")
@@ -678,31 +765,24 @@ def show_current(t):
             else:
                 s = "............."
             response(0, 18, f"{s:^20}") 
-
-        
-    if(__DEBUG__ > 1):
-        log_print(f"DCC-Strom: {i:>4} mA, duty_high={duty_high_current}, duty_low={duty_low_current}", end="\r")
         
 if mcu == "RPi RP2040":
     def response(col=0, line=0, s=""):
         text(oled, font, col, line, s) 
     
 
-def wait_t(milliseconds=None):
+async def wait_t(milliseconds=None):
     if(milliseconds != None):
-        start = time.ticks_ms()
-        stop = start + milliseconds
-        while(time.ticks_ms() <= stop):
-            op.loop()
+        await op.pause(milliseconds)
     
-def startup_sequence():
-    process_input_buffer("W1,1")
-    wait_t(300)
-    process_input_buffer("W2,1")
-    wait_t(300)
-    process_input_buffer("W2,0")
-    wait_t(300)
-    process_input_buffer("W1,0")
+async def startup_sequence():
+    await process_input_buffer("W1,1")
+    await wait_t(300)
+    await process_input_buffer("W2,1")
+    await wait_t(300)
+    await process_input_buffer("W2,0")
+    await wait_t(300)
+    await process_input_buffer("W1,0")
     
     
 
@@ -726,6 +806,8 @@ m = MAP
 op = OP(H_BRIDGE, DIR_PIN, BRAKE_PIN, PWM_PIN, POWER_PIN, ACK_PIN)
 
 op.begin()
+if vsys.monitor != None:
+    op.sampler.add_channel(vsys.monitor)   # VSYS misst der Besitzer des ADC mit (auch im Servicemode)
 current_A = op.get_current()
 
 
@@ -753,25 +835,44 @@ time.sleep(.3)
 usage()
 auto_sleep_timer = time.ticks_ms() + AUTO_SLEEP_TIME
 emergency = False
-try:
-    t = time.ticks_ms() + 20000
-    timer_current = Timer()
+scanning = False        # Lok-Suche läuft (get_loco), op ist beendet
+telemetry_stream = False
+current_mA = 0
 
-    # 1 Minute auf eine Lok warten
-    while t > time.ticks_ms():
-        I = op.get_current()
-        if I < -1:
-            log_print(f"Keine Lok erkannt ({I:>4} mA)", end="\r")
-        else:
-            log_print("\nBeginne")
-            break
-     
-    startup_sequence()
-    log_print(10 * "-")
-    timer_current.init(mode=Timer.PERIODIC, freq=1, period=333, callback=show_current)
+# Tasks: Gleis-Refresh (op.run), Kommandos, Strom, Taster, Anzeige
+
+async def command_task():
     while True:
-        
-        if time.ticks_ms() >= auto_sleep_timer:
+        if not scanning and await eventloop() == False:
+            finish()
+        await asyncio.sleep_ms(20)
+
+async def current_task():
+    global current_mA
+    while True:
+        if(not emergency and not scanning):
+            current_mA = show_current()
+        await asyncio.sleep_ms(333)
+
+async def display_task():
+    while True:
+        if(not emergency):
+            show_display(current_mA)
+        await asyncio.sleep_ms(333)
+
+async def telemetry_task():
+    while True:
+        if telemetry_stream:
+            for frame in op.telemetry.stream():
+                send_frame(frame)
+        await asyncio.sleep_ms(TELEMETRY_MS)
+
+async def button_task():
+    global emergency
+    while True:
+        # während der Lok-Suche weder schlafen noch Nothalt umschalten: op.begin() würde
+        # Statemachine 0 unter dem Servicemode neu anlegen (auf dem Programmiergleis fährt keine Lok)
+        if time.ticks_ms() >= auto_sleep_timer and not scanning:
             finish()
             machine.deepsleep()
             log_print("Erwache...")
@@ -783,38 +884,55 @@ try:
                 while (reset_pin.value() == LOW):
                     if(time.ticks_ms() - start > 2000):
                         reset()
+                    await asyncio.sleep_ms(20)
 
         if EMERG_PIN != None:
             if __DEBUG__ > 2:
                 log_print(f"{time.ticks_ms() / 1000.0:12} Nothalt-Pin ist {'HIGH' if emerg_pin.value() else 'LOW'}", end="\r")
-            if (emerg_pin.value() == LOW):
+            if (emerg_pin.value() == LOW and not scanning):
                 while (emerg_pin.value() == LOW):
-                    pass
+                    await asyncio.sleep_ms(20)
                 if(not emergency):
                     emergency = True
-                    timer_current.deinit()
-                    pwm_low_current.duty_u16(0)
-                    pwm_high_current.duty_u16(0)
+                    op.hold = True
+                    if LED_LOW_CURRENT != None:
+                        pwm_low_current.duty_u16(0)
+                    if LED_HIGH_CURRENT != None:
+                        pwm_high_current.duty_u16(0)
                     op.emergency_stop()
                 else:
-                    emergeny = False
-                    timer_current.init(mode=Timer.PERIODIC, freq=1, period=333, callback=show_current)
+                    emergency = False
+                    op.hold = False
                     op.begin()
 
-            
         if rp2.bootsel_button():
             finish()
             raise(RuntimeError("BootSel - Abbruch"))
-        if(not emergency):
-            op.loop()
-        if eventloop() == False:
-            finish()
-        idle()
+        await asyncio.sleep_ms(20)
 
+async def main():
+    refresh = asyncio.create_task(op.run())
+    t = time.ticks_ms() + 20000
+
+    # 1 Minute auf eine Lok warten
+    while t > time.ticks_ms():
+        present, I = op.loco_present()
+        if not present:
+            log_print(f"Keine Lok erkannt ({I:>4} mA)", end="\r")
+        else:
+            log_print("\nBeginne")
+            break
+        await asyncio.sleep_ms(100)
+     
+    await startup_sequence()
+    log_print(10 * "-")
+    await asyncio.gather(refresh, command_task(), current_task(), display_task(), telemetry_task(), button_task())
+
+try:
+    asyncio.run(main())
         
 except KeyboardInterrupt:
     finish()
     raise(KeyboardInterrupt("Benutzer hat abgebrochen"))
 
 finish()
-